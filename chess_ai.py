@@ -5,11 +5,38 @@ Created on Wed Mar 24 11:26:24 2021
 @author: Zach
 """
 
+import hashlib
+import json
+import os
 import random as rn
+import re
+import threading
+import time
+from collections import Counter, namedtuple
 from copy import copy
+from multiprocessing import Pool
 
+import numpy as np
 
-__all__ = ['getRandomMove', 'getBestMove']
+from chess_book import OpeningBook, readPGNGames, writeBook
+from chess_cache import TranspositionTable, SharedTranspositionTable
+from chess_cache import FileTranspositionTable, EvalCache
+from chess_cache import EXACT, LOWER_BOUND, UPPER_BOUND
+import chess_board
+from chess_board import setPieceScores, setAccumulatorRows
+from chess_engine import GameState, ZOBRIST_STATE_KEYS
+from chess_nnue import Network
+from chess_tablebase import loadTablebase, getTablebaseKey
+
+
+__all__ = ['getRandomMove', 'getBestMove', 'startSearch', 'startPondering',
+           'startAnalysis', 'BackgroundSearch', 'BackgroundAnalysis',
+           'SearchCancelled', 'iterateSearch', 'getMoveSquares',
+           'getBestMoves', 'getMateLine',
+           'solveMatesFromFile', 'getLazySMPMove', 'setTranspositionTable',
+           'useCacheFile', 'closeCacheFile', 'useOpeningBook',
+           'closeOpeningBook', 'buildOpeningBook', 'useTablebase',
+           'loadEvalWeights', 'useNetwork', 'benchmarkSearchOptions']
 
 PIECE_SCORE = dict(
     King = 9000,
@@ -22,6 +49,348 @@ PIECE_SCORE = dict(
 CHECKMATE = PIECE_SCORE['King'] + 1
 STALEMATE = 0
 MAX_DEPTH = 3
+MAX_PLY = 64  # Scores within MAX_PLY of CHECKMATE are mate scores.
+
+# Switches for the selective search techniques.  Each can be turned on
+# independently; see benchmarkSearchOptions() for measuring them.
+SEARCH_OPTIONS = dict(
+    nullMove = False,
+    lateMoveReductions = False,
+    futilityPruning = False,
+    quiescence = False,
+    batchEvaluation = False,
+)
+NULL_MOVE_REDUCTION = 2
+LMR_FULL_DEPTH_MOVES = 3  # Number of moves searched before reducing.
+LMR_MIN_DEPTH = 3
+LMR_REDUCTION = 1
+FUTILITY_MARGIN = {  # Depth: margin
+    1: 3,
+    2: 5,
+}
+NULL_WINDOW = 0.01
+# Pawn structure terms, in pawns, for scorePawnStructure().
+PAWN_STRUCTURE = dict(
+    doubled = -0.25,   # For each Pawn on a file after the first.
+    isolated = -0.2,   # No friendly Pawns on the files next to it.
+    backward = -0.15,  # Can't be supported and can't safely advance.
+)
+# Piece activity terms, in pawns, for scoreActivity().
+ACTIVITY_SCORE = dict(
+    mobility = 0.03,  # For each non-Pawn move.
+    center = 0.05,    # For each attack on d4, e4, d5, or e5.
+    kingZone = 0.08,  # For each attack on the enemy King or next to it.
+)
+MOP_UP_SCORE = dict(
+    edge = 0.1,    # Per square the lone King is from the center.
+    kings = 0.05,  # Per square the Kings are closer than opposite corners.
+    box = 0.02,    # Per square the lone King is cut off from.
+)
+MOP_UP_PIECES = ('Queen', 'Rook')  # Pieces that mate a lone King easily.
+CENTER_SQUARES = (27, 28, 35, 36)  # 8*rank + file of d5, e5, d4, and e4.
+PASSED_PAWN_BONUS = {  # Ranks from promotion: bonus
+    1: 0.8,
+    2: 0.6,
+    3: 0.4,
+    4: 0.25,
+    5: 0.15,
+    6: 0.1,
+}
+# Material and piece-square scores, in centipawns, for the middlegame and
+# endgame.  The tables are from White's side of the board, one row per
+# rank from the 8th rank down, and are flipped for Black.  Boards keep
+# running totals of them (see makePieceScores()), which scoreBoard()
+# blends by game phase.
+MATERIAL_SCORE = dict(  # Piece: (middlegame, endgame)
+    King = (0, 0),
+    Queen = (900, 900),
+    Rook = (500, 520),
+    Bishop = (310, 320),
+    Knight = (300, 280),
+    Pawn = (100, 120),
+)
+PHASE_WEIGHT = dict(  # The phase is MAX_PHASE with all pieces on the board.
+    Queen = 4,
+    Rook = 2,
+    Bishop = 1,
+    Knight = 1,
+)
+MAX_PHASE = 24
+PROMOTION_BONUS = 800  # For a Pawn that can promote next move.
+PAWN_TABLE = (
+    (  0,   0,   0,   0,   0,   0,   0,   0),
+    ( 50,  50,  50,  50,  50,  50,  50,  50),
+    ( 10,  10,  20,  30,  30,  20,  10,  10),
+    (  5,   5,  10,  25,  25,  10,   5,   5),
+    (  0,   0,   0,  20,  20,   0,   0,   0),
+    (  5,  -5, -10,   0,   0, -10,  -5,   5),
+    (  5,  10,  10, -20, -20,  10,  10,   5),
+    (  0,   0,   0,   0,   0,   0,   0,   0),
+)
+PAWN_ENDGAME_TABLE = (
+    (  0,   0,   0,   0,   0,   0,   0,   0),
+    ( 80,  80,  80,  80,  80,  80,  80,  80),
+    ( 50,  50,  50,  50,  50,  50,  50,  50),
+    ( 30,  30,  30,  30,  30,  30,  30,  30),
+    ( 20,  20,  20,  20,  20,  20,  20,  20),
+    ( 10,  10,  10,  10,  10,  10,  10,  10),
+    ( 10,  10,  10,  10,  10,  10,  10,  10),
+    (  0,   0,   0,   0,   0,   0,   0,   0),
+)
+KNIGHT_TABLE = (
+    (-50, -40, -30, -30, -30, -30, -40, -50),
+    (-40, -20,   0,   0,   0,   0, -20, -40),
+    (-30,   0,  10,  15,  15,  10,   0, -30),
+    (-30,   5,  15,  20,  20,  15,   5, -30),
+    (-30,   0,  15,  20,  20,  15,   0, -30),
+    (-30,   5,  10,  15,  15,  10,   5, -30),
+    (-40, -20,   0,   5,   5,   0, -20, -40),
+    (-50, -40, -30, -30, -30, -30, -40, -50),
+)
+BISHOP_TABLE = (
+    (-20, -10, -10, -10, -10, -10, -10, -20),
+    (-10,   0,   0,   0,   0,   0,   0, -10),
+    (-10,   0,   5,  10,  10,   5,   0, -10),
+    (-10,   5,   5,  10,  10,   5,   5, -10),
+    (-10,   0,  10,  10,  10,  10,   0, -10),
+    (-10,  10,  10,  10,  10,  10,  10, -10),
+    (-10,   5,   0,   0,   0,   0,   5, -10),
+    (-20, -10, -10, -10, -10, -10, -10, -20),
+)
+ROOK_TABLE = (
+    (  0,   0,   0,   0,   0,   0,   0,   0),
+    (  5,  10,  10,  10,  10,  10,  10,   5),
+    ( -5,   0,   0,   0,   0,   0,   0,  -5),
+    ( -5,   0,   0,   0,   0,   0,   0,  -5),
+    ( -5,   0,   0,   0,   0,   0,   0,  -5),
+    ( -5,   0,   0,   0,   0,   0,   0,  -5),
+    ( -5,   0,   0,   0,   0,   0,   0,  -5),
+    (  0,   0,   0,   5,   5,   0,   0,   0),
+)
+QUEEN_TABLE = (
+    (-20, -10, -10,  -5,  -5, -10, -10, -20),
+    (-10,   0,   0,   0,   0,   0,   0, -10),
+    (-10,   0,   5,   5,   5,   5,   0, -10),
+    ( -5,   0,   5,   5,   5,   5,   0,  -5),
+    (  0,   0,   5,   5,   5,   5,   0,  -5),
+    (-10,   5,   5,   5,   5,   5,   0, -10),
+    (-10,   0,   5,   0,   0,   0,   0, -10),
+    (-20, -10, -10,  -5,  -5, -10, -10, -20),
+)
+KING_TABLE = (
+    (-30, -40, -40, -50, -50, -40, -40, -30),
+    (-30, -40, -40, -50, -50, -40, -40, -30),
+    (-30, -40, -40, -50, -50, -40, -40, -30),
+    (-30, -40, -40, -50, -50, -40, -40, -30),
+    (-20, -30, -30, -40, -40, -30, -30, -20),
+    (-10, -20, -20, -20, -20, -20, -20, -10),
+    ( 20,  20,   0,   0,   0,   0,  20,  20),
+    ( 20,  30,  10,   0,   0,  10,  30,  20),
+)
+KING_ENDGAME_TABLE = (
+    (-50, -40, -30, -20, -20, -30, -40, -50),
+    (-30, -20, -10,   0,   0, -10, -20, -30),
+    (-30, -10,  20,  30,  30,  20, -10, -30),
+    (-30, -10,  30,  40,  40,  30, -10, -30),
+    (-30, -10,  30,  40,  40,  30, -10, -30),
+    (-30, -10,  20,  30,  30,  20, -10, -30),
+    (-30, -30,   0,   0,   0,   0, -30, -30),
+    (-50, -30, -30, -30, -30, -30, -30, -50),
+)
+PIECE_SQUARE_TABLES = dict(  # Piece: (middlegame table, endgame table)
+    King = (KING_TABLE, KING_ENDGAME_TABLE),
+    Queen = (QUEEN_TABLE, QUEEN_TABLE),
+    Rook = (ROOK_TABLE, ROOK_TABLE),
+    Bishop = (BISHOP_TABLE, BISHOP_TABLE),
+    Knight = (KNIGHT_TABLE, KNIGHT_TABLE),
+    Pawn = (PAWN_TABLE, PAWN_ENDGAME_TABLE),
+)
+BATCH_PIECES = 'PNBRQK'  # Order of the pieces in encoded boards.
+PROMOTION_CODES = 'QRBN'  # Order of promotion pieces in move codes.
+PROMOTION_CHOICES = 'qrbk'  # For GameState.promote(); 'k' is a Knight.
+NO_MOVE = 0  # Move code for no move, since a move can't end where it started.
+BOOK_PLY = 20  # Number of plies from the start of each game put in the book.
+SAN_MOVE = re.compile(  # Piece, start file and rank, end, and promotion.
+    r'([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?')
+# Tuned evaluation weights written by chess_tuning, loaded at import if
+# the file exists.
+EVAL_WEIGHTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 'eval_weights.json')
+
+def makePieceScores():
+    """
+    Makes the arguments for chess_board.setPieceScores() from
+    MATERIAL_SCORE, PIECE_SQUARE_TABLES, PHASE_WEIGHT, and PIECE_SCORE.
+
+    Each piece's score on a square is its material plus its table
+    entry, with PROMOTION_BONUS for Pawns one step from promoting.
+    """
+    pieceSquareScores = {}
+    pieceValues = {}
+    for name, (middlegameTable, endgameTable) in PIECE_SQUARE_TABLES.items():
+        symbol = 'N' if name == 'Knight' else name[0]
+        middlegameMaterial, endgameMaterial = MATERIAL_SCORE[name]
+        for color, sign in (('w', 1), ('b', -1)):
+            scores = []
+            for file in range(8):
+                scores.append([])
+                for rank in range(8):
+                    # Black's tables are flipped top to bottom.
+                    row = rank if color == 'w' else 7 - rank
+                    middlegame = (middlegameMaterial
+                                  + middlegameTable[row][file])
+                    endgame = endgameMaterial + endgameTable[row][file]
+                    if name == 'Pawn' and row == 1:
+                        middlegame += PROMOTION_BONUS
+                        endgame += PROMOTION_BONUS
+                    scores[file].append((sign * middlegame, sign * endgame))
+            pieceSquareScores[color + symbol] = scores
+            pieceValues[color + symbol] = sign * PIECE_SCORE[name]
+
+    return pieceSquareScores, PHASE_WEIGHT, pieceValues
+
+
+def makeBatchTables():
+    """
+    Makes the NumPy tables used by scoreBoards() from the scores set
+    with chess_board.setPieceScores(). Call again if they change.
+
+    Returns the middlegame and endgame scores and the phase weights,
+    indexed by piece code (see encodeBoard()) and then square.
+    """
+    middlegame = np.zeros((13, 64), dtype=np.int64)
+    endgame = np.zeros((13, 64), dtype=np.int64)
+    phase = np.zeros(13, dtype=np.int64)
+    for code in range(1, 13):
+        color = 'w' if code <= 6 else 'b'
+        symbol = BATCH_PIECES[(code - 1) % 6]
+        scores = chess_board.PIECE_SQUARE_SCORES[color + symbol]
+        for file in range(8):
+            for rank in range(8):
+                middlegame[code, 8*rank + file] = scores[file][rank][0]
+                endgame[code, 8*rank + file] = scores[file][rank][1]
+        name = dict(P='Pawn', N='Knight', B='Bishop', R='Rook', Q='Queen',
+                    K='King')[symbol]
+        phase[code] = chess_board.PHASE_WEIGHTS.get(name, 0)
+
+    return middlegame, endgame, phase
+
+
+def loadEvalWeights(filename):
+    """
+    Replaces the material, piece-square, promotion, and Pawn structure
+    scores with the ones in a weights file (see chess_tuning). Terms
+    missing from the file are left as they are.
+
+    The scores cached and the search results stored with the old
+    weights are cleared. Boards keep running totals of the old scores
+    until their refresh_piece_scores() is called.
+    """
+    global PROMOTION_BONUS, batchTables
+    with open(filename) as file:
+        weights = json.load(file)
+    for name, scores in weights.get('MATERIAL_SCORE', {}).items():
+        MATERIAL_SCORE[name] = tuple(scores)
+    for name, tables in weights.get('PIECE_SQUARE_TABLES', {}).items():
+        PIECE_SQUARE_TABLES[name] = tuple(tuple(map(tuple, table))
+                                          for table in tables)
+    PROMOTION_BONUS = weights.get('PROMOTION_BONUS', PROMOTION_BONUS)
+    PAWN_STRUCTURE.update(weights.get('PAWN_STRUCTURE', {}))
+    PASSED_PAWN_BONUS.update(
+        (int(distance), bonus)
+        for distance, bonus in weights.get('PASSED_PAWN_BONUS', {}).items())
+
+    setPieceScores(*makePieceScores())
+    batchTables = makeBatchTables()
+    evalCache.clear()
+    pawnHashTable.clear()
+    clearTranspositionTable()
+
+
+def getEvalKey():
+    """
+    Returns a 64-bit hash of what the search's scores depend on: the
+    evaluation weights, including any loaded from a weights file, the
+    network in use, and SEARCH_OPTIONS. Cache files (see useCacheFile())
+    are marked with it, so one isn't used with a different evaluation.
+    """
+    config = dict(
+        MATERIAL_SCORE = MATERIAL_SCORE,
+        PIECE_SQUARE_TABLES = PIECE_SQUARE_TABLES,
+        PROMOTION_BONUS = PROMOTION_BONUS,
+        PAWN_STRUCTURE = PAWN_STRUCTURE,
+        PASSED_PAWN_BONUS = PASSED_PAWN_BONUS,
+        ACTIVITY_SCORE = ACTIVITY_SCORE,
+        MOP_UP_SCORE = MOP_UP_SCORE,
+        network = None if network is None else network.digest,
+        SEARCH_OPTIONS = SEARCH_OPTIONS,
+    )
+    digest = hashlib.blake2b(json.dumps(config, sort_keys=True).encode(),
+                             digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def clearTranspositionTable():
+    """
+    Clears the transposition table after the evaluation changes. A cache
+    file is marked with the new evaluation's key.
+    """
+    if isinstance(transpositionTable, FileTranspositionTable):
+        transpositionTable.set_eval_key(getEvalKey())
+    else:
+        transpositionTable.clear()
+
+
+setPieceScores(*makePieceScores())
+batchTables = makeBatchTables()
+transpositionTable = TranspositionTable()
+evalCache = EvalCache()
+pawnHashTable = EvalCache(2**14)  # Indexed by the Pawn key.
+openingBook = None  # Set by useOpeningBook().
+tablebases = {}  # Signature: Tablebase, added by useTablebase().
+network = None  # Set by useNetwork().
+if os.path.exists(EVAL_WEIGHTS_FILE):
+    loadEvalWeights(EVAL_WEIGHTS_FILE)
+
+AnalysisLine = namedtuple('AnalysisLine', ['move', 'score', 'line'])
+SearchInfo = namedtuple('SearchInfo', ['depth', 'score', 'nodes', 'nps',
+                                       'move', 'line'])
+
+
+class SearchCancelled(Exception):
+    """Raised inside a search when its stop event is set."""
+
+
+class SearchState(threading.local):
+    """
+    The state of the search running in the current thread.
+
+    Each thread gets its own copy, so searches can run in background
+    threads at the same time. The transposition table is shared.
+    """
+    def __init__(self):
+        self.nextMove = None  # Best move found at the root.
+        self.score = None  # Its score, positive is good for White.
+        self.pvTable = {}  # Ply: best line of moves found from that ply.
+        self.attackInfo = {}  # Ply: AttackInfo of the moves made there.
+        self.stopEvent = None  # threading.Event that cancels the search.
+        # Node counters for instrumenting the search.
+        self.nodeCounts = dict(
+            nodes = 0,
+            nullMoveCutoffs = 0,
+            lateMoveReductions = 0,
+            lateMoveResearches = 0,
+            futilityPrunes = 0,
+            tableHits = 0,
+            tableCutoffs = 0,
+            quiescenceNodes = 0,
+            seePrunes = 0,
+            batchEvaluations = 0,
+            tablebaseHits = 0,
+        )
+
+
+searchState = SearchState()
 
 
 def getRandomMove(validMoves):
@@ -67,21 +436,402 @@ def getBestMinMaxMove(gs, validMoves):
     return bestPlayerMove
 
 
-def getBestMove(gs):
+def getBestMove(gs, depth=MAX_DEPTH):
     """Helper function to make the first recursive call."""
-    global nextMove
     gs = copy(gs)
     validMoves = gs.valid_moves
-    nextMove = None
+    searchState.nextMove = None
+    searchState.score = None  # Book moves aren't scored.
+    resetNodeCounts()
+    bookMove = getBookMove(gs)
+    if bookMove is not None:
+        searchState.nextMove = bookMove
+        searchState.pvTable[0] = [bookMove]
+        return bookMove
+
+    transpositionTable.new_search()
     rn.shuffle(validMoves)
-    getNegaMaxAlphaBetaMove(gs, validMoves, MAX_DEPTH, -CHECKMATE,
-                            CHECKMATE, 1 if gs.white_to_move else -1)
-    return nextMove
+    turnMultiplier = 1 if gs.white_to_move else -1
+    searchState.score = turnMultiplier * getNegaMaxAlphaBetaMove(
+        gs, validMoves, depth, -CHECKMATE, CHECKMATE, turnMultiplier)
+    return searchState.nextMove
+
+
+def startSearch(gs, depth=MAX_DEPTH):
+    """
+    Starts looking for the best move in a background thread and returns
+    the BackgroundSearch.
+    """
+    return BackgroundSearch(gs, depth)
+
+
+def startPondering(gs, search, depth=MAX_DEPTH):
+    """
+    Starts searching the position after the opponent's expected reply,
+    as predicted by the finished BackgroundSearch that found the move
+    just played, while the opponent thinks. Returns the BackgroundSearch,
+    or None if there isn't a reply to expect.
+
+    If the opponent plays the expected reply (ponder_hit()), the search
+    can be kept and its move used, otherwise it should be cancelled.
+    Either way, the transposition table keeps what it found.
+    """
+    if search is None or search.reply_code == NO_MOVE:
+        return None
+
+    return BackgroundSearch(gs, depth, search.reply_code)
+
+
+class BackgroundSearch():
+    """
+    Runs getBestMove() in a background thread so the caller, e.g. the
+    Pygame main loop, can keep going while the AI thinks.
+
+    The search works on its own copy of the position, made from the
+    game state's FEN, so the game state can be drawn and changed while
+    the search runs. Poll done() to find out when the search is over,
+    then use get_move() to get the move found. cancel() stops the search
+    at its next node.
+
+    With a ponder code, the search plays that move first and searches
+    the position after it. A finished search also saves the code of the
+    reply it expects to its move in reply_code, for startPondering().
+    """
+    def __init__(self, gs, depth=MAX_DEPTH, ponderCode=NO_MOVE):
+        self.fen = gs.get_fen()
+        self.depth = depth
+        self.ponder_code = ponderCode
+        self.move_code = NO_MOVE
+        self.reply_code = NO_MOVE
+        self.cancelled = False
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        """Searches the position. Runs in the background thread."""
+        searchState.stopEvent = self.stop_event
+        gs = GameState(self.fen)
+        gs.valid_moves = gs.get_valid_moves()
+        if self.ponder_code != NO_MOVE:
+            ponderMove = findMove(gs, gs.valid_moves, self.ponder_code)
+            if ponderMove is None:
+                return
+            gs.make_move(ponderMove)
+            gs.valid_moves = gs.get_valid_moves()
+        try:
+            move = getBestMove(gs, self.depth)
+        except SearchCancelled:
+            self.cancelled = True
+            return
+
+        if move is None:
+            return
+        self.move_code = getMoveCode(move)
+        # The expected reply is the next move of the principal variation,
+        # or the best move the table has for the position after the move.
+        line = searchState.pvTable.get(0, [])
+        if len(line) > 1:
+            self.reply_code = getMoveCode(line[1])
+        else:
+            gs.make_move(move)
+            entry = transpositionTable.probe(gs.get_position_key())
+            if entry is not None:
+                self.reply_code = entry.move
+
+    def done(self):
+        """Returns True once the search has finished or been cancelled."""
+        return not self.thread.is_alive()
+
+    def cancel(self):
+        """Stops the search. It won't have a move afterwards."""
+        self.stop_event.set()
+
+    def ponder_hit(self, move):
+        """
+        Returns True if the search is pondering the position after the
+        move, so it can be kept once the move has been played.
+        """
+        return (self.ponder_code != NO_MOVE
+                and getMoveCode(move) == self.ponder_code)
+
+    def get_move(self, gs):
+        """
+        Returns the move found by a finished search as one of the game
+        state's valid moves, or None if no move was found.
+        """
+        if not self.done() or self.cancelled or self.move_code == NO_MOVE:
+            return None
+
+        return findMove(gs, gs.valid_moves, self.move_code)
+
+
+def startAnalysis(gs, depth=MAX_DEPTH):
+    """
+    Starts an iterative deepening search of the position in a background
+    thread and returns the BackgroundAnalysis.
+    """
+    return BackgroundAnalysis(gs, depth)
+
+
+class BackgroundAnalysis(BackgroundSearch):
+    """
+    BackgroundSearch that deepens one ply at a time with
+    iterateSearch(), so its best move can be used before it finishes,
+    e.g. for hints. info is the SearchInfo of the deepest search
+    finished so far, or None.
+    """
+    def __init__(self, gs, depth=MAX_DEPTH):
+        self.info = None
+        super().__init__(gs, depth)
+
+    def run(self):
+        """Searches the position. Runs in the background thread."""
+        searchState.stopEvent = self.stop_event
+        try:
+            for info in iterateSearch(GameState(self.fen), self.depth):
+                self.info = info
+                self.move_code = info.move
+        except SearchCancelled:
+            self.cancelled = True
+
+    def get_move(self, gs):
+        """
+        Returns the best move found so far as one of the game state's
+        valid moves, or None if no depth has been finished.
+        """
+        if self.move_code == NO_MOVE:
+            return None
+
+        return findMove(gs, gs.valid_moves, self.move_code)
+
+
+def setTranspositionTable(table):
+    """
+    Makes the search use the given table, e.g. a
+    SharedTranspositionTable, as its transposition table.
+    """
+    global transpositionTable
+    transpositionTable = table
+
+
+def useCacheFile(filename, size=2**18):
+    """
+    Keeps the transposition table in a memory-mapped file, so searches
+    of positions seen in earlier runs start with their results.
+
+    The file is marked with the key of the evaluation in use (see
+    getEvalKey()), and started over if it was written with another.
+    Changing SEARCH_OPTIONS while the file is open isn't noticed.
+    """
+    closeCacheFile()
+    setTranspositionTable(FileTranspositionTable(filename, size,
+                                                 getEvalKey()))
+
+
+def closeCacheFile():
+    """
+    Saves and closes the cache file opened with useCacheFile(), if
+    any, and goes back to a transposition table in memory.
+    """
+    if isinstance(transpositionTable, FileTranspositionTable):
+        transpositionTable.close()
+        setTranspositionTable(TranspositionTable())
+
+
+def useOpeningBook(filename):
+    """
+    Makes getBestMove() play moves from the opening book file (see
+    buildOpeningBook()) while the game is in the book.
+    """
+    global openingBook
+    closeOpeningBook()
+    openingBook = OpeningBook(filename)
+
+
+def closeOpeningBook():
+    """Closes the book opened with useOpeningBook(), if any."""
+    global openingBook
+    if openingBook is not None:
+        openingBook.close()
+        openingBook = None
+
+
+def useTablebase(filename):
+    """
+    Makes the search use the endgame tablebase in the file (see
+    chess_tablebase.generateTablebaseFiles()) for positions with its
+    material.
+    """
+    table = loadTablebase(filename)
+    tablebases[table.signature] = table
+
+
+def useNetwork(filename):
+    """
+    Makes the search score positions with the neural network in the
+    file (see chess_nnue) instead of the piece-square scores, or with
+    the piece-square scores again if filename is None.
+
+    The scores cached and the search results stored with the old
+    evaluator are cleared.
+    """
+    global network
+    network = None if filename is None else Network(filename)
+    setAccumulatorRows({} if network is None
+                       else network.get_accumulator_rows())
+    evalCache.clear()
+    pawnHashTable.clear()
+    clearTranspositionTable()
+
+
+def probeTablebases(gs, ply):
+    """
+    Returns the exact score of the position from the side to move's
+    point of view if it is in a tablebase in use, or None if it isn't.
+
+    Mates are scored like mates found by the search, counting from the
+    root. Tablebases don't know about castling, so positions that can
+    still castle aren't looked up.
+    """
+    key = getTablebaseKey(gs.board)
+    if (key is None or key[0] not in tablebases
+            or gs.get_castling_rights()):
+        return None
+
+    signature, strongColor, squares = key
+    strongToMove = (strongColor == 'white') == gs.white_to_move
+    plies = tablebases[signature].probe(squares, strongToMove)
+    if plies is None:
+        return STALEMATE
+    elif strongToMove:
+        return CHECKMATE - ply - plies
+    return -CHECKMATE + ply + plies
+
+
+def getBookMove(gs):
+    """
+    Returns one of the game state's valid moves from the opening book,
+    or None if there is no book or the position isn't in it.
+    """
+    if openingBook is None:
+        return None
+
+    code = openingBook.choose_move(gs.get_position_key())
+    if code is None:
+        return None
+
+    return findMove(gs, gs.valid_moves, code)
+
+
+def buildOpeningBook(pgnFilename, bookFilename, maxPly=BOOK_PLY,
+                     minCount=1):
+    """
+    Builds an opening book file from the games in a PGN file.
+
+    The games are read one at a time, and each move in the first maxPly
+    plies is counted under its position's key. Moves played fewer than
+    minCount times are left out. Games set up from a FEN are skipped,
+    and a game stops counting at a move that can't be read. Returns the
+    number of moves in the book.
+    """
+    counts = Counter()
+    with open(pgnFilename, encoding='utf-8', errors='replace') as file:
+        for headers, sanMoves in readPGNGames(file):
+            if 'FEN' in headers:
+                continue
+            gs = GameState()
+            for san in sanMoves[:maxPly]:
+                gs.valid_moves = gs.get_valid_moves()
+                move = findSANMove(gs, gs.valid_moves, san)
+                if move is None:
+                    break
+                counts[gs.get_position_key(), getMoveCode(move)] += 1
+                gs.make_move(move)
+
+    return writeBook(bookFilename, counts, minCount)
+
+
+def findSANMove(gs, moves, san):
+    """
+    Returns the move in moves written as san in standard algebraic
+    notation, e.g., 'Nbd7' or 'exd8=Q+', or None if there isn't one.
+    """
+    san = san.rstrip('+#!?').replace('0', 'O')
+    if san in ('O-O', 'O-O-O'):
+        for move in moves:
+            if move.contains_castle() and move.get_chess_notation(gs) == san:
+                return move
+        return None
+
+    match = SAN_MOVE.fullmatch(san)
+    if match is None:
+        return None
+    symbol, file, rank, end, promotion = match.groups()
+    for move in moves:
+        start = move.start_square.get_name()
+        if (move.piece_moved.get_symbol() == (symbol or 'P')
+                and move.end_square.get_name() == end
+                and not move.contains_castle()
+                and file in (None, start[0]) and rank in (None, start[1])):
+            if promotion is None:
+                return move
+            code = (getMoveCode(move) & 0xfff
+                    | (PROMOTION_CODES.index(promotion) + 1) << 12)
+            return findMove(gs, [move], code)
+
+    return None
+
+
+def getLazySMPMove(gs, processes=None, depth=MAX_DEPTH):
+    """
+    Finds the best move with several processes searching at once.
+
+    Every worker process searches the whole position on its own, half
+    of them one ply deeper, but they share a SharedTranspositionTable,
+    so each one uses the results the others have already stored
+    ("Lazy SMP"). The move from the deepest search is returned. Uses
+    one process per CPU unless processes is given.
+    """
+    processes = processes or os.cpu_count()
+    table = SharedTranspositionTable(transpositionTable.size)
+    try:
+        with Pool(processes, initializer=attachSharedTable,
+                  initargs=(table.name,)) as pool:
+            results = pool.map(
+                searchWithSharedTable,
+                [(gs.get_fen(), depth + i % 2) for i in range(processes)])
+    finally:
+        table.close()
+        table.unlink()
+
+    _, code = max(results)
+    return findMove(gs, gs.valid_moves, code)
+
+
+def attachSharedTable(name):
+    """
+    Initializer for getLazySMPMove()'s workers. Attaches to the shared
+    table and gives the worker its own random move order.
+    """
+    setTranspositionTable(SharedTranspositionTable(name=name))
+    rn.seed()
+
+
+def searchWithSharedTable(args):
+    """
+    Worker for getLazySMPMove(). Takes a tuple of a FEN string and a
+    depth, and returns the depth and the code of the best move found.
+    """
+    fen, depth = args
+    gs = GameState(fen)
+    gs.valid_moves = gs.get_valid_moves()
+    move = getBestMove(gs, depth)
+    return depth, NO_MOVE if move is None else getMoveCode(move)
 
 
 def getMinMaxMove(gs, validMoves, whiteToMove, depth):
     """Recursive function for finding the best AI move."""
-    global nextMove
     if depth == 0:
         return scoreMaterial(gs.board)
     
@@ -94,7 +844,7 @@ def getMinMaxMove(gs, validMoves, whiteToMove, depth):
             if score > maxScore:
                 maxScore = score
                 if depth == MAX_DEPTH:
-                    nextMove = move
+                    searchState.nextMove = move
             gs.undo_move()
             gs.undo_log.pop()
         
@@ -109,7 +859,7 @@ def getMinMaxMove(gs, validMoves, whiteToMove, depth):
             if score < minScore:
                 minScore = score
                 if depth == MAX_DEPTH:
-                    nextMove = move
+                    searchState.nextMove = move
             gs.undo_move()
             gs.undo_log.pop()
         
@@ -120,7 +870,6 @@ def getNegaMaxMove(gs, validMoves, depth, turnMultiplier):
     """
     
     """
-    global nextMove
     if depth == 0:
         return turnMultiplier * scoreBoard(gs)
     
@@ -132,7 +881,7 @@ def getNegaMaxMove(gs, validMoves, depth, turnMultiplier):
         if score > maxScore:
             maxScore = score
             if depth == MAX_DEPTH:
-                nextMove = move
+                searchState.nextMove = move
         if abs(score) == CHECKMATE:
             break
         
@@ -143,36 +892,742 @@ def getNegaMaxMove(gs, validMoves, depth, turnMultiplier):
 
 
 def getNegaMaxAlphaBetaMove(
-        gs, validMoves, depth, alpha, beta, turnMultiplier):
-    global nextMove
-    if depth == 0:
-        return turnMultiplier * scoreBoard(gs)
-    
-    # Move ordering - look at moves that put opponent in check and captures
-    # first.  Add later.
+        gs, validMoves, depth, alpha, beta, turnMultiplier, ply=0,
+        allowNullMove=True):
+    """
+    Negamax search with alpha-beta pruning.
+
+    validMoves can be None, in which case the moves are generated here.
+    The best move found at the root (ply 0) is saved to
+    searchState.nextMove, and the best line from each ply to
+    searchState.pvTable. The selective search techniques turned on in
+    SEARCH_OPTIONS are applied here, and their effect is counted in
+    searchState.nodeCounts. Raises SearchCancelled if the search's stop
+    event is set.
+    """
+    checkStopEvent()
+    searchState.nodeCounts['nodes'] += 1
+    searchState.pvTable[ply] = []
+    # Positions in a tablebase have an exact score, so aren't searched.
+    if tablebases and ply > 0:
+        score = probeTablebases(gs, ply)
+        if score is not None:
+            searchState.nodeCounts['tablebaseHits'] += 1
+            return score
+
+    if depth <= 0:
+        if SEARCH_OPTIONS['quiescence']:
+            return getQuiescenceScore(gs, alpha, beta, turnMultiplier, ply)
+        # Mating a lone King takes few pieces, so its leaves are checked
+        # for mate and stalemate, which the evaluation can't see.
+        if (recognizeEndgame(gs.board) is not None
+                and not gs.get_valid_moves()):
+            return -CHECKMATE + ply if gs.in_check else STALEMATE
+        return turnMultiplier * (scoreBoard(gs) + scoreActivity(
+            gs.board, searchState.attackInfo.get(ply - 2),
+            searchState.attackInfo.get(ply - 1)))
+
+    # Look the position up in the transposition table.  The stored best
+    # move is searched first, and a deep enough result is used right away.
+    key = gs.get_position_key()
+    entry = transpositionTable.probe(key)
+    tableMove = NO_MOVE
+    if entry is not None:
+        searchState.nodeCounts['tableHits'] += 1
+        tableMove = entry.move
+        if ply > 0 and entry.depth >= depth:
+            score = scoreFromTable(entry.score, ply)
+            if (entry.flag == EXACT
+                    or (entry.flag == LOWER_BOUND and score >= beta)
+                    or (entry.flag == UPPER_BOUND and score <= alpha)):
+                searchState.nodeCounts['tableCutoffs'] += 1
+                return score
+
+    if validMoves is None:
+        validMoves = gs.get_valid_moves()
+    searchState.attackInfo[ply] = gs.attack_info
+    inCheck = gs.in_check
+    if not validMoves:
+        return -CHECKMATE + ply if inCheck else STALEMATE
+
+    # Null-move pruning.  If passing the turn to the opponent still fails
+    # high, a real move would too.  Not safe in check or when the side to
+    # move only has pawns left, as zugzwang is common in pawn endings.
+    if (SEARCH_OPTIONS['nullMove'] and allowNullMove and ply > 0
+            and not inCheck and depth > NULL_MOVE_REDUCTION
+            and beta < CHECKMATE - MAX_PLY and hasNonPawnMaterial(gs)):
+        gs.make_null_move()
+        score = -1 * getNegaMaxAlphaBetaMove(
+            gs, None, depth - 1 - NULL_MOVE_REDUCTION, -beta,
+            -beta + NULL_WINDOW, -turnMultiplier, ply + 1, False)
+        gs.undo_null_move()
+        if score >= beta:
+            searchState.nodeCounts['nullMoveCutoffs'] += 1
+            return beta
+
+    # Batch evaluation.  At the frontier every child is a leaf, so they
+    # are all scored at once with NumPy instead of making each move.
+    # The batch doesn't recognize mop-up endgames, so they are left out,
+    # and it only knows the piece-square scores, not the network.
+    if (SEARCH_OPTIONS['batchEvaluation'] and depth == 1
+            and not SEARCH_OPTIONS['quiescence'] and network is None
+            and len(gs.board.get_pieces()) > 6):
+        return getFrontierScore(gs, validMoves, alpha, beta, turnMultiplier,
+                                ply, key)
+
+    # Futility pruning.  Near the leaves, quiet moves can't raise a
+    # static score that is far below alpha, so they aren't searched.
+    futilityScore = None
+    if (SEARCH_OPTIONS['futilityPruning'] and ply > 0 and not inCheck
+            and depth in FUTILITY_MARGIN
+            and abs(alpha) < CHECKMATE - MAX_PLY):
+        score = turnMultiplier * scoreBoard(gs) + FUTILITY_MARGIN[depth]
+        if score <= alpha:
+            futilityScore = score
+
+    originalAlpha = alpha
     maxScore = -CHECKMATE
-    if validMoves:
-        # p = Pool(len(validMoves))
-        for move in validMoves:
+    bestMove = None
+    for i, move in enumerate(orderMoves(gs, validMoves, tableMove)):
+        quiet = isQuietMove(move)
+        if futilityScore is not None and quiet:
+            searchState.nodeCounts['futilityPrunes'] += 1
+            if futilityScore > maxScore:
+                maxScore = futilityScore
+            continue
+
+        gs.make_move(move)
+        # Late-move reductions.  Quiet moves ordered late rarely turn out
+        # best, so they are searched shallower with a null window first and
+        # only searched again at full depth if they beat alpha.
+        if (SEARCH_OPTIONS['lateMoveReductions'] and quiet and not inCheck
+                and i >= LMR_FULL_DEPTH_MOVES and depth >= LMR_MIN_DEPTH
+                and not givesCheck(gs)):
+            searchState.nodeCounts['lateMoveReductions'] += 1
+            score = -1 * getNegaMaxAlphaBetaMove(
+                gs, None, depth - 1 - LMR_REDUCTION, -alpha - NULL_WINDOW,
+                -alpha, -turnMultiplier, ply + 1)
+            if score > alpha:
+                searchState.nodeCounts['lateMoveResearches'] += 1
+                score = -1 * getNegaMaxAlphaBetaMove(
+                    gs, None, depth - 1, -beta, -alpha, -turnMultiplier,
+                    ply + 1)
+        else:
+            score = -1 * getNegaMaxAlphaBetaMove(
+                gs, None, depth - 1, -beta, -alpha, -turnMultiplier, ply + 1)
+        gs.undo_move()
+        gs.undo_log.pop()
+
+        if score > maxScore:
+            maxScore = score
+            bestMove = move
+            if ply == 0:
+                searchState.nextMove = move
+        if maxScore > alpha:  # Pruning happens.
+            alpha = maxScore
+            searchState.pvTable[ply] = [move] + searchState.pvTable[ply + 1]
+        if alpha >= beta:
+            break
+
+    if maxScore <= originalAlpha:
+        flag = UPPER_BOUND
+    elif maxScore >= beta:
+        flag = LOWER_BOUND
+    else:
+        flag = EXACT
+    transpositionTable.store(
+        key, depth, scoreToTable(maxScore, ply), flag,
+        NO_MOVE if bestMove is None else getMoveCode(bestMove))
+
+    return maxScore
+
+
+def iterateSearch(gs, depth=MAX_DEPTH):
+    """
+    Searches the position one ply deeper at a time, up to depth.
+
+    Yields a SearchInfo after each depth with the depth, the score
+    (positive is good for White, as in scoreBoard()), the number of
+    nodes searched so far and nodes per second, the code of the best
+    move (see getMoveCode()), and the names of the moves in the
+    expected line. Each depth starts with the best moves stored in the
+    transposition table by the one before it.
+
+    The moves are made on the game state's board, so give it a game
+    state of its own if it runs alongside anything else.
+    """
+    gs = copy(gs)
+    turnMultiplier = 1 if gs.white_to_move else -1
+    validMoves = gs.get_valid_moves()
+    if not validMoves:
+        return
+
+    resetNodeCounts()
+    transpositionTable.new_search()
+    startTime = time.perf_counter()
+    for currentDepth in range(1, depth + 1):
+        searchState.nextMove = None
+        score = getNegaMaxAlphaBetaMove(
+            gs, validMoves, currentDepth, -CHECKMATE, CHECKMATE,
+            turnMultiplier)
+        nodes = searchState.nodeCounts['nodes']
+        seconds = time.perf_counter() - startTime
+        yield SearchInfo(
+            currentDepth, turnMultiplier * score, nodes,
+            int(nodes / seconds) if seconds > 0 else 0,
+            getMoveCode(searchState.nextMove),
+            getLineNames(gs, searchState.pvTable[0], currentDepth))
+
+
+def getFrontierScore(gs, validMoves, alpha, beta, turnMultiplier, ply, key):
+    """
+    Searches a node one ply from the leaves by scoring all of its
+    children with scoreBoards() in one batch.
+
+    Gives the same scores as searching each child to depth 0, and saves
+    the best move and line and the transposition table entry the same
+    way getNegaMaxAlphaBetaMove() does.
+    """
+    promoteToQueens(gs, validMoves)
+    searchState.nodeCounts['nodes'] += len(validMoves)
+    searchState.nodeCounts['batchEvaluations'] += 1
+    # Every child uses the same attack information, so the activity
+    # score only changes when the King moves.
+    infos = (searchState.attackInfo.get(ply - 1),
+             searchState.attackInfo.get(ply))
+    activity = np.full(len(validMoves), scoreActivity(gs.board, *infos))
+    for i, move in enumerate(validMoves):
+        if move.piece_moved.get_name() == 'King':
             gs.make_move(move)
-            nextMoves = gs.get_valid_moves()
-            score = -1 * getNegaMaxAlphaBetaMove(gs, nextMoves, depth-1, -beta,
-                                                 -alpha, -turnMultiplier)
-            if score > maxScore:
-                maxScore = score
-                if depth == MAX_DEPTH:
-                    nextMove = move
-            
+            activity[i] = scoreActivity(gs.board, *infos)
             gs.undo_move()
             gs.undo_log.pop()
-            if maxScore > alpha:  # Pruning happens.
-                alpha = maxScore
-            if alpha >= beta:
-                break
-    
+    scores = turnMultiplier * (
+        scoreBoards(encodeChildren(gs, validMoves)) + activity)
+    best = int(np.argmax(scores))
+    maxScore = float(scores[best])
+    bestMove = validMoves[best]
+    if ply == 0:
+        searchState.nextMove = bestMove
+    if maxScore > alpha:
+        searchState.pvTable[ply] = [bestMove]
+
+    if maxScore <= alpha:
+        flag = UPPER_BOUND
+    elif maxScore >= beta:
+        flag = LOWER_BOUND
+    else:
+        flag = EXACT
+    transpositionTable.store(key, 1, scoreToTable(maxScore, ply), flag,
+                             getMoveCode(bestMove))
+
     return maxScore
 
 
+def getQuiescenceScore(gs, alpha, beta, turnMultiplier, ply):
+    """
+    Searches captures and promotions until the position is quiet, so a
+    leaf isn't scored in the middle of an exchange.
+
+    The side to move can stand pat on the static score instead of
+    capturing, unless it is in check, in which case every move is
+    searched. Captures that lose material by static exchange evaluation
+    are pruned, and the rest are searched best exchange first.
+    """
+    checkStopEvent()
+    searchState.nodeCounts['quiescenceNodes'] += 1
+    moves = gs.get_valid_moves()
+    searchState.attackInfo[ply] = gs.attack_info
+    if not moves:
+        return -CHECKMATE + ply if gs.in_check else STALEMATE
+
+    if gs.in_check and ply < MAX_PLY:
+        maxScore = -CHECKMATE
+        moves = orderMoves(gs, moves)
+    else:
+        maxScore = turnMultiplier * (scoreBoard(gs) + scoreActivity(
+            gs.board, gs.attack_info, searchState.attackInfo.get(ply - 1)))
+        if maxScore >= beta or ply >= MAX_PLY:
+            return maxScore
+        promoteToQueens(gs, moves)
+        exchanges = []
+        for move in moves:
+            if isQuietMove(move) and not move.contains_enpassant():
+                continue
+            exchange = gs.static_exchange(move)
+            if exchange < 0:
+                searchState.nodeCounts['seePrunes'] += 1
+                continue
+            exchanges.append((exchange, getMoveOrderScore(move), move))
+        exchanges.sort(key=lambda exchange: exchange[:2], reverse=True)
+        moves = [move for _, _, move in exchanges]
+    alpha = max(alpha, maxScore)
+
+    for move in moves:
+        gs.make_move(move)
+        score = -1 * getQuiescenceScore(gs, -beta, -alpha, -turnMultiplier,
+                                        ply + 1)
+        gs.undo_move()
+        gs.undo_log.pop()
+        if score > maxScore:
+            maxScore = score
+        if maxScore > alpha:
+            alpha = maxScore
+        if alpha >= beta:
+            break
+
+    return maxScore
+
+
+def getBestMoves(gs, numMoves=3, depth=MAX_DEPTH):
+    """
+    Finds the best numMoves moves in the position with a single search.
+
+    Returns a list of AnalysisLine tuples, best first. Each has the
+    move, its score (positive is good for White, as in scoreBoard()),
+    and the names of the moves in the expected line, starting with the
+    move itself.
+
+    The search deepens one ply at a time. At each depth, every root
+    move is searched with alpha set to the score of the numMoves-th
+    best move so far, so only the moves that can make the list get an
+    exact score. All of the lines share the transposition table and the
+    move ordering from the earlier depths.
+    """
+    gs = copy(gs)
+    turnMultiplier = 1 if gs.white_to_move else -1
+    rootMoves = orderMoves(gs, gs.get_valid_moves())
+    searchState.attackInfo[0] = gs.attack_info
+    resetNodeCounts()
+    transpositionTable.new_search()
+    lines = []  # Lists of score, move, and line.
+    for currentDepth in range(1, depth + 1):
+        lines = []
+        for move in rootMoves:
+            if len(lines) < numMoves:
+                alpha = -CHECKMATE
+            else:
+                alpha = lines[-1][0]
+            gs.make_move(move)
+            score = -1 * getNegaMaxAlphaBetaMove(
+                gs, None, currentDepth - 1, -CHECKMATE, -alpha,
+                -turnMultiplier, 1)
+            gs.undo_move()
+            gs.undo_log.pop()
+            if score > alpha:
+                lines.append([score, move, [move] + searchState.pvTable[1]])
+                lines.sort(key=lambda line: line[0], reverse=True)
+                del lines[numMoves:]
+        # Search the best moves first at the next depth.
+        bestMoves = [line[1] for line in lines]
+        rootMoves = bestMoves + [
+            move for move in rootMoves if move not in bestMoves]
+
+    return [
+        AnalysisLine(move, turnMultiplier * score,
+                     getLineNames(gs, line, depth))
+        for score, move, line in lines
+    ]
+
+
+def getMateLine(gs, movesToMate, checksOnly=False):
+    """
+    Searches for a forced checkmate in at most movesToMate moves.
+
+    Returns the names of the moves of the mating line in algebraic
+    notation, or None if there is no such mate. The line is a shortest
+    mate, and the defending side plays the reply that holds out the
+    longest.
+
+    This is a depth-first AND/OR search rather than a scored search:
+    the attacking side needs one move that mates against every reply.
+    Like proof-number search, it tries the attacking moves that leave
+    the fewest replies first, with checks ahead of quiet moves, since
+    those take the least work to prove. If checksOnly is True, only
+    checking moves are tried for the attacking side, which is much
+    faster but misses mates that begin with a quiet move.
+    """
+    gs = copy(gs)
+    results = {}  # (Position key, moves left): mating line or None.
+    line = searchMate(gs, movesToMate, checksOnly, results)
+    if line is None:
+        return None
+
+    return getLineNames(gs, line, len(line))
+
+
+def searchMate(gs, movesLeft, checksOnly, results):
+    """
+    Finds a shortest mate in at most movesLeft moves for the side to
+    move, trying mates in one move, then two, and so on.
+
+    Returns the line as move codes (see getMoveCode()), or None if there
+    isn't a mate. Results are saved in the results dict by position key
+    and moves left. They hold codes rather than Moves, since the same
+    position can be reached with other Piece objects on its squares.
+    """
+    key = (gs.get_position_key(), movesLeft)
+    if key in results:
+        return results[key]
+    checkStopEvent()
+    searchState.nodeCounts['nodes'] += 1
+
+    candidates = []  # Moves that don't mate right away.
+    for move in orderMoves(gs, getPromotionMoves(gs, gs.get_valid_moves())):
+        gs.make_move(move)
+        if checksOnly and not givesCheck(gs):
+            replies = None
+        else:
+            replies = gs.get_valid_moves()
+            inCheck = gs.in_check
+        gs.undo_move()
+        gs.undo_log.pop()
+        if replies is None:
+            continue
+        if not replies:
+            if inCheck:
+                results[key] = [getMoveCode(move)]
+                return results[key]
+            continue  # Stalemate.
+        if movesLeft > 1:
+            candidates.append((not inCheck, len(replies), move, replies))
+
+    line = None
+    candidates.sort(key=lambda candidate: candidate[:2])
+    for depth in range(1, movesLeft):
+        for _, _, move, replies in candidates:
+            gs.make_move(move)
+            defence = searchMateDefence(gs, replies, depth, checksOnly,
+                                        results)
+            gs.undo_move()
+            gs.undo_log.pop()
+            if defence is not None:
+                line = [getMoveCode(move)] + defence
+                break
+        if line is not None:
+            break
+    results[key] = line
+
+    return line
+
+
+def searchMateDefence(gs, replies, movesLeft, checksOnly, results):
+    """
+    Checks that every reply of the defending side still gets mated in
+    movesLeft moves.
+
+    Returns the line starting with the reply that holds out the
+    longest, as move codes, or None as soon as one reply escapes the
+    mate.
+    """
+    longest = None
+    for reply in orderMoves(gs, getPromotionMoves(gs, replies)):
+        gs.make_move(reply)
+        line = searchMate(gs, movesLeft, checksOnly, results)
+        gs.undo_move()
+        gs.undo_log.pop()
+        if line is None:
+            return None
+        if longest is None or len(line) >= len(longest):
+            longest = [getMoveCode(reply)] + line
+
+    return longest
+
+
+def solveMatesFromFile(filename, movesToMate, checksOnly=False,
+                       processes=None):
+    """
+    Runs getMateLine() on every position in a file.
+
+    The file has one position per line as a FEN string. Blank lines
+    and lines starting with '#' are skipped. The positions are shared
+    out to a pool of worker processes, one per CPU unless processes is
+    given. Returns a list of (FEN, mating line) tuples in file order,
+    with None as the line of positions without a mate.
+    """
+    with open(filename) as file:
+        fens = [line.strip() for line in file
+                if line.strip() and not line.startswith('#')]
+    with Pool(processes) as pool:
+        lines = pool.map(solveMateFromFEN,
+                         [(fen, movesToMate, checksOnly) for fen in fens])
+
+    return list(zip(fens, lines))
+
+
+def solveMateFromFEN(args):
+    """
+    Worker for solveMatesFromFile(). Takes a tuple of a FEN string,
+    movesToMate, and checksOnly.
+    """
+    fen, movesToMate, checksOnly = args
+    return getMateLine(GameState(fen), movesToMate, checksOnly)
+
+
+def getLineNames(gs, line, length):
+    """
+    Plays through a line of moves, or of move codes (see getMoveCode()),
+    and returns the names of the moves in algebraic notation.
+
+    If the line is shorter than length, for example because the search
+    of its last position was cut short by the transposition table, it
+    is continued with the best moves stored in the table. The moves are
+    undone afterwards.
+    """
+    names = []
+    line = list(line)
+    for _ in range(length):
+        gs.valid_moves = gs.get_valid_moves()
+        if line:
+            move = line.pop(0)
+            if isinstance(move, int):  # A move code.
+                move = findMove(gs, gs.valid_moves, move)
+        else:
+            entry = transpositionTable.probe(gs.get_position_key())
+            if entry is None:
+                break
+            move = findMove(gs, gs.valid_moves, entry.move)
+            if move is None:
+                break
+        names.append(move.get_chess_notation(gs))
+        gs.make_move(move)
+    for _ in names:
+        gs.undo_move()
+        gs.undo_log.pop()
+    gs.valid_moves = gs.get_valid_moves()
+
+    return names
+
+
+def getMoveCode(move):
+    """
+    Returns an integer that identifies the move in its position.
+
+    The files and ranks of the start and end squares take three bits
+    each, and the promotion piece, if any, is stored above them. The
+    caches store move codes instead of Move objects, since a Move
+    belongs to a particular board.
+    """
+    start, end = move.start_square, move.end_square
+    code = start.file << 9 | start.rank << 6 | end.file << 3 | end.rank
+    if move.contains_promotion():
+        symbol = move.promotion_piece.get_symbol()
+        code |= (PROMOTION_CODES.index(symbol) + 1) << 12
+
+    return code
+
+
+def findMove(gs, moves, code):
+    """
+    Returns the move in moves with the given move code, or None.
+
+    If the code has a promotion piece that the move doesn't have yet,
+    the move is promoted to that piece.
+    """
+    promotion = code >> 12
+    for move in moves:
+        if getMoveCode(move) & 0xfff == code & 0xfff:
+            if promotion and not move.contains_promotion():
+                symbol = PROMOTION_CODES[promotion - 1]
+                gs.promote('k' if symbol == 'N' else symbol.lower(), move)
+            if getMoveCode(move) == code:
+                return move
+
+    return None
+
+
+def getMoveSquares(board, code):
+    """Returns the start and end squares of a move code on the board."""
+    return (board.squares[code >> 9 & 7, code >> 6 & 7],
+            board.squares[code >> 3 & 7, code & 7])
+
+
+def scoreToTable(score, ply):
+    """
+    Converts a mate score to be relative to the current ply instead of
+    the root, so it can be stored in the transposition table.
+    """
+    if score > CHECKMATE - MAX_PLY:
+        return score + ply
+    elif score < -CHECKMATE + MAX_PLY:
+        return score - ply
+
+    return score
+
+
+def scoreFromTable(score, ply):
+    """Converts a mate score from the transposition table back."""
+    if score > CHECKMATE - MAX_PLY:
+        return score - ply
+    elif score < -CHECKMATE + MAX_PLY:
+        return score + ply
+
+    return score
+
+
+def orderMoves(gs, moves, tableMove=NO_MOVE):
+    """
+    Sorts moves so the likely best ones are searched first.
+
+    The best move from the transposition table comes first, then
+    promotions and captures that don't lose material by static exchange
+    evaluation, ordered by most valuable victim/least valuable attacker
+    (MVV-LVA), then quiet moves, then losing captures. Pawns reaching
+    the last rank are promoted to Queens. The sort is stable, so
+    shuffled moves stay shuffled within each group.
+    """
+    promoteToQueens(gs, moves)
+    losingCaptures = set()
+    for move in moves:
+        if (move.piece_captured is not None and not move.contains_promotion()
+                and gs.static_exchange(move) < 0):
+            losingCaptures.add(move)
+    moves.sort(key=lambda move: (move not in losingCaptures,
+                                 getMoveOrderScore(move)),
+               reverse=True)
+    if tableMove != NO_MOVE:
+        for i, move in enumerate(moves):
+            if getMoveCode(move) == tableMove:
+                moves.insert(0, moves.pop(i))
+                break
+
+    return moves
+
+
+def promoteToQueens(gs, moves):
+    """
+    Promotes the Pawns reaching the last rank in moves to Queens, since
+    the AI doesn't consider underpromotions.
+    """
+    for move in moves:
+        pieceMoved = move.piece_moved
+        if (pieceMoved.get_name() == 'Pawn'
+                and move.promotion_piece is None
+                and move.end_square.get_rank()
+                    == pieceMoved.get_promotion_rank()):
+            gs.promote('q', move)
+
+
+def getPromotionMoves(gs, moves):
+    """
+    Returns the moves with each Pawn move to the last rank replaced by
+    one move for each piece it can promote to, for the searches that
+    have to consider underpromotions.
+    """
+    allMoves = []
+    for move in moves:
+        pieceMoved = move.piece_moved
+        if (pieceMoved.get_name() == 'Pawn'
+                and move.promotion_piece is None
+                and move.end_square.get_rank()
+                    == pieceMoved.get_promotion_rank()):
+            for choice in PROMOTION_CHOICES:
+                promotion = copy(move)
+                gs.promote(choice, promotion)
+                allMoves.append(promotion)
+        else:
+            allMoves.append(move)
+
+    return allMoves
+
+
+def getMoveOrderScore(move):
+    """
+    Returns the key used to sort the move in orderMoves().
+
+    The key is a tuple of the promotion piece's value, the captured
+    piece's value, and the negative value of the piece moved.
+    """
+    promotion = victim = attacker = 0
+    if move.contains_promotion():
+        promotion = PIECE_SCORE[move.promotion_piece.get_name()]
+    if move.piece_captured is not None:
+        victim = PIECE_SCORE[move.piece_captured.get_name()]
+        attacker = PIECE_SCORE[move.piece_moved.get_name()]
+
+    return promotion, victim, -attacker
+
+
+def isQuietMove(move):
+    """Returns True if the move is not a capture or a promotion."""
+    return move.piece_captured is None and not move.contains_promotion()
+
+
+def givesCheck(gs):
+    """Returns True if the side to move is in check after a move."""
+    king = gs.board.white_king if gs.white_to_move else gs.board.black_king
+    return len(gs.get_pins_and_checks(king)[1]) > 0
+
+
+def hasNonPawnMaterial(gs):
+    """
+    Returns True if the side to move has a piece other than its King
+    and Pawns.
+    """
+    color = 'white' if gs.white_to_move else 'black'
+    for pieceList in gs.board.piece_lists.values():
+        if pieceList[color]:
+            return True
+
+    return False
+
+
+def checkStopEvent():
+    """Raises SearchCancelled if the current search has been stopped."""
+    stopEvent = searchState.stopEvent
+    if stopEvent is not None and stopEvent.is_set():
+        raise SearchCancelled()
+
+
+def resetNodeCounts():
+    """Sets all of the search's node counters back to zero."""
+    for key in searchState.nodeCounts:
+        searchState.nodeCounts[key] = 0
+
+
+def getNodeCounts():
+    """Returns a copy of the node counters from the last search."""
+    return dict(searchState.nodeCounts)
+
+
+def benchmarkSearchOptions(gs, depth=MAX_DEPTH):
+    """
+    Measures the effect of each selective search technique.
+
+    Searches the position once with every option in SEARCH_OPTIONS
+    off, once with each option on by itself, and once with all of
+    them on. Returns a dict mapping each configuration's name to its
+    node counts and evaluation cache statistics. SEARCH_OPTIONS is
+    restored afterwards.
+    """
+    savedOptions = dict(SEARCH_OPTIONS)
+    configurations = [('none', ())]
+    configurations += [(option, (option,)) for option in SEARCH_OPTIONS]
+    configurations.append(('all', tuple(SEARCH_OPTIONS)))
+    results = {}
+    gs = copy(gs)
+    validMoves = gs.get_valid_moves()
+    try:
+        for name, options in configurations:
+            for option in SEARCH_OPTIONS:
+                SEARCH_OPTIONS[option] = option in options
+            resetNodeCounts()
+            transpositionTable.clear()
+            evalCache.clear()
+            searchState.nextMove = None
+            start = time.perf_counter()
+            getNegaMaxAlphaBetaMove(gs, list(validMoves), depth, -CHECKMATE,
+                                    CHECKMATE, 1 if gs.white_to_move else -1)
+            results[name] = getNodeCounts()
+            results[name]['seconds'] = time.perf_counter() - start
+            results[name]['move'] = searchState.nextMove
+            results[name]['evalCache'] = evalCache.get_stats()
+    finally:
+        SEARCH_OPTIONS.update(savedOptions)
+
+    return results
+
+
 def scoreBoard(gs):
     """
     Scores the board based on material and attacks.
@@ -186,36 +1641,400 @@ def scoreBoard(gs):
             return CHECKMATE
     elif gs.stalemate:
         return STALEMATE
+
+    # The score only depends on where the pieces are, so the board's key
+    # is enough to look it up.  The network's also depends on the side
+    # to move.
+    key = gs.board.get_zobrist_key()
+    if network is not None and not gs.white_to_move:
+        key ^= ZOBRIST_STATE_KEYS['blackToMove']
+    score = evalCache.probe(key)
+    if score is None:
+        if network is not None:
+            score = evaluateNetwork(gs)
+        else:
+            score = evaluateBoard(gs.board)
+        evalCache.store(key, score)
+
+    return score
+
+
+def evaluateBoard(board):
+    """
+    Scores the pieces on the board without using the evaluation cache.
+
+    The material and piece-square scores are running totals kept by the
+    board, blended from the middlegame to the endgame score as pieces
+    come off. A positive score is good for white, and a negative score
+    is good for black.
+
+    Endgames of Queens and Rooks against a lone King are scored by
+    scoreMopUp() instead.
+    """
+    strongColor = recognizeEndgame(board)
+    if strongColor is not None:
+        return scoreMopUp(board, strongColor)
+
+    middlegame, endgame, phase = board.get_piece_scores()
+    phase = min(phase, MAX_PHASE)
+    score = (middlegame*phase + endgame*(MAX_PHASE - phase)) / MAX_PHASE / 100
+
+    # Pawn structure rarely changes from one position to the next, so it
+    # is looked up by the Pawn key.
+    pawnKey = board.get_pawn_key()
+    pawnScore = pawnHashTable.probe(pawnKey)
+    if pawnScore is None:
+        pawnScore = scorePawnStructure(board)
+        pawnHashTable.store(pawnKey, pawnScore)
     
+    return score + pawnScore
+
+
+def evaluateNetwork(gs):
+    """
+    Scores the position with the network set by useNetwork(), from the
+    accumulator the board keeps. A positive score is good for white, and
+    a negative score is good for black.
+
+    Endgames of Queens and Rooks against a lone King are still scored by
+    scoreMopUp().
+    """
     board = gs.board
-    score = 0
-    for piece in board.get_pieces():
+    strongColor = recognizeEndgame(board)
+    if strongColor is not None:
+        return scoreMopUp(board, strongColor)
+    if board.accumulator is None:  # Made before the network was set.
+        board.refresh_piece_scores()
+
+    return network.evaluate(board.accumulator, gs.white_to_move)
+
+
+def recognizeEndgame(board):
+    """
+    Returns the color of the side that has only Queens and Rooks against
+    a lone King, or None if the board isn't such an endgame.
+
+    The normal evaluation can't tell these positions apart, so the
+    search shuffles the pieces around without making progress toward
+    mate.
+    """
+    pieces = board.get_pieces()
+    if len(pieces) > 5:
+        return None
+
+    names = dict(white = [], black = [])
+    for piece in pieces:
         if piece.is_on_board():
-            if piece.get_color() == 'white':
-                score += PIECE_SCORE[piece.get_name()]
-                if piece.get_name() == 'Pawn' and piece.can_promote():
-                    score += 8
-            elif piece.get_color() == 'black':
-                score -= PIECE_SCORE[piece.get_name()]
-                if piece.get_name() == 'Pawn' and piece.can_promote():
-                    score -= 8
-    
+            names[piece.get_color()].append(piece.get_name())
+    for color, otherColor in (('white', 'black'), ('black', 'white')):
+        if (names[otherColor] == ['King'] and len(names[color]) > 1
+                and all(name in MOP_UP_PIECES or name == 'King'
+                        for name in names[color])):
+            return color
+
+    return None
+
+
+def scoreMopUp(board, strongColor):
+    """
+    Scores an endgame found by recognizeEndgame() by material, plus
+    driving the lone King to the edge of the board and bringing the
+    stronger side's King next to it, which is how these endgames are
+    won. The piece-square scores are left out, as they keep the Kings in
+    the center. A positive score is good for white, and a negative score
+    is good for black.
+
+    The box is the rectangle of squares a Queen or Rook cuts the lone
+    King into with its file and rank. Shrinking it is how a lone Rook
+    pushes the King back, which the edge distance alone can't see.
+    """
+    if strongColor == 'white':
+        king, loneKing, sign = board.white_king, board.black_king, 1
+    else:
+        king, loneKing, sign = board.black_king, board.white_king, -1
+    file, rank = king.get_coords()
+    loneFile, loneRank = loneKing.get_coords()
+    edge = max(3 - loneFile, loneFile - 4) + max(3 - loneRank, loneRank - 4)
+    distance = abs(file - loneFile) + abs(rank - loneRank)
+    box = 64
+    for piece in board.get_pieces():
+        if (piece.is_on_board() and piece.get_color() == strongColor
+                and piece.get_name() != 'King'):
+            pieceFile, pieceRank = piece.get_coords()
+            box = min(box, getBoxSize(pieceFile, loneFile)
+                      * getBoxSize(pieceRank, loneRank))
+
+    return board.get_material_score() + sign * (
+        MOP_UP_SCORE['edge'] * edge + MOP_UP_SCORE['kings'] * (14 - distance)
+        + MOP_UP_SCORE['box'] * (64 - box))
+
+
+def getBoxSize(line, loneLine):
+    """
+    Returns the number of files (or ranks) left to the lone King on its
+    side of a piece's file (or rank).
+    """
+    if loneLine < line:
+        return line
+    elif loneLine > line:
+        return 7 - line
+    return 8
+
+
+def scoreActivity(board, info, otherInfo):
+    """
+    Scores mobility, center control, and attacks near the enemy King
+    from the AttackInfo of each side's last move generation (see
+    GameState.count_attacks()), so no moves are generated for it.
+
+    In the search they come from the nodes one and two plies up, so
+    they can be a move out of date. Returns 0 unless both are given and
+    one is for each side. A positive score is good for white, and a
+    negative score is good for black.
+    """
+    if info is None or otherInfo is None or info.color == otherInfo.color:
+        return 0
+
+    score = 0
+    for sideInfo in (info, otherInfo):
+        counts = sideInfo.counts
+        if sideInfo.color == 'white':
+            king, sign = board.black_king, 1
+        else:
+            king, sign = board.white_king, -1
+        center = sum(counts[square] for square in CENTER_SQUARES)
+        kingZone = 0
+        if king.is_on_board():
+            kingFile, kingRank = king.get_coords()
+            for file in range(max(kingFile - 1, 0), min(kingFile + 2, 8)):
+                for rank in range(max(kingRank - 1, 0), min(kingRank + 2, 8)):
+                    kingZone += counts[8*rank + file]
+        score += sign * (ACTIVITY_SCORE['mobility'] * sideInfo.mobility
+                         + ACTIVITY_SCORE['center'] * center
+                         + ACTIVITY_SCORE['kingZone'] * kingZone)
+
     return score
 
 
-def scoreMaterial(board):
+def scorePawnStructure(board):
     """
-    Score the board based on material.
+    Scores doubled, isolated, backward, and passed Pawns.
+
+    A positive score is good for white, and a negative score is good for black.
     """
+    files = {'white': {}, 'black': {}}  # Color: {file: ranks of its Pawns}
+    for piece in board.get_pieces():
+        if piece.is_on_board() and piece.get_name() == 'Pawn':
+            file, rank = piece.get_coords()
+            files[piece.get_color()].setdefault(file, []).append(rank)
+
     score = 0
+    for color, enemy, forward, sign in (('white', 'black', -1, 1),
+                                        ('black', 'white', 1, -1)):
+        pawnFiles, enemyFiles = files[color], files[enemy]
+        promotionRank = 0 if color == 'white' else board.ranks - 1
+        for file, ranks in pawnFiles.items():
+            score += sign * PAWN_STRUCTURE['doubled'] * (len(ranks) - 1)
+            neighbours = (pawnFiles.get(file - 1, [])
+                          + pawnFiles.get(file + 1, []))
+            for rank in ranks:
+                # Enemy Pawns ahead of this one on its file or the next.
+                blockers = [
+                    enemyRank
+                    for enemyFile in (file - 1, file, file + 1)
+                    for enemyRank in enemyFiles.get(enemyFile, [])
+                    if (enemyRank - rank) * forward > 0
+                ]
+                if not blockers:
+                    score += sign * PASSED_PAWN_BONUS.get(
+                        abs(promotionRank - rank), 0)
+                if not neighbours:
+                    score += sign * PAWN_STRUCTURE['isolated']
+                elif (all((neighbour - rank) * forward > 0
+                          for neighbour in neighbours)
+                      and any(rank + 2*forward in enemyFiles.get(f, [])
+                              for f in (file - 1, file + 1))):
+                    # Every friendly Pawn next to it has gone past it, and
+                    # an enemy Pawn guards the square in front of it.
+                    score += sign * PAWN_STRUCTURE['backward']
+
+    return score
+
+
+def encodeBoard(board):
+    """
+    Encodes the pieces on the board as an array of 64 int8 piece codes,
+    indexed by 8*rank + file. 0 is an empty square, 1 to 6 are White's
+    pieces in the order of BATCH_PIECES, and 7 to 12 are Black's.
+    """
+    position = np.zeros(64, dtype=np.int8)
     for piece in board.get_pieces():
         if piece.is_on_board():
-            if piece.get_color() == 'white':
-                score += PIECE_SCORE[piece.get_name()]
-            elif piece.get_color() == 'black':
-                score -= PIECE_SCORE[piece.get_name()]
-    
-    return score
+            file, rank = piece.get_coords()
+            position[8*rank + file] = getPieceCode(piece)
+
+    return position
+
+
+def encodeFEN(fen):
+    """Encodes the piece placement of a FEN string like encodeBoard()."""
+    position = np.zeros(64, dtype=np.int8)
+    for rank, row in enumerate(fen.split()[0].split('/')):
+        file = 0
+        for char in row:
+            if char.isdigit():
+                file += int(char)
+                continue
+            code = BATCH_PIECES.index(char.upper()) + 1
+            position[8*rank + file] = code if char.isupper() else code + 6
+            file += 1
+
+    return position
+
+
+def getPieceCode(piece):
+    """Returns the code of a piece in encoded boards."""
+    code = BATCH_PIECES.index(piece.get_symbol()) + 1
+    return code if piece.get_color() == 'white' else code + 6
+
+
+def encodeChildren(gs, moves):
+    """
+    Encodes the board after each of the moves without making them.
+
+    Returns an (N, 64) array like encodeBoard(). Starts from a copy of
+    the current board per move and moves the pieces in the copies, with
+    the few castling and en passant moves fixed up one at a time.
+    """
+    parent = encodeBoard(gs.board)
+    children = np.repeat(parent[np.newaxis], len(moves), axis=0)
+    starts = np.empty(len(moves), dtype=np.intp)
+    ends = np.empty(len(moves), dtype=np.intp)
+    codes = np.empty(len(moves), dtype=np.int8)
+    for i, move in enumerate(moves):
+        start, end = move.start_square, move.end_square
+        starts[i] = 8*start.rank + start.file
+        ends[i] = 8*end.rank + end.file
+        if move.contains_promotion():
+            codes[i] = getPieceCode(move.promotion_piece)
+        else:
+            codes[i] = parent[starts[i]]
+    rows = np.arange(len(moves))
+    children[rows, starts] = 0
+    children[rows, ends] = codes
+    for i, move in enumerate(moves):
+        if move.contains_enpassant():
+            square = move.enpassant_square
+            children[i, 8*square.rank + square.file] = 0
+        elif move.contains_castle():
+            rook, rookStart, rookEnd = move.castle
+            children[i, 8*rookStart.rank + rookStart.file] = 0
+            children[i, 8*rookEnd.rank + rookEnd.file] = getPieceCode(rook)
+
+    return children
+
+
+def scoreBoards(positions):
+    """
+    Scores a batch of encoded boards (see encodeBoard()) with vectorized
+    NumPy operations.
+
+    positions is an (N, 64) array. Returns an array of N scores that
+    match evaluateBoard(): tapered material and piece-square scores plus
+    the Pawn structure terms. A positive score is good for white, and a
+    negative score is good for black.
+    """
+    positions = np.asarray(positions, dtype=np.intp).reshape(-1, 64)
+    middlegameTable, endgameTable, phaseTable = batchTables
+    squares = np.arange(64)
+    middlegame = middlegameTable[positions, squares].sum(axis=1)
+    endgame = endgameTable[positions, squares].sum(axis=1)
+    phase = np.minimum(phaseTable[positions].sum(axis=1), MAX_PHASE)
+    scores = ((middlegame*phase + endgame*(MAX_PHASE - phase))
+              / MAX_PHASE / 100)
+
+    return scores + scorePawnMasks(positions.reshape(-1, 8, 8))
+
+
+def scorePawnMasks(positions):
+    """
+    Scores the Pawn structure of a batch of encoded boards, shaped
+    (N, 8, 8) by rank and file, like scorePawnStructure().
+    """
+    return countPawnMasks(positions) @ getPawnWeights()
+
+
+def getPawnWeights():
+    """
+    Returns the scores of the Pawn structure terms counted by
+    countPawnMasks(), in pawns.
+    """
+    return np.array(list(PAWN_STRUCTURE.values())
+                    + [PASSED_PAWN_BONUS.get(distance, 0)
+                       for distance in range(8)])
+
+
+def countPawnMasks(positions):
+    """
+    Counts the Pawn structure terms of a batch of encoded boards, shaped
+    (N, 8, 8) by rank and file.
+
+    Returns an (N, 11) array of White's count minus Black's of doubled,
+    isolated, and backward Pawns (in the order of PAWN_STRUCTURE), then
+    of passed Pawns 0 to 7 ranks from promotion.
+    """
+    white = positions == 1
+    black = positions == 7
+    ranks = np.arange(8).reshape(1, 8, 1)
+    counts = np.zeros((len(positions), 11), dtype=np.int64)
+    for pawns, enemies, forward, sign in ((white, black, -1, 1),
+                                          (black, white, 1, -1)):
+        # Flip Black's boards so both sides move up the board (rank 0).
+        if forward == 1:
+            pawns, enemies = pawns[:, ::-1], enemies[:, ::-1]
+        fileCounts = pawns.sum(axis=1)  # Pawns on each file.
+        doubled = np.maximum(fileCounts - 1, 0).sum(axis=1)
+        counts[:, 0] += sign * doubled
+
+        # Whether there are friendly Pawns on a file next to each file.
+        adjacent = np.zeros_like(fileCounts, dtype=bool)
+        adjacent[:, 1:] |= fileCounts[:, :-1] > 0
+        adjacent[:, :-1] |= fileCounts[:, 1:] > 0
+        isolated = pawns & ~adjacent[:, np.newaxis]
+        counts[:, 1] += sign * isolated.sum(axis=(1, 2))
+
+        # Passed: no enemy Pawns on a lower rank on this file or the next.
+        enemyRanks = np.where(enemies, ranks, 8).min(axis=1)
+        frontEnemy = enemyRanks.copy()
+        frontEnemy[:, 1:] = np.minimum(frontEnemy[:, 1:], enemyRanks[:, :-1])
+        frontEnemy[:, :-1] = np.minimum(frontEnemy[:, :-1], enemyRanks[:, 1:])
+        passed = pawns & (frontEnemy[:, np.newaxis] >= ranks)
+        counts[:, 3:] += sign * passed.sum(axis=2)
+
+        # Backward: every Pawn on the next files is on a lower rank, and
+        # an enemy Pawn two ranks up on a next file guards its front.
+        friendRanks = np.where(pawns, ranks, -1).max(axis=1)
+        rearFriend = np.full_like(friendRanks, -1)
+        rearFriend[:, 1:] = friendRanks[:, :-1]
+        rearFriend[:, :-1] = np.maximum(rearFriend[:, :-1],
+                                        friendRanks[:, 1:])
+        guards = np.zeros_like(enemies)
+        guards[:, 2:, 1:] |= enemies[:, :-2, :-1]
+        guards[:, 2:, :-1] |= enemies[:, :-2, 1:]
+        backward = (pawns & adjacent[:, np.newaxis]
+                    & (rearFriend[:, np.newaxis] < ranks) & guards)
+        counts[:, 2] += sign * backward.sum(axis=(1, 2))
+
+    return counts
+
+
+def scoreMaterial(board):
+    """
+    Score the board based on material.
+
+    Uses the running total of PIECE_SCORE kept by the board.
+    """
+    return board.get_material_score()
 
 
 
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+This module lets asyncio programs use the AI without blocking their
+event loop. The search runs in an executor and its progress is sent
+back to the event loop as it deepens.
+"""
+
+__all__ = ['analyse', 'getBestMoveAsync']
+
+import asyncio
+import threading
+
+import chess_ai as ai
+from chess_engine import GameState, STARTING_FEN
+
+
+async def analyse(fen=STARTING_FEN, depth=ai.MAX_DEPTH, timeout=None,
+                  executor=None):
+    """
+    Analyses the position in the FEN string, yielding a SearchInfo (see
+    chess_ai.iterateSearch()) each time the search finishes a depth.
+
+    The search runs in executor, or the event loop's default executor
+    if it is None, so a bounded pool of threads can serve many
+    analyses. It stops when it reaches depth, when timeout seconds have
+    passed, when the task using it is cancelled, or when the caller
+    stops iterating, so the last SearchInfo yielded is the best result.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stopEvent = threading.Event()
+
+    def send(info):
+        """Puts info on the queue from the search's thread."""
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, info)
+        except RuntimeError:  # The event loop has been closed.
+            stopEvent.set()
+
+    def search():
+        """Runs the search in the executor's thread."""
+        ai.searchState.stopEvent = stopEvent
+        try:
+            for info in ai.iterateSearch(GameState(fen), depth):
+                send(info)
+        except ai.SearchCancelled:
+            pass
+        finally:
+            ai.searchState.stopEvent = None
+            send(None)  # The search is over.
+
+    future = loop.run_in_executor(executor, search)
+    deadline = None if timeout is None else loop.time() + timeout
+    try:
+        while True:
+            if deadline is None:
+                info = await queue.get()
+            else:
+                try:
+                    info = await asyncio.wait_for(
+                        queue.get(), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    break
+            if info is None:
+                break
+            yield info
+    finally:
+        stopEvent.set()
+    await future  # Raises any error from the search.
+
+
+async def getBestMoveAsync(fen=STARTING_FEN, depth=ai.MAX_DEPTH,
+                           timeout=None, executor=None):
+    """
+    Returns the SearchInfo of the deepest search of the position
+    finished within timeout seconds, or None if no depth was finished.
+    """
+    info = None
+    async for info in analyse(fen, depth, timeout, executor):
+        pass
+
+    return info
@@ -8,10 +8,13 @@ This module contains the Square and Board class as well as functions
 that they use.
 """
 
-__all__ = ["Board", "Square", "makeStandardBoard"]
+__all__ = ["Board", "Square", "makeStandardBoard", "makeBoardFromFEN",
+           "setPieceScores", "setAccumulatorRows"]
 
 
 import numpy as np  # We'll use a numpy array for the board.
+import weakref
+from random import Random
 from typing import Union, List, Tuple
 
 from chess_pieces import Piece, King, Queen, Rook, Bishop, Knight, Pawn
@@ -19,6 +22,90 @@ from chess_pieces import Piece, King, Queen, Rook, Bishop, Knight, Pawn
 
 FILE = 'abcdefgh'  # Letters are used to denote files.
 RANK = '87654321'  # Numbers are used to denote ranks.
+MAX_BOARD_SIZE = 26  # One file for each letter of the alphabet.
+
+
+def makeZobristKeys(seed: int=2021) -> dict:
+    """
+    Makes the random numbers used for Zobrist hashing of the pieces.
+
+    Returns a dict mapping each piece's image name (e.g. 'wK') to a
+    list of lists of 64-bit numbers, indexed by file and then rank.
+    The seed is fixed so that position keys are the same between runs.
+    """
+    rng = Random(seed)
+    keys = {}
+    for color in 'wb':
+        for symbol in 'KQRBNP':
+            keys[color + symbol] = [
+                [rng.getrandbits(64) for _ in range(MAX_BOARD_SIZE)]
+                for _ in range(MAX_BOARD_SIZE)
+            ]
+
+    return keys
+
+
+ZOBRIST_PIECE_KEYS = makeZobristKeys()
+# Scores that boards keep running totals of as pieces are set and removed.
+# Filled in by setPieceScores().
+PIECE_SQUARE_SCORES = {}  # Image name: [file][rank] of (middlegame, endgame)
+PHASE_WEIGHTS = {}  # Piece name: how much it counts toward the middlegame
+PIECE_VALUES = {}  # Image name: material value
+# First-layer weights of a neural network evaluator that boards keep a
+# running sum of, the accumulator.  Filled in by setAccumulatorRows().
+ACCUMULATOR_ROWS = {}  # Image name: array indexed by file and rank
+LIVE_BOARDS = weakref.WeakSet()  # Boards made, for setAccumulatorRows()
+
+
+def setPieceScores(pieceSquareScores: dict, phaseWeights: dict,
+                   pieceValues: dict) -> None:
+    """
+    Sets the scores that boards keep running totals of.
+
+    pieceSquareScores maps each piece's image name to a list of lists,
+    indexed by file and then rank, of (middlegame, endgame) scores for
+    the piece on that square. phaseWeights maps piece names to how much
+    they count toward the game phase, and pieceValues maps image names
+    to material values. Scores for Black should be negative.
+
+    Boards made before the scores were set need refresh_piece_scores().
+    """
+    PIECE_SQUARE_SCORES.clear()
+    PIECE_SQUARE_SCORES.update(pieceSquareScores)
+    PHASE_WEIGHTS.clear()
+    PHASE_WEIGHTS.update(phaseWeights)
+    PIECE_VALUES.clear()
+    PIECE_VALUES.update(pieceValues)
+
+
+def setAccumulatorRows(accumulatorRows: dict) -> None:
+    """
+    Sets the rows of weights that boards add up in their accumulator.
+
+    accumulatorRows maps each piece's image name to a numpy array,
+    indexed by file and then rank, of the rows for the piece on that
+    square. Every row has the shape of the accumulator. An empty
+    dictionary turns the accumulator off.
+
+    The accumulators of existing boards are sums of the old rows, so
+    they are dropped, and the boards need refresh_piece_scores() before
+    their accumulators are used again.
+    """
+    ACCUMULATOR_ROWS.clear()
+    ACCUMULATOR_ROWS.update(accumulatorRows)
+    for board in LIVE_BOARDS:
+        board.accumulator = None
+
+
+def makeAccumulator():
+    """
+    Returns an empty accumulator for the rows set by setAccumulatorRows(),
+    or None if none are set.
+    """
+    for rows in ACCUMULATOR_ROWS.values():
+        return np.zeros(rows.shape[2:], dtype=rows.dtype)
+
+    return None
 
 
 def defineFILEandRANK(files: int, ranks: int) -> Tuple[List[str]]:
@@ -175,12 +262,19 @@ class Square():
         Sets a Piece object to the Square, and simultaneously
         sets the Square to the Piece object.
         """
+        if self.piece is not None:
+            self.board.toggle_piece_key(self.piece, self)
+            self.board.update_piece_scores(self.piece, self, -1)
         self.piece = piece        
         piece.square = self
+        self.board.toggle_piece_key(piece, self)
+        self.board.update_piece_scores(piece, self, 1)
         
     def remove_piece(self) -> None:
         """Removes the piece from the square."""
         if self.has_piece():
+            self.board.toggle_piece_key(self.piece, self)
+            self.board.update_piece_scores(self.piece, self, -1)
             self.piece.square = None
             self.piece = None
         
@@ -260,6 +354,81 @@ class Board():
         # generated. Will be used for checks and pins.
         self.white_king = None
         self.black_king = None
+        # Zobrist hash of the piece placement. Updated by the squares
+        # whenever a piece is set or removed.
+        self.zobrist_key = 0
+        self.pawn_key = 0  # The same, but for the Pawns only.
+        # Running totals of the scores set by setPieceScores(), updated
+        # by the squares the same way.
+        self.middlegame_score = 0
+        self.endgame_score = 0
+        self.phase = 0
+        self.material_score = 0
+        # Sum of the rows set by setAccumulatorRows(), or None.
+        self.accumulator = makeAccumulator()
+        LIVE_BOARDS.add(self)
+    
+    def toggle_piece_key(self, piece: Piece, square: Square) -> None:
+        """
+        Adds or removes a piece on a square from the board's Zobrist
+        key, and from its Pawn key if the piece is a Pawn.  Since the
+        keys are built with XOR, the same call does both.
+        """
+        key = ZOBRIST_PIECE_KEYS[piece.get_image_name()][
+            square.file][square.rank]
+        self.zobrist_key ^= key
+        if piece.get_name() == 'Pawn':
+            self.pawn_key ^= key
+    
+    def get_zobrist_key(self) -> int:
+        """Returns the Zobrist hash of the pieces on the board."""
+        return self.zobrist_key
+    
+    def get_pawn_key(self) -> int:
+        """Returns the Zobrist hash of the Pawns on the board."""
+        return self.pawn_key
+    
+    def update_piece_scores(self, piece: Piece, square: Square,
+                            sign: int) -> None:
+        """
+        Adds (sign = 1) or subtracts (sign = -1) a piece on a square to
+        or from the board's running score totals.
+        """
+        imageName = piece.get_image_name()
+        scores = PIECE_SQUARE_SCORES.get(imageName)
+        if scores is not None:
+            middlegame, endgame = scores[square.file][square.rank]
+            self.middlegame_score += sign * middlegame
+            self.endgame_score += sign * endgame
+        self.phase += sign * PHASE_WEIGHTS.get(piece.get_name(), 0)
+        self.material_score += sign * PIECE_VALUES.get(imageName, 0)
+        rows = ACCUMULATOR_ROWS.get(imageName)
+        if rows is not None and self.accumulator is not None:
+            # In place, so no new array is made for every move.
+            if sign > 0:
+                self.accumulator += rows[square.file, square.rank]
+            else:
+                self.accumulator -= rows[square.file, square.rank]
+    
+    def refresh_piece_scores(self) -> None:
+        """Recalculates the running score totals from the squares."""
+        self.middlegame_score = self.endgame_score = 0
+        self.phase = self.material_score = 0
+        self.accumulator = makeAccumulator()
+        for square in self.squares.flat:
+            if square.has_piece():
+                self.update_piece_scores(square.get_piece(), square, 1)
+    
+    def get_piece_scores(self) -> Tuple[int]:
+        """
+        Returns the running totals of the middlegame and endgame
+        piece-square scores and the game phase.
+        """
+        return self.middlegame_score, self.endgame_score, self.phase
+    
+    def get_material_score(self) -> int:
+        """Returns the running total of the material on the board."""
+        return self.material_score
     
     def get_size(self) -> Tuple[int]:
         """
@@ -420,3 +589,43 @@ def makeQueenEndgameBoard(queenColor: str):
     return board
 
 
+def makeBoardFromFEN(placement: str):
+    """
+    Sets up a chess board from the piece placement field of a FEN
+    string, e.g.
+
+        'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR'
+
+    The ranks are given from the 8th rank down, with uppercase letters
+    for White's pieces, lowercase for Black's, and digits for runs of
+    empty squares.
+    """
+    PIECES = dict(
+        k = King,
+        q = Queen,
+        r = Rook,
+        b = Bishop,
+        n = Knight,
+        p = Pawn,
+    )
+    board = Board()
+    for rank, row in enumerate(placement.split('/')):
+        file = 0
+        for char in row:
+            if char.isdigit():
+                file += int(char)
+                continue
+            if char.lower() not in PIECES:
+                raise ValueError(f"Invalid piece '{char}' in FEN.")
+            color = 'white' if char.isupper() else 'black'
+            piece = PIECES[char.lower()](color)
+            board.squares[file, rank].set_piece(piece)
+            if char == 'K':
+                board.white_king = piece
+            elif char == 'k':
+                board.black_king = piece
+            file += 1
+    
+    board.update_pieces()
+    
+    return board
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the opening book, a file of moves played from
+positions in collections of games, indexed by the Zobrist key of a
+position, and the reader for the PGN files the book is built from.
+"""
+
+__all__ = ['OpeningBook', 'BookEntry', 'writeBook', 'readPGNGames']
+
+import mmap
+import os
+import random as rn
+import re
+import struct
+from collections import namedtuple
+
+# Each record is the position's key, the move code (see
+# chess_ai.getMoveCode()), the number of games the move was played in,
+# and a field Polyglot books use for learning, which is left at 0. Like
+# in a Polyglot book the records are big-endian and sorted by key, but
+# the keys are this program's own Zobrist keys.
+BOOK_RECORD = struct.Struct('>QHHI')
+BOOK_KEY = struct.Struct('>Q')
+MAX_WEIGHT = 0xffff
+
+BookEntry = namedtuple('BookEntry', ['move', 'weight'])
+
+PGN_HEADER = re.compile(r'\[\s*(\w+)\s+"(.*)"\s*\]')
+PGN_TOKEN = re.compile(r"""\s*(?:
+    (?P<comment>\{)
+    |(?P<lineComment>;)
+    |(?P<variationStart>\()
+    |(?P<variationEnd>\))
+    |(?P<nag>\$\d+)
+    |(?P<moveNumber>\d+\.+)
+    |(?P<result>1-0|0-1|1/2-1/2|\*)
+    |(?P<move>[^\s(){};$]+)
+    )""", re.VERBOSE)
+
+
+class OpeningBook():
+    """
+    Opening book in a file of fixed-size records sorted by position key.
+
+    The file is memory-mapped and searched with a binary search, so only
+    the pages holding the records looked at are read from disk, and a
+    large book costs no time to open.
+    """
+    def __init__(self, filename: str) -> None:
+        self.file = open(filename, 'rb')
+        self.size = os.path.getsize(filename) // BOOK_RECORD.size
+        self.mmap = None
+        if self.size:  # An empty file can't be mapped.
+            self.mmap = mmap.mmap(self.file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+
+    def __len__(self) -> int:
+        """Return the number of moves in the book."""
+        return self.size
+
+    def get_key(self, index: int) -> int:
+        """Returns the position key of the record at the index."""
+        return BOOK_KEY.unpack_from(self.mmap, index * BOOK_RECORD.size)[0]
+
+    def find(self, key: int) -> int:
+        """Returns the index of the first record with the key or above."""
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if self.get_key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
+
+    def probe(self, key: int) -> list:
+        """
+        Returns a BookEntry for each move in the book for the key, most
+        played first, or an empty list if the position isn't in it.
+        """
+        entries = []
+        index = self.find(key)
+        while index < self.size and self.get_key(index) == key:
+            _, move, weight, _ = BOOK_RECORD.unpack_from(
+                self.mmap, index * BOOK_RECORD.size)
+            entries.append(BookEntry(move, weight))
+            index += 1
+
+        return entries
+
+    def choose_move(self, key: int):
+        """
+        Returns the code of a book move for the key, chosen at random in
+        proportion to how often it was played, or None if there isn't
+        one.
+        """
+        entries = self.probe(key)
+        if not entries:
+            return None
+
+        return rn.choices([entry.move for entry in entries],
+                          [entry.weight for entry in entries])[0]
+
+    def close(self) -> None:
+        """Closes the book's file."""
+        if self.mmap is not None:
+            self.mmap.close()
+        self.file.close()
+
+
+def writeBook(filename: str, counts: dict, minCount: int=1) -> int:
+    """
+    Writes an opening book file from a dictionary of the number of times
+    each move was played, keyed by (position key, move code). Moves
+    played fewer than minCount times are left out. Returns the number of
+    moves written.
+    """
+    # Sorted by key, then with the most played moves first.
+    records = sorted((key, -count, move)
+                     for (key, move), count in counts.items()
+                     if count >= minCount)
+    with open(filename, 'wb') as file:
+        for key, negativeCount, move in records:
+            weight = min(-negativeCount, MAX_WEIGHT)
+            file.write(BOOK_RECORD.pack(key, move, weight, 0))
+
+    return len(records)
+
+
+def readPGNGames(file):
+    """
+    Reads the games in a PGN file one at a time, yielding a dictionary
+    of each game's tag pairs and a list of its moves in algebraic
+    notation. Comments, variations, and annotations are skipped.
+    """
+    headers, moves = {}, []
+    inComment = False
+    variationDepth = 0
+    for line in file:
+        if inComment:
+            end = line.find('}')
+            if end < 0:
+                continue
+            line = line[end + 1:]
+            inComment = False
+        if not variationDepth and line.startswith('['):
+            match = PGN_HEADER.match(line)
+            if match is not None:
+                if moves:  # The last game had no result.
+                    yield headers, moves
+                    headers, moves = {}, []
+                headers[match.group(1)] = match.group(2)
+            continue
+        if line.startswith('%'):  # Escaped line.
+            continue
+
+        position = 0
+        while position < len(line):
+            match = PGN_TOKEN.match(line, position)
+            if match is None or not match.group().strip():
+                break
+            position = match.end()
+            kind = match.lastgroup
+            if kind == 'comment':
+                end = line.find('}', position)
+                if end < 0:
+                    inComment = True
+                    break
+                position = end + 1
+            elif kind == 'lineComment':
+                break
+            elif kind == 'variationStart':
+                variationDepth += 1
+            elif kind == 'variationEnd':
+                variationDepth = max(variationDepth - 1, 0)
+            elif variationDepth:
+                continue
+            elif kind == 'result':
+                yield headers, moves
+                headers, moves = {}, []
+            elif kind == 'move':
+                moves.append(match.group(kind))
+
+    if moves:
+        yield headers, moves
@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the tables the AI uses to remember work it has
+already done, indexed by the Zobrist key of a position.
+"""
+
+__all__ = ['TranspositionTable', 'SharedTranspositionTable',
+           'FileTranspositionTable', 'EvalCache', 'EXACT', 'LOWER_BOUND',
+           'UPPER_BOUND']
+
+import mmap
+import os
+import struct
+from collections import namedtuple
+from multiprocessing.shared_memory import SharedMemory
+
+# Flags for what a stored score means.
+EXACT = 0        # The score is the exact value of the position.
+LOWER_BOUND = 1  # The search failed high, the value is at least the score.
+UPPER_BOUND = 2  # The search failed low, the value is at most the score.
+
+Entry = namedtuple('Entry', ['key', 'depth', 'score', 'flag', 'move',
+                             'generation'])
+
+TABLE_MAGIC = int.from_bytes(b'ChessTT1', 'little')  # Marks a packed table.
+TABLE_VERSION = 3  # Increase whenever the layout of the entries changes.
+VERSION_SALT = TABLE_VERSION * 0x9e3779b97f4a7c15 & 0xffffffffffffffff
+HEADER_WORDS = 5  # Magic, version, slots, generation, and evaluation key.
+FLOAT = struct.Struct('<f')
+
+
+class TranspositionTable():
+    """
+    Fixed-size table of search results indexed by position key.
+
+    Each slot holds one Entry of the position's key, the depth it was
+    searched to, its score and flag, and the code of the best move (see
+    chess_ai.getMoveCode()). A new entry replaces the old one in its
+    slot unless the old one is from the current search and was searched
+    deeper. The generation is increased by new_search() so entries from
+    earlier searches are replaced first.
+    """
+    def __init__(self, size: int=2**18) -> None:
+        self.size = size
+        self.entries = [None] * size
+        self.generation = 0
+
+    def __len__(self) -> int:
+        """Return the number of slots in the table."""
+        return self.size
+
+    def probe(self, key: int):
+        """Returns the Entry stored for the key, or None if there isn't one."""
+        entry = self.entries[key % self.size]
+        if entry is not None and entry.key == key:
+            return entry
+
+        return None
+
+    def store(self, key: int, depth: int, score: float, flag: int,
+              move: int) -> None:
+        """Stores a search result in the key's slot."""
+        index = key % self.size
+        old = self.entries[index]
+        if (old is None or old.key == key or depth >= old.depth
+                or old.generation != self.generation):
+            self.entries[index] = Entry(key, depth, score, flag, move,
+                                        self.generation)
+
+    def new_search(self) -> None:
+        """Ages the entries already in the table."""
+        self.generation += 1
+
+    def clear(self) -> None:
+        """Removes every entry from the table."""
+        self.entries = [None] * self.size
+        self.generation = 0
+
+
+class PackedTranspositionTable():
+    """
+    Transposition table stored as a flat array of fixed-width entries in
+    a buffer, so that it can be put in memory shared between processes.
+
+    After a header of HEADER_WORDS 64-bit words, each slot takes two
+    words: the position's key XORed with the entry's data, and the data
+    itself, which packs the score (as a 32-bit float), move code, depth,
+    flag, and generation into 64 bits. No locks are used. If two
+    processes write the same slot at once, or one reads while another
+    writes, the words of a slot can come from different entries, but
+    then the check word doesn't XOR back to the key and the entry is
+    ignored ("lockless hashing"). The check word is also salted with
+    TABLE_VERSION, so entries written in another format never check out.
+
+    The header also holds an evaluation key, a hash of the evaluation
+    the scores were found with (see chess_ai.getEvalKey()), so a table
+    isn't used with a different evaluation.
+
+    Has the same methods as TranspositionTable, so the search can use
+    either one.
+    """
+    def __init__(self, buffer, size: int, evalKey: int=0) -> None:
+        self.buffer = buffer
+        self.words = memoryview(buffer).cast('Q')
+        self.size = size
+        self.eval_key = evalKey
+        self.generation = 0
+
+    def __len__(self) -> int:
+        """Return the number of slots in the table."""
+        return self.size
+
+    @staticmethod
+    def get_buffer_size(size: int) -> int:
+        """Returns the number of bytes needed for a table of size slots."""
+        return 8 * (HEADER_WORDS + 2*size)
+
+    def write_header(self) -> None:
+        """
+        Marks the buffer as a table and saves its version, number of
+        slots, generation, and evaluation key.
+        """
+        self.words[0] = TABLE_MAGIC
+        self.words[1] = TABLE_VERSION
+        self.words[2] = self.size
+        self.words[3] = self.generation
+        self.words[4] = self.eval_key
+
+    def has_valid_header(self) -> bool:
+        """
+        Returns True if the buffer's header is for a table of the
+        current version with this table's number of slots and
+        evaluation key.
+        """
+        return (self.words[0] == TABLE_MAGIC
+                and self.words[1] == TABLE_VERSION
+                and self.words[2] == self.size
+                and self.words[4] == self.eval_key)
+
+    def pack(self, depth: int, score: float, flag: int, move: int) -> int:
+        """Packs an entry's data into a 64-bit word."""
+        scoreBits = int.from_bytes(FLOAT.pack(score), 'little')
+        return (scoreBits | move << 32 | (depth & 0xff) << 48 | flag << 56
+                | (self.generation & 0x3f) << 58)
+
+    def unpack(self, key: int, data: int) -> Entry:
+        """Unpacks a 64-bit data word into an Entry."""
+        score = FLOAT.unpack((data & 0xffffffff).to_bytes(4, 'little'))[0]
+        return Entry(key, data >> 48 & 0xff, score, data >> 56 & 0x3,
+                     data >> 32 & 0xffff, data >> 58)
+
+    def probe(self, key: int):
+        """Returns the Entry stored for the key, or None if there isn't one."""
+        index = HEADER_WORDS + 2*(key % self.size)
+        data = self.words[index + 1]
+        if self.words[index] ^ data ^ VERSION_SALT != key:
+            return None
+
+        return self.unpack(key, data)
+
+    def store(self, key: int, depth: int, score: float, flag: int,
+              move: int) -> None:
+        """Stores a search result in the key's slot."""
+        index = HEADER_WORDS + 2*(key % self.size)
+        oldData = self.words[index + 1]
+        if (oldData == 0
+                or self.words[index] ^ oldData ^ VERSION_SALT == key
+                or depth >= oldData >> 48 & 0xff
+                or oldData >> 58 != self.generation & 0x3f):
+            data = self.pack(depth, score, flag, move)
+            self.words[index + 1] = data
+            self.words[index] = key ^ data ^ VERSION_SALT
+
+    def new_search(self) -> None:
+        """Ages the entries already in the table."""
+        self.generation = (self.generation + 1) & 0x3f
+        self.words[3] = self.generation
+
+    def clear(self) -> None:
+        """Removes every entry from the table."""
+        for index in range(HEADER_WORDS, HEADER_WORDS + 2*self.size):
+            self.words[index] = 0
+        self.generation = 0
+        self.words[3] = 0
+
+    def set_eval_key(self, evalKey: int) -> None:
+        """
+        Clears the table for scores found with another evaluation, and
+        saves its key in the header.
+        """
+        self.clear()
+        self.eval_key = evalKey
+        self.words[4] = evalKey
+
+    def release(self) -> None:
+        """Releases the table's view of its buffer."""
+        self.words.release()
+
+
+class SharedTranspositionTable(PackedTranspositionTable):
+    """
+    PackedTranspositionTable in a multiprocessing.shared_memory block.
+
+    Without a name, a new block is made for a table of size slots. With
+    the name of an existing block, the table in that block is used, so
+    every search process attached to it sees what the others have
+    stored. The process that made the block should unlink() it when the
+    table isn't needed anymore.
+    """
+    def __init__(self, size: int=2**18, name: str=None) -> None:
+        if name is None:
+            self.shared_memory = SharedMemory(
+                create=True, size=self.get_buffer_size(size))
+            super().__init__(self.shared_memory.buf, size)
+            self.write_header()
+        else:
+            self.shared_memory = attachSharedMemory(name)
+            words = self.shared_memory.buf.cast('Q')
+            size, evalKey = words[2], words[4]
+            words.release()
+            super().__init__(self.shared_memory.buf, size, evalKey)
+            if not self.has_valid_header():
+                self.close()
+                raise ValueError(
+                    f"Shared memory '{name}' doesn't hold a table.")
+            self.generation = self.words[3]
+
+    @property
+    def name(self) -> str:
+        """The name other processes use to attach to the table."""
+        return self.shared_memory.name
+
+    def close(self) -> None:
+        """Detaches this process from the table."""
+        self.release()
+        self.shared_memory.close()
+
+    def unlink(self) -> None:
+        """Frees the shared memory once every process has closed it."""
+        self.shared_memory.unlink()
+
+
+
+class FileTranspositionTable(PackedTranspositionTable):
+    """
+    PackedTranspositionTable kept in a memory-mapped file, so that its
+    entries are still there the next time the program runs.
+
+    Only the parts of the file that the search touches are read from
+    disk. If the file doesn't exist, or its header is for another
+    version of the table, another number of slots, or another
+    evaluation key, it is started over empty. The generation is saved
+    in the header, so entries from earlier runs are replaced before
+    entries from this one.
+    """
+    def __init__(self, filename: str, size: int=2**18,
+                 evalKey: int=0) -> None:
+        bufferSize = self.get_buffer_size(size)
+        if not os.path.exists(filename):
+            open(filename, 'wb').close()
+        self.file = open(filename, 'r+b')
+        if os.path.getsize(filename) != bufferSize:
+            self.file.truncate(0)
+            self.file.truncate(bufferSize)
+        self.mmap = mmap.mmap(self.file.fileno(), bufferSize)
+        super().__init__(self.mmap, size, evalKey)
+        if self.has_valid_header():
+            self.generation = self.words[3]
+        else:
+            self.clear()
+            self.write_header()
+
+    def flush(self) -> None:
+        """Writes the table's changes to the file."""
+        self.mmap.flush()
+
+    def close(self) -> None:
+        """Saves and closes the table's file."""
+        self.flush()
+        self.release()
+        self.mmap.close()
+        self.file.close()
+
+
+class EvalCache():
+    """
+    Fixed-size cache of static evaluations indexed by position key.
+
+    Each slot holds a (key, score) tuple of the last position stored in
+    it, so a new position simply overwrites the old one. The key and
+    score are replaced together, so a search thread switching in the
+    middle of a store can't pair a key with another position's score.
+    Counts hits and misses so the hit rate can be checked with
+    get_stats().
+    """
+    def __init__(self, size: int=2**16) -> None:
+        self.size = size
+        self.entries = [None] * size
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        """Return the number of slots in the table."""
+        return self.size
+
+    def probe(self, key: int):
+        """Returns the score stored for the key, or None if there isn't one."""
+        entry = self.entries[key % self.size]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        return None
+
+    def store(self, key: int, score: float) -> None:
+        """Stores a score in the key's slot."""
+        self.entries[key % self.size] = (key, score)
+
+    def get_stats(self) -> dict:
+        """Returns the number of hits and misses and the hit rate."""
+        probes = self.hits + self.misses
+        return dict(
+            hits = self.hits,
+            misses = self.misses,
+            hitRate = self.hits / probes if probes else 0.0,
+        )
+
+    def reset_stats(self) -> None:
+        """Sets the hit and miss counts back to zero."""
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self) -> None:
+        """Removes every score from the cache."""
+        self.entries = [None] * self.size
+        self.reset_stats()
+
+
+def attachSharedMemory(name: str) -> SharedMemory:
+    """
+    Attaches to an existing shared memory block, leaving it to the
+    process that made the block to unlink it.
+    """
+    try:
+        return SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        # Older versions always track the block, but worker processes
+        # share their parent's resource tracker, so it isn't unlinked
+        # early.
+        return SharedMemory(name=name)
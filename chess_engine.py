@@ -7,11 +7,47 @@ Created on Fri Mar 12 22:29:53 2021
 This is the engine that will run the chess game.
 """
 
+from collections import namedtuple
+from random import Random
 from typing import Union, Tuple
 
 from chess_pieces import Queen, Rook, Bishop, Knight
 from chess_pieces import DIRECTIONS
-from chess_board import makeStandardBoard, Square
+from chess_board import makeStandardBoard, makeBoardFromFEN, Square
+from chess_board import algebraicToComputer, computerToAlgebraic
+from chess_board import MAX_BOARD_SIZE
+
+STARTING_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+PREVIOUSLY_MOVED = 'moved before the game state was set up'  # Stands in for
+    # the first move of pieces that a FEN string says have already moved.
+AttackInfo = namedtuple('AttackInfo', ['color', 'counts', 'mobility'])
+    # counts[rank * files + file] is the number of the side's pieces
+    # attacking that square, and mobility is its number of non-Pawn moves.
+SEE_PIECE_VALUES = dict(  # Piece values used by static exchange evaluation.
+    King = 100,
+    Queen = 9,
+    Rook = 5,
+    Bishop = 3,
+    Knight = 3,
+    Pawn = 1,
+)
+
+
+def makeZobristStateKeys(seed: int=1997) -> dict:
+    """
+    Makes the random numbers used for Zobrist hashing of the parts of
+    a position that aren't piece placement: the side to move, the
+    castling rights, and the en passant file.
+    """
+    rng = Random(seed)
+    return dict(
+        blackToMove = rng.getrandbits(64),
+        castling = [rng.getrandbits(64) for _ in range(16)],
+        enpassant = [rng.getrandbits(64) for _ in range(MAX_BOARD_SIZE)],
+    )
+
+
+ZOBRIST_STATE_KEYS = makeZobristStateKeys()
 
 
 class GameState():
@@ -20,10 +56,16 @@ class GameState():
     current state of a chess game. It will also be responsible for
     determining the valid moves at the current state. It will also keep
     a move log.
+
+    The game starts from the standard setup unless a position is given
+    as a FEN string.
     """
     
-    def __init__(self):
-        self.board = makeStandardBoard()
+    def __init__(self, fen: str=None):
+        if fen is None:
+            self.board = makeStandardBoard()
+        else:
+            self.board = makeBoardFromFEN(fen.split()[0])
         self.file_size, self.rank_size = self.board.get_size()
         self.white_to_move = True
         self.move_log = []
@@ -39,6 +81,96 @@ class GameState():
         self.stalemate_counter = 0
         self.enpassant_coords = ()
         self.valid_moves = []
+        self.attack_info = None  # AttackInfo from the last move generation.
+        if fen is not None:
+            self.set_fen_state(fen)
+        self.start_enpassant_coords = self.enpassant_coords
+    
+    def set_fen_state(self, fen: str) -> None:
+        """
+        Sets the side to move, castling rights, en passant square, and
+        move counters from the fields of a FEN string after the piece
+        placement.
+
+        Castling rights and two-square Pawn moves depend on whether the
+        pieces have moved, so Kings, Rooks, and Pawns that couldn't still
+        be unmoved are given PREVIOUSLY_MOVED as their first move.
+        """
+        fields = fen.split()
+        defaults = ['w', '-', '-', '0', '1']  # For FENs with missing fields.
+        turn, castling, enpassant, halfmoves, fullmoves = (
+            fields[1:6] + defaults[len(fields)-1:])
+        self.white_to_move = turn == 'w'
+        self.stalemate_counter = int(halfmoves)
+        self.move_number = (2 * (int(fullmoves) - 1)
+                            + (0 if self.white_to_move else 1))
+
+        s = self.board.squares
+        for piece in self.board.get_pieces():
+            name, (file, rank) = piece.get_name(), piece.get_coords()
+            homeRank = self.rank_size - 1 if piece.get_color() == 'white' else 0
+            if name == 'Pawn':
+                startRank = homeRank + (-1 if piece.get_color() == 'white'
+                                        else 1)
+                if rank != startRank:
+                    piece.first_move = PREVIOUSLY_MOVED
+            elif name in ('King', 'Rook'):
+                piece.first_move = PREVIOUSLY_MOVED
+        for king, symbols in ((self.board.white_king, 'KQ'),
+                              (self.board.black_king, 'kq')):
+            if king is None:
+                continue
+            homeRank = self.rank_size - 1 if king.get_color() == 'white' else 0
+            for symbol, file in zip(symbols, (self.file_size - 1, 0)):
+                rook = s[file, homeRank].get_piece()
+                if (symbol in castling and rook is not None
+                        and rook.get_name() == 'Rook'):
+                    rook.first_move = None
+                    king.first_move = None
+
+        if enpassant != '-':
+            file, rank = algebraicToComputer(enpassant)
+            # The Pawn that moved two squares is one square past the target.
+            self.enpassant_coords = (
+                file, rank + (1 if self.white_to_move else -1))
+
+    def get_fen(self) -> str:
+        """Returns the current position as a FEN string."""
+        s = self.board.squares
+        rows = []
+        for rank in range(self.rank_size):
+            row, empty = '', 0
+            for file in range(self.file_size):
+                piece = s[file, rank].get_piece()
+                if piece is None:
+                    empty += 1
+                    continue
+                if empty:
+                    row += str(empty)
+                    empty = 0
+                symbol = piece.get_symbol()
+                row += symbol if piece.get_color() == 'white' else symbol.lower()
+            if empty:
+                row += str(empty)
+            rows.append(row)
+
+        rights = self.get_castling_rights()
+        castling = ''.join(
+            symbol for bit, symbol in enumerate('KQkq') if rights & 1 << bit)
+        enpassant = '-'
+        if self.enpassant_coords:
+            file, rank = self.enpassant_coords
+            enpassant = computerToAlgebraic(
+                file, rank + (-1 if self.white_to_move else 1))
+
+        return ' '.join([
+            '/'.join(rows),
+            'w' if self.white_to_move else 'b',
+            castling or '-',
+            enpassant,
+            str(self.stalemate_counter),
+            str(self.move_number // 2 + 1),
+        ])
     
     def make_new_move(self, move):
         """
@@ -69,6 +201,7 @@ class GameState():
         """
         pieces_set, pieces_removed = [], []
         if move.contains_enpassant():
+            pieces_removed.append(move.piece_captured)
             move.enpassant_square.remove_piece()
         elif move.piece_captured is not None:
             pieces_removed.append(move.piece_captured)
@@ -124,9 +257,11 @@ class GameState():
                 rookStartSquare.set_piece(rook)
             if move.contains_promotion():
                 pieces_removed.append(move.promotion_piece)
+                pieces_set.append(move.piece_moved)
             if self.move_log:  # Needed to prevent AI bugs.
                 previousMove, _ = self.move_log.copy().pop()
-                if (previousMove.piece_moved.get_name() == 'Pawn'
+                if (previousMove is not None  # None is a null move.
+                        and previousMove.piece_moved.get_name() == 'Pawn'
                         and (abs(previousMove.end_square.get_rank()
                              - previousMove.start_square.get_rank()) == 2)):
                     self.enpassant_coords = (
@@ -134,6 +269,8 @@ class GameState():
                     )
                 else:
                     self.enpassant_coords = ()
+            else:
+                self.enpassant_coords = self.start_enpassant_coords
 
             if self.checkmate:
                 self.checkmate = False
@@ -144,6 +281,78 @@ class GameState():
             self.undo_log.append((move, stalemate_counter))
             self.board.update_pieces(pieces_set, pieces_removed)
 
+    def get_castling_rights(self) -> int:
+        """
+        Returns the castling rights as four bits:
+
+            1 = White kingside, 2 = White queenside,
+            4 = Black kingside, 8 = Black queenside.
+
+        A side keeps a right as long as its King and the Rook in that
+        corner haven't moved.
+        """
+        s = self.board.squares
+        rights = 0
+        for bit, king, rank in ((0, self.board.white_king, self.rank_size-1),
+                                (2, self.board.black_king, 0)):
+            if (king is None or not king.is_on_board()
+                    or king.has_moved()):
+                continue
+            for shift, file in ((0, self.file_size-1), (1, 0)):
+                rook = s[file, rank].get_piece()
+                if (rook is not None and rook.get_name() == 'Rook'
+                        and rook.get_color() == king.get_color()
+                        and not rook.has_moved()):
+                    rights |= 1 << (bit + shift)
+
+        return rights
+
+    def get_position_key(self) -> int:
+        """
+        Returns a Zobrist hash of the current position.
+
+        The board's piece placement key is combined with the side to
+        move, the castling rights, and the en passant file. The en
+        passant file only counts when a Pawn can capture en passant, so
+        transpositions still get the same key.
+        """
+        key = self.board.get_zobrist_key()
+        if not self.white_to_move:
+            key ^= ZOBRIST_STATE_KEYS['blackToMove']
+        key ^= ZOBRIST_STATE_KEYS['castling'][self.get_castling_rights()]
+        if self.enpassant_coords:
+            file, rank = self.enpassant_coords
+            color = 'white' if self.white_to_move else 'black'
+            for x, _ in DIRECTIONS['HORIZONTAL']:
+                if 0 <= file + x < self.file_size:
+                    piece = self.board.squares[file + x, rank].get_piece()
+                    if (piece is not None and piece.get_name() == 'Pawn'
+                            and piece.get_color() == color):
+                        key ^= ZOBRIST_STATE_KEYS['enpassant'][file]
+                        break
+
+        return key
+
+    def make_null_move(self):
+        """
+        Passes the turn to the other side without moving a piece.
+
+        Used by the AI for null-move pruning. A None entry is put in
+        the move_log so that undoing moves made after the null move
+        doesn't restore an en passant capture from before it. Must be
+        reversed with undo_null_move().
+        """
+        self.move_log.append((None, self.enpassant_coords))
+        self.enpassant_coords = ()
+        self.white_to_move = not self.white_to_move
+        self.move_number += 1
+
+    def undo_null_move(self):
+        """Undoes a null move made with make_null_move()."""
+        _, self.enpassant_coords = self.move_log.pop()
+        self.white_to_move = not self.white_to_move
+        self.move_number -= 1
+
     def redo_move(self):
         """Redo a previously undone move."""
         if self.undo_log:
@@ -213,12 +422,16 @@ class GameState():
                 for move in reversed(moves):
                     if move.piece_moved.get_name() != 'King':
                         # Move doesn't move King so it must block or capture.
-                        if move.end_square not in validSquares:
+                        if (move.end_square not in validSquares
+                                and not (move.contains_enpassant()
+                                         and move.enpassant_square
+                                         == checkSquare)):
                         # i.e. if move doesn't block or capture.
                             moves.remove(move)
 
             else:  # Double check, so has to move.
                 self.get_king_and_knight_moves(king, moves)
+                self.count_attacks(moves)
 
         else:  # Not in check, so all moves (outside of pins) are fine.
             self.in_check = False
@@ -237,6 +450,9 @@ class GameState():
                         #    move.end_square.get_name()))
                         moves.remove(move)
                         # print(len(moves))
+                elif (move.contains_enpassant()
+                      and not self.is_enpassant_legal(move, king)):
+                    moves.remove(move)
 
         if not king.has_moved() and not self.in_check:
             self.get_castle_moves(king, moves)
@@ -253,6 +469,26 @@ class GameState():
             
         return moves
 
+    def is_enpassant_legal(self, move, king):
+        """
+        Returns whether an en passant capture leaves the King out of
+        check.
+
+        The capture takes two Pawns off the same rank at once, which the
+        pin checks can't see, so it is tried on the squares and taken
+        back.
+        """
+        pawn, captured = move.piece_moved, move.piece_captured
+        move.start_square.remove_piece()
+        move.enpassant_square.remove_piece()
+        move.end_square.set_piece(pawn)
+        checks = self.get_pins_and_checks(king)[1]
+        move.end_square.remove_piece()
+        move.enpassant_square.set_piece(captured)
+        move.start_square.set_piece(pawn)
+
+        return not checks
+
     def get_castle_moves(self, king, moves):
         """Adds castling moves to valid moves."""
         s = self.board.squares
@@ -266,7 +502,9 @@ class GameState():
                     rookSquare = s[kingFile + x, kingRank]
                     # If the king can't move to the first square to the
                     # side, he can't castle, move on to the next direction.
-                    if rookSquare == move.end_square:
+                    # Capturing a piece there doesn't count.
+                    if (rookSquare == move.end_square
+                            and not rookSquare.has_piece()):
                         castleFile = kingFile + x * 2
                         castleSquare = s[castleFile, kingRank]
                         # Make sure the square is unoccupied.
@@ -318,8 +556,37 @@ class GameState():
                     else:
                         self.find_moves_on_path(piece, moves)
 
+        self.count_attacks(moves)
         return moves
 
+    def count_attacks(self, moves):
+        """
+        Saves an AttackInfo for the side to move to attack_info, made
+        from the moves just generated for it.
+
+        Every non-Pawn move counts as an attack on its end square and as
+        a move for mobility. Pawns attack the squares diagonally in
+        front of them whether or not there is a piece to capture there.
+        """
+        counts = [0] * (self.file_size * self.rank_size)
+        mobility = 0
+        for move in moves:
+            if move.piece_moved.get_name() != 'Pawn':
+                end = move.end_square
+                counts[end.rank*self.file_size + end.file] += 1
+                mobility += 1
+        color = 'white' if self.white_to_move else 'black'
+        for pawn in self.board.get_pieces():
+            if (pawn.get_name() == 'Pawn' and pawn.get_color() == color
+                    and pawn.is_on_board()):
+                file, rank = pawn.get_coords()
+                rank += pawn.get_directions()[1]
+                if 0 <= rank < self.rank_size:
+                    for x in (file - 1, file + 1):
+                        if 0 <= x < self.file_size:
+                            counts[rank*self.file_size + x] += 1
+        self.attack_info = AttackInfo(color, counts, mobility)
+
     def is_piece_pinned(self, piece):
         """Checks if the piece is pinned to the King in any direction."""
         if piece.get_name() != 'King':
@@ -544,6 +811,102 @@ class GameState():
 
         return pins, checks
 
+    def get_attackers(self, square, color, removed=()):
+        """
+        Returns the pieces of the color that attack the square, ignoring
+        pins.
+
+        Pieces on the (file, rank) coordinates in removed are treated as
+        if they had left the board, so sliding pieces lined up behind
+        them (x-rays) are found too.
+        """
+        attackers = []
+        squares = self.board.squares
+        f, r = square.get_coords()
+        directions = (
+            DIRECTIONS['HORIZONTAL']
+            + DIRECTIONS['VERTICAL']
+            + DIRECTIONS['DIAGONAL']
+        )
+        for x, y in directions:
+            file, rank = f + x, r + y
+            distance = 1
+            while 0 <= file < self.file_size and 0 <= rank < self.rank_size:
+                if (file, rank) not in removed:
+                    piece = squares[file, rank].get_piece()
+                    if piece is not None:
+                        name = piece.get_name()
+                        # Pawns attack diagonally toward their promotion
+                        # rank, so a white Pawn attacking the square is
+                        # on the rank below it (rank + 1).
+                        if piece.get_color() == color and (
+                                (name == 'King' and distance == 1)
+                                or (name == 'Pawn' and distance == 1
+                                    and x != 0
+                                    and y == (1 if color == 'white' else -1))
+                                or (name not in ('King', 'Pawn')
+                                    and (x, y) in piece.get_directions())):
+                            attackers.append(piece)
+                        break
+                file, rank = file + x, rank + y
+                distance += 1
+
+        for x, y in DIRECTIONS['KNIGHT']:
+            file, rank = f + x, r + y
+            if (0 <= file < self.file_size and 0 <= rank < self.rank_size
+                    and (file, rank) not in removed):
+                piece = squares[file, rank].get_piece()
+                if (piece is not None and piece.get_color() == color
+                        and piece.get_name() == 'Knight'):
+                    attackers.append(piece)
+
+        return attackers
+
+    def static_exchange(self, move):
+        """
+        Returns the material the side making the move can expect to win
+        from the exchange of captures it starts on the move's end square.
+
+        Both sides recapture with their least valuable attacker
+        (including x-ray attackers behind pieces that have already
+        captured) and either side can stop when going on would lose
+        material. Pins and checks are ignored. Uses SEE_PIECE_VALUES.
+        """
+        values = SEE_PIECE_VALUES
+        target = move.end_square
+        removed = {move.start_square.get_coords()}
+        if move.contains_enpassant():
+            gain = [values['Pawn']]
+            removed.add(move.enpassant_square.get_coords())
+        elif move.piece_captured is not None:
+            gain = [values[move.piece_captured.get_name()]]
+        else:
+            gain = [0]
+        onSquare = values[move.piece_moved.get_name()]
+        if move.contains_promotion():
+            onSquare = values[move.promotion_piece.get_name()]
+            gain[0] += onSquare - values['Pawn']
+
+        color = 'black' if move.piece_moved.get_color() == 'white' else 'white'
+        while True:
+            attackers = self.get_attackers(target, color, removed)
+            if not attackers:
+                break
+            attacker = min(attackers,
+                           key=lambda piece: values[piece.get_name()])
+            # What the side capturing now wins if the other side stops.
+            gain.append(onSquare - gain[-1])
+            onSquare = values[attacker.get_name()]
+            removed.add(attacker.get_coords())
+            color = 'black' if color == 'white' else 'white'
+
+        # Each side only captures if it is better than stopping.
+        while len(gain) > 1:
+            score = gain.pop()
+            gain[-1] = -max(-gain[-1], score)
+
+        return gain[0]
+
     def promote(self, choice, move):
         """Promotes Pawn to Queen, Knight, Rook, or Bishop."""
         if move.piece_moved.get_name() == 'Pawn':
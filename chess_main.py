@@ -29,6 +29,18 @@ IMAGES = {}                             # Setup for loadImages().
 FLIPPEDBOARD = [i for i in reversed(range(DIMENSION))]  # For getting screen
     # coordinates when the board is drawn from Black's perspective.
 UPSIDEDOWN = False
+SEARCH_CACHE_FILE = None  # Path of a file to keep the AI's search cache in
+    # between games, e.g. 'search_cache.bin'. None keeps it in memory only.
+OPENING_BOOK_FILE = None  # Path of an opening book for the AI made with
+    # ai.buildOpeningBook(), e.g. 'book.bin'. None searches every move.
+TABLEBASE_FILES = ()  # Endgame tablebases for the AI made with
+    # chess_tablebase.generateTablebaseFiles(), e.g. ('KQK.tb', 'KRK.tb').
+NETWORK_FILE = None  # Path of a chess_nnue network for the AI to evaluate
+    # positions with, e.g. 'network.npz'. None uses the piece-square scores.
+PONDER = True  # The AI searches the reply it expects during the human's turn.
+MIN_DISPLAY_TIME = 200  # Minimum time in ms between the human's move and the
+    # AI's reply, so the human's move can be seen. Overlaps the AI's search.
+HINT_DEPTH = 5  # Deepest search for the hint shown when H is pressed.
 
 
 def main():
@@ -41,6 +53,14 @@ def main():
     humanWhite, humanBlack, theme_name = mainMenu()
     if theme_name not in themes.keys():
         theme_name = "blue"
+    if SEARCH_CACHE_FILE is not None:
+        ai.useCacheFile(SEARCH_CACHE_FILE)
+    if OPENING_BOOK_FILE is not None:
+        ai.useOpeningBook(OPENING_BOOK_FILE)
+    for filename in TABLEBASE_FILES:
+        ai.useTablebase(filename)
+    if NETWORK_FILE is not None:
+        ai.useNetwork(NETWORK_FILE)
     p.init()
     screen = p.display.set_mode((WIDTH, HEIGHT))
     p.display.set_caption(CAPTION)
@@ -60,6 +80,9 @@ def main():
     playerClicks = []  # Keep track of player clicks
         # (two tuples: [(4, 6), (4, 4)] would be (e2 pawn to) e4)
     highlight_last_move = True
+    aiSearch = None  # Background search for the AI's next move.
+    lastMoveTime = 0  # Time in ms when the human last moved.
+    hintSearch = None  # Background search for the human's hint.
     # humanWhite = True  # True if human player is white.
     # humanBlack = True  # True if human player is black.
     if humanBlack and not humanWhite:
@@ -73,6 +96,10 @@ def main():
         for event in p.event.get():
             # Allows the game to be closed.
             if event.type == p.QUIT:
+                if aiSearch is not None:
+                    aiSearch.cancel()
+                if hintSearch is not None:
+                    hintSearch.cancel()
                 exitGame()
 
             # Mouse handlers
@@ -117,6 +144,19 @@ def main():
                                             and pieceMoved.can_promote()):
                                         promoteMenu(validMove)
                                     gs.make_new_move(validMove)
+                                    if (aiSearch is not None
+                                            and not aiSearch.ponder_hit(
+                                                validMove)):
+                                        # Ponder miss.
+                                        aiSearch.cancel()
+                                        aiSearch = None
+                                    if (aiSearch is None
+                                            and not (humanWhite
+                                                     and humanBlack)):
+                                        # The AI thinks during the
+                                        # animation.
+                                        aiSearch = ai.startSearch(gs)
+                                    lastMoveTime = p.time.get_ticks()
                                     animateMove(validMove, validMoves)
                                     printMove(validMove)  # For debugging.
                                     moveMade = True
@@ -138,6 +178,10 @@ def main():
                 if ((event.mod & p.KMOD_CTRL and event.key == p.K_z)
                     or event.key == p.K_LEFT
                     or event.key == p.K_a):
+                    if aiSearch is not None:
+                        # The position is changing, so stop the AI.
+                        aiSearch.cancel()
+                        aiSearch = None
                     if gs.move_log:
                         board.update_pieces(gs.undo_move())
                         move = gs.undo_log.copy().pop()[0]
@@ -157,20 +201,41 @@ def main():
                         animateMove(move, validMoves)
                         print('Redid {}'.format(str(move)), end=' ')  # For debugging.
                         moveMade = True
-
-        # AI move finder
+                # Show a hint for the human's move when H is pressed.  It
+                # gets better as the search deepens.
+                if event.key == p.K_h and humanTurn and not gs.gameover:
+                    if hintSearch is not None:
+                        hintSearch.cancel()
+                    hintSearch = ai.startAnalysis(gs, HINT_DEPTH)
+
+        # AI move finder.  The search runs in the background, so the
+        # window keeps drawing and handling events while the AI thinks.
         if (not moveMade and not gs.gameover and not humanTurn
                 and not gs.undo_log):
-            AIMove = ai.getBestMove(gs)
-            if AIMove is None:
-                AIMove = ai.getRandomMove(validMoves)
-            p.time.wait(200)
-            gs.make_new_move(AIMove)
-            animateMove(AIMove, validMoves)
-            printMove(AIMove)  # For debugging.
-            moveMade = True
+            if aiSearch is None:
+                aiSearch = ai.startSearch(gs)
+            elif (aiSearch.done() and p.time.get_ticks() - lastMoveTime
+                    >= MIN_DISPLAY_TIME):
+                search = aiSearch
+                AIMove = search.get_move(gs)
+                aiSearch = None
+                if AIMove is None:
+                    AIMove = ai.getRandomMove(validMoves)
+                gs.make_new_move(AIMove)
+                # Think about the expected reply while the human does.
+                humanNext = ((gs.white_to_move and humanWhite)
+                             or (not gs.white_to_move and humanBlack))
+                if PONDER and humanNext:
+                    aiSearch = ai.startPondering(gs, search)
+                animateMove(AIMove, validMoves)
+                printMove(AIMove)  # For debugging.
+                moveMade = True
         
         if moveMade:
+            if hintSearch is not None:
+                # The hint is for the old position.
+                hintSearch.cancel()
+                hintSearch = None
             gs.valid_moves = gs.get_valid_moves()
             validMoves = gs.valid_moves
             if playerClicks:
@@ -180,7 +245,7 @@ def main():
             moveMade = False
 
         gs.find_mate(validMoves)
-        drawGameState(validMoves)
+        drawGameState(validMoves, hintSearch)
 
         if gs.gameover:
             s = p.Surface((WIDTH, HEIGHT))
@@ -223,9 +288,12 @@ def loadImages():
             IMAGES[pieceName].convert()
 
 
-def drawGameState(validMoves):
+def drawGameState(validMoves, hintSearch=None):
     """
     Responsible for all the graphics within a current gamestate.
+
+    If a hint search is given, the best move it has found so far is
+    highlighted.
     """
     # Draw squares on the board.
     drawBoard(validMoves)
@@ -234,7 +302,9 @@ def drawGameState(validMoves):
     # Highlight selected square and movement/capture squares.
     if selectedSquare is not None:
         highlightSquares(validMoves)
-    # Add in piece highlighting or move suggestions (later)
+    # Move suggestions.
+    if hintSearch is not None and hintSearch.move_code != ai.NO_MOVE:
+        highlightHint(hintSearch.move_code)
     drawPieces()  # Draw pieces on the board.
 
 
@@ -298,40 +368,48 @@ def highlightLastMove():
 # =============================================================================
 
 
-def highlightSquares(validMoves):
-    """
-    Highlights squares on the board
-    related to the current selected piece.
-    """
-    file, rank = getSquareCoordinates(selectedSquare)
-    color = getSquareThemeHighlightColor(selectedSquare)
-
+def highlightStartSquare(square):
+    """Fills the square a piece moves from with the theme's highlight."""
+    file, rank = getSquareCoordinates(square)
     p.draw.rect(
-        screen, color, p.Rect(
+        screen, getSquareThemeHighlightColor(square), p.Rect(
             file * SQ_SIZE, rank * SQ_SIZE,
             SQ_SIZE, SQ_SIZE,
         )
     )
+
+
+def highlightEndSquare(square, capture):
+    """
+    Marks a square a piece can move to, in red for a capture and in
+    translucent green otherwise.
+    """
+    file, rank = getSquareCoordinates(square)
+    surface = p.Surface((SQ_SIZE, SQ_SIZE))
+    if capture:
+        surface.fill((230, 118, 118))
+    else:
+        surface.set_alpha(80)
+        surface.fill(p.Color('green'))
+    screen.blit(surface, (file * SQ_SIZE, rank * SQ_SIZE,))
+
+
+def highlightSquares(validMoves):
+    """
+    Highlights squares on the board
+    related to the current selected piece.
+    """
+    highlightStartSquare(selectedSquare)
     moveSquares, captureSquares = (
         markMovementSquares(selectedSquare, validMoves)
     )
     # Draw markers for move squares:
-    if moveSquares:
-        for square in moveSquares:
-            file, rank = getSquareCoordinates(square)
-            surface = p.Surface((SQ_SIZE, SQ_SIZE))
-            surface.set_alpha(80)
-            surface.fill(p.Color('green'))
-            screen.blit(surface, (file * SQ_SIZE, rank * SQ_SIZE,))
+    for square in moveSquares:
+        highlightEndSquare(square, False)
 
     # Draw markers for capture squares.
-    if captureSquares:
-        for square in captureSquares:
-            file, rank = getSquareCoordinates(square)
-            attackSquare = p.Surface((SQ_SIZE, SQ_SIZE))
-            attackSquare.fill((230, 118, 118))
-            attackSquare.set_alpha(255)
-            screen.blit(attackSquare, (file * SQ_SIZE, rank * SQ_SIZE,))
+    for square in captureSquares:
+        highlightEndSquare(square, True)
 # =============================================================================
 # This is for using circles instead of highlighting the square.
 #             p.draw.circle(
@@ -344,6 +422,16 @@ def highlightSquares(validMoves):
 # =============================================================================
 
 
+def highlightHint(moveCode):
+    """
+    Highlights the start and end squares of a suggested move in the
+    same style as the squares of a selected piece.
+    """
+    startSquare, endSquare = ai.getMoveSquares(gs.board, moveCode)
+    highlightStartSquare(startSquare)
+    highlightEndSquare(endSquare, endSquare.has_piece())
+
+
 def drawPieces():
     """
     Draw the pieces on the board using the current GameState.board.
@@ -550,6 +638,8 @@ def drawText(text, font_size, font='Helvetica', othickness=3, xoffset=0,
 
 def exitGame():
     """Exits Pygame."""
+    ai.closeCacheFile()
+    ai.closeOpeningBook()
     p.quit()
     sys.exit()
 
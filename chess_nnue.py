@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains a small NNUE-style neural network evaluator that
+runs on the CPU with NumPy.
+
+The first layer takes one input for each piece on each square, seen
+from each side, so its output for a position is the sum of one row of
+weights per piece. Boards keep that sum, the accumulator, up to date
+as pieces are set and removed (see chess_board.setAccumulatorRows()),
+so only the small dense layers after it are run for each position.
+"""
+
+__all__ = ['Network', 'saveNetwork', 'makeNetworkWeights',
+           'getFeatureIndices']
+
+import hashlib
+
+import numpy as np
+
+NUM_FEATURES = 2 * 6 * 64  # Own and enemy pieces, piece, then square.
+PIECES = 'PNBRQK'  # Order of the pieces in the features.
+# Arrays in a network file, with their shapes in terms of the number of
+# features, accumulator size, and head size.
+WEIGHT_SHAPES = dict(  # Name: shape
+    inputWeights = ('features', 'accumulator'),
+    inputBiases = ('accumulator',),
+    hiddenWeights = ('2 * accumulator', 'head'),
+    hiddenBiases = ('head',),
+    outputWeights = ('head',),
+    outputBias = (),
+)
+
+
+def getFeatureIndices(color, symbol, file, rank):
+    """
+    Returns the first-layer inputs of a piece on a square, from White's
+    side and from Black's.
+
+    Each side sees its own pieces first, then the enemy's, in the order
+    of PIECES, each with 64 squares numbered 8*rank + file from the
+    side's own end of the board.
+    """
+    piece = PIECES.index(symbol)
+    white = 64*(piece + (0 if color == 'w' else 6)) + 8*rank + file
+    black = 64*(piece + (6 if color == 'w' else 0)) + 8*(7 - rank) + file
+    return white, black
+
+
+class Network():
+    """
+    Neural network evaluator loaded from a .npz file (see saveNetwork()).
+
+    The accumulator holds the first layer's sums from White's side and
+    from Black's. The side to move's half goes first into a clipped
+    ReLU, then a dense layer, another clipped ReLU, and a single output
+    for the side to move, in pawns.
+    """
+    def __init__(self, filename: str) -> None:
+        with np.load(filename) as data:
+            weights = {name: data[name].astype(np.float32)
+                       for name in WEIGHT_SHAPES}
+        self.input_weights = weights['inputWeights']
+        self.input_biases = weights['inputBiases']
+        self.hidden_weights = weights['hiddenWeights']
+        self.hidden_biases = weights['hiddenBiases']
+        self.output_weights = weights['outputWeights']
+        self.output_bias = float(weights['outputBias'])
+        if (self.input_weights.shape[0] != NUM_FEATURES
+                or self.hidden_weights.shape[0]
+                != 2 * len(self.input_biases)):
+            raise ValueError(f"'{filename}' doesn't hold a network with "
+                             f"{NUM_FEATURES} inputs.")
+        # The biases of both halves of the accumulator, side to move first.
+        self.accumulator_biases = np.tile(self.input_biases, 2)
+        # Identifies the weights, e.g. in chess_ai.getEvalKey().
+        self.digest = hashlib.blake2b(
+            b''.join(weights[name].tobytes() for name in WEIGHT_SHAPES),
+            digest_size=8).hexdigest()
+
+    def get_accumulator_rows(self) -> dict:
+        """
+        Returns the arguments for chess_board.setAccumulatorRows(): for
+        each piece, an array indexed by file and rank of its first-layer
+        rows from White's side and from Black's.
+
+        The rows are float64, so the rounding errors of adding and
+        taking them away during a long search stay negligible.
+        """
+        accumulatorRows = {}
+        for color in 'wb':
+            for symbol in PIECES:
+                rows = np.empty((8, 8, 2, len(self.input_biases)))
+                for file in range(8):
+                    for rank in range(8):
+                        indices = getFeatureIndices(color, symbol, file, rank)
+                        rows[file, rank] = self.input_weights[list(indices)]
+                accumulatorRows[color + symbol] = rows
+
+        return accumulatorRows
+
+    def evaluate(self, accumulator, whiteToMove: bool) -> float:
+        """
+        Scores a position from its accumulator. A positive score is good
+        for white, and a negative score is good for black.
+        """
+        if whiteToMove:
+            sums = np.concatenate((accumulator[0], accumulator[1]))
+        else:
+            sums = np.concatenate((accumulator[1], accumulator[0]))
+        score = self.run_head(sums + self.accumulator_biases)
+        return score if whiteToMove else -score
+
+    def evaluate_positions(self, positions, whiteToMove):
+        """
+        Scores a batch of encoded boards (see chess_ai.encodeBoard()) by
+        running the whole network, without accumulators. whiteToMove is
+        an array of the side to move in each. Returns an array of scores
+        like evaluate().
+        """
+        positions = np.asarray(positions).reshape(-1, 64)
+        whiteToMove = np.asarray(whiteToMove, dtype=bool)
+        features = np.zeros((len(positions), 2, NUM_FEATURES),
+                            dtype=np.float32)
+        rows, squares = np.nonzero(positions)
+        for row, square in zip(rows, squares):
+            code = positions[row, square]
+            color = 'w' if code <= 6 else 'b'
+            white, black = getFeatureIndices(
+                color, PIECES[(code - 1) % 6], square % 8, square // 8)
+            features[row, 0, white] = 1
+            features[row, 1, black] = 1
+        sums = features @ self.input_weights + self.input_biases
+        # The side to move's half first.
+        sums[~whiteToMove] = sums[~whiteToMove, ::-1]
+        scores = self.run_head(sums.reshape(len(positions), -1))
+        return np.where(whiteToMove, scores, -scores)
+
+    def run_head(self, sums):
+        """
+        Runs the layers after the first on its sums, side to move first,
+        and returns the side to move's score.
+        """
+        hidden = np.clip(sums, 0, 1) @ self.hidden_weights + self.hidden_biases
+        return np.clip(hidden, 0, 1) @ self.output_weights + self.output_bias
+
+
+def saveNetwork(filename: str, weights: dict) -> None:
+    """
+    Saves a network's weights, a dictionary of the arrays in
+    WEIGHT_SHAPES, to a compressed .npz file as float32.
+    """
+    np.savez_compressed(filename, **{
+        name: np.asarray(weights[name], dtype=np.float32)
+        for name in WEIGHT_SHAPES})
+
+
+def makeNetworkWeights(accumulatorSize: int=128, headSize: int=32,
+                       seed: int=None) -> dict:
+    """
+    Makes randomly initialized weights for a network with the sizes, as
+    a starting point for training. Returns a dictionary for saveNetwork().
+    """
+    rng = np.random.default_rng(seed)
+    sizes = {'features': NUM_FEATURES, 'accumulator': accumulatorSize,
+             '2 * accumulator': 2 * accumulatorSize, 'head': headSize}
+    weights = {}
+    for name, shape in WEIGHT_SHAPES.items():
+        shape = tuple(sizes[size] for size in shape)
+        if name.endswith('Weights'):
+            weights[name] = rng.normal(0, 1 / np.sqrt(shape[0]), shape)
+        else:
+            weights[name] = np.zeros(shape)
+
+    return weights
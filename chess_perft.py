@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+This module counts the move paths from a position to a given depth
+(perft) to check that GameState.get_valid_moves() finds the right moves,
+and to measure how fast it finds them. Deep counts can be split across
+worker processes (see parallelPerft()).
+"""
+
+__all__ = ['perft', 'dividePerft', 'runPerft', 'printPerft',
+           'checkPerftPositions', 'parallelPerft', 'PerftResult',
+           'PERFT_POSITIONS']
+
+import time
+from collections import namedtuple
+from copy import copy
+from multiprocessing import Pool
+
+from chess_cache import EvalCache
+from chess_engine import GameState
+
+# Standard test positions with their known counts, from depth 1 up.
+PERFT_POSITIONS = dict(  # Name: (FEN, counts)
+    start = (
+        'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+        (20, 400, 8902, 197281, 4865609, 119060324),
+    ),
+    kiwipete = (
+        'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+        (48, 2039, 97862, 4085603, 193690690),
+    ),
+    position3 = (
+        '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+        (14, 191, 2812, 43238, 674624, 11030083),
+    ),
+    position4 = (
+        'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+        (6, 264, 9467, 422333, 15833292),
+    ),
+    position5 = (
+        'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+        (44, 1486, 62379, 2103487, 89941194),
+    ),
+    position6 = (
+        'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+        (46, 2079, 89890, 3894594, 164075551),
+    ),
+)
+PROMOTION_CHOICES = 'qrbk'  # For GameState.promote(); 'k' is a Knight.
+PERFT_TABLE_SIZE = 2**18  # Slots in the table of counts (see perft()).
+
+PerftResult = namedtuple('PerftResult', ['nodes', 'seconds', 'nps',
+                                         'divide'])
+workerTable = None  # Counts kept by a worker process between tasks.
+
+
+def isPromotion(move):
+    """Returns whether a move is a Pawn move to its last rank."""
+    pieceMoved = move.piece_moved
+    return (pieceMoved.get_name() == 'Pawn'
+            and move.end_square.get_rank() == pieceMoved.get_promotion_rank())
+
+
+def getPerftMoves(gs):
+    """
+    Returns the legal moves in the position, with one move for each
+    piece a Pawn can promote to.
+    """
+    moves = []
+    for move in gs.get_valid_moves():
+        if isPromotion(move):
+            for choice in PROMOTION_CHOICES:
+                promotion = copy(move)
+                gs.promote(choice, promotion)
+                moves.append(promotion)
+        else:
+            moves.append(move)
+
+    return moves
+
+
+def perft(gs, depth, table=None):
+    """
+    Returns the number of move paths depth plies long from the position.
+
+    The moves at the last ply are counted without making them. With a
+    table, an EvalCache (see makePerftTable()), the counts of the
+    positions searched at least two plies deep are kept in it by
+    position key and depth, so a position reached again by another
+    order of moves isn't searched again. Counts one ply deep are cheap
+    enough to find again, so they aren't stored.
+    """
+    if depth == 0:
+        return 1
+
+    if table is not None and depth > 1:
+        key = gs.get_position_key() << 8 | depth
+        nodes = table.probe(key)
+        if nodes is not None:
+            return nodes
+
+    if depth == 1:
+        moves = gs.get_valid_moves()
+        nodes = len(moves) + 3 * sum(isPromotion(move) for move in moves)
+    else:
+        nodes = 0
+        for move in getPerftMoves(gs):
+            gs.make_move(move)
+            nodes += perft(gs, depth - 1, table)
+            gs.undo_move()
+            gs.undo_log.pop()
+
+    if table is not None and depth > 1:
+        table.store(key, nodes)
+    return nodes
+
+
+def makePerftTable(size=PERFT_TABLE_SIZE):
+    """
+    Returns a table of size slots for perft() to keep its counts in. A
+    count replaces the one in its slot, so the table's memory stays the
+    same however deep the search goes.
+    """
+    return EvalCache(size)
+
+
+def getMoveName(move):
+    """
+    Returns the name of a move as its start and end squares and the
+    piece it promotes to, e.g., 'e2e4' or 'a7a8q', like other programs'
+    divide output.
+    """
+    name = move.start_square.get_name() + move.end_square.get_name()
+    if move.contains_promotion():
+        name += move.promotion_piece.get_symbol().lower()
+
+    return name
+
+
+def dividePerft(gs, depth, table=None):
+    """
+    Returns a dictionary of the perft count below each legal move, by
+    getMoveName(), to find which move a wrong count comes from. The
+    depth must be at least 1.
+    """
+    if depth < 1:
+        raise ValueError(f'Perft depth must be at least 1, not {depth}.')
+
+    divide = {}
+    for move in getPerftMoves(gs):
+        gs.make_move(move)
+        divide[getMoveName(move)] = perft(gs, depth - 1, table)
+        gs.undo_move()
+        gs.undo_log.pop()
+
+    return divide
+
+
+def findMove(gs, name):
+    """Returns the legal move with a name from getMoveName()."""
+    for move in getPerftMoves(gs):
+        if getMoveName(move) == name:
+            return move
+
+    raise ValueError(f"'{name}' isn't a legal move.")
+
+
+def getPerftTasks(fen, depth, splitDepth):
+    """
+    Returns the lists of move names that lead from the FEN to the
+    positions splitDepth plies in, or fewer where the game ends first,
+    for parallelPerft() to share out.
+    """
+    gs = GameState(fen)
+    tasks = []
+
+    def addTasks(names):
+        if len(names) == min(splitDepth, depth):
+            tasks.append(names)
+            return
+        moves = getPerftMoves(gs)
+        if not moves and names:
+            tasks.append(names)  # Still in the divide counts, as 0.
+        for move in moves:
+            gs.make_move(move)
+            addTasks(names + [getMoveName(move)])
+            gs.undo_move()
+            gs.undo_log.pop()
+
+    addTasks([])
+    return tasks
+
+
+def startPerftWorker(useTable):
+    """Sets up a worker process's table for runPerftTask()."""
+    global workerTable
+    workerTable = makePerftTable() if useTable else None
+
+
+def runPerftTask(args):
+    """
+    Takes a tuple of a FEN, a list of move names from it, and the depth
+    of the perft from the FEN. Rebuilds the position after the moves
+    and returns the names and the perft count below them.
+
+    The worker keeps its table between tasks, so positions reached from
+    more than one of its tasks are only searched once.
+    """
+    fen, names, depth = args
+    gs = GameState(fen)
+    for name in names:
+        gs.make_move(findMove(gs, name))
+
+    return names, perft(gs, depth - len(names), workerTable)
+
+
+def parallelPerft(fen, depth, processes=None, splitDepth=1, useTable=True):
+    """
+    Runs perft to depth from a FEN in processes worker processes (the
+    number of CPUs if None) and times it. Returns a PerftResult like
+    runPerft().
+
+    The moves splitDepth plies deep (1 or 2) are shared out among the
+    workers, which are only sent the FEN and the names of the moves, and
+    the counts below them are added up by root move. Splitting at the
+    second ply makes many more, smaller tasks, which keeps all the
+    workers busy to the end when there are only a few root moves.
+    """
+    if depth < 1:
+        raise ValueError(f'Perft depth must be at least 1, not {depth}.')
+
+    startTime = time.perf_counter()
+    tasks = [(fen, names, depth)
+             for names in getPerftTasks(fen, depth, splitDepth)]
+    # The tasks with the most plies left first, so a large one isn't
+    # left for last.
+    tasks.sort(key=lambda task: len(task[1]))
+    divide = {}
+    with Pool(processes, startPerftWorker, (useTable,)) as pool:
+        for names, nodes in pool.imap_unordered(runPerftTask, tasks):
+            divide[names[0]] = divide.get(names[0], 0) + nodes
+    seconds = time.perf_counter() - startTime
+    nodes = sum(divide.values())
+
+    return PerftResult(nodes, seconds,
+                       int(nodes / seconds) if seconds > 0 else 0, divide)
+
+
+def runPerft(fen, depth, useTable=True):
+    """
+    Runs perft to depth from a FEN and times it. Returns a PerftResult
+    of the count, seconds taken, nodes per second, and the divide
+    counts (see dividePerft()).
+    """
+    gs = GameState(fen)
+    startTime = time.perf_counter()
+    divide = dividePerft(gs, depth, makePerftTable() if useTable else None)
+    seconds = time.perf_counter() - startTime
+    nodes = sum(divide.values())
+
+    return PerftResult(nodes, seconds,
+                       int(nodes / seconds) if seconds > 0 else 0, divide)
+
+
+def printPerft(fen, depth, useTable=True):
+    """Prints the divide counts, total, and speed of perft from a FEN."""
+    result = runPerft(fen, depth, useTable)
+    for name, nodes in sorted(result.divide.items()):
+        print(f'{name}: {nodes}')
+    print(f'\nNodes: {result.nodes}')
+    print(f'Time: {result.seconds:.3f} s ({result.nps} nodes/s)')
+
+
+def checkPerftPositions(maxDepth=3, useTable=True):
+    """
+    Runs perft on each of PERFT_POSITIONS up to maxDepth. Returns a list
+    of (name, depth, expected count, count found) for the counts that
+    are wrong, so an empty list means the move generator passed.
+    """
+    failures = []
+    for name, (fen, counts) in PERFT_POSITIONS.items():
+        for depth, expected in enumerate(counts[:maxDepth], 1):
+            nodes = runPerft(fen, depth, useTable).nodes
+            if nodes != expected:
+                failures.append((name, depth, expected, nodes))
+
+    return failures
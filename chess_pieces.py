@@ -151,8 +151,7 @@ class Piece:
         Assigns a Square object to the Piece and then assigns the Piece
         to that same Square object.
         """
-        self.square = square
-        square.piece = self
+        square.set_piece(self)
     
     def is_on_board(self) -> bool:
         """
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+This module makes random legal positions with given material, for
+benchmarks, checking tablebases, and training data. The pieces are
+placed with vectorized NumPy operations, a batch at a time, and
+placements that aren't legal are thrown away.
+"""
+
+__all__ = ['generateRandomPlacements', 'getRandomFENs',
+           'makeRandomGameStates', 'parseSignature']
+
+import numpy as np
+
+from chess_engine import GameState
+from chess_tablebase import ATTACKS, BETWEEN
+
+BATCH_SIZE = 4096  # Placements tried at a time.
+MAX_EMPTY_BATCHES = 100  # Batches in a row with no legal placement.
+SIGNATURE_PIECES = 'KQRBNP'
+
+
+def makePawnAttacks():
+    """
+    Returns whether a Pawn of each color attacks a square from another
+    square, indexed by 8*rank + file. White's Pawns move toward rank 0.
+    """
+    pawnAttacks = {}
+    for color, forward in (('w', -1), ('b', 1)):
+        table = np.zeros((64, 64), bool)
+        for square in range(64):
+            file, rank = square % 8, square // 8 + forward
+            for x in (-1, 1):
+                if 0 <= file + x < 8 and 0 <= rank < 8:
+                    table[square, 8*rank + file + x] = True
+        pawnAttacks[color] = table
+
+    return pawnAttacks
+
+
+PAWN_ATTACKS = makePawnAttacks()
+
+
+def parseSignature(signature):
+    """
+    Splits a material signature into White's and Black's pieces, e.g.
+    'KRPvKR' into ('KRP', 'KR'). Without a 'v', Black's pieces start at
+    the second King, so 'KQK' is ('KQ', 'K').
+    """
+    signature = signature.upper()
+    if 'V' in signature:
+        white, _, black = signature.partition('V')
+    else:
+        second = signature.find('K', 1)
+        white, black = signature[:second], signature[second:]
+    for pieces in (white, black):
+        if (pieces.count('K') != 1 or pieces.count('P') > 8
+                or any(symbol not in SIGNATURE_PIECES for symbol in pieces)):
+            raise ValueError(f"Invalid material signature '{signature}'.")
+
+    return white, black
+
+
+def generateRandomPlacements(signature, count, seed=None, whiteToMove=None):
+    """
+    Places the pieces of a material signature (see parseSignature()) at
+    random on count boards, so that neither King is in check and no
+    Pawn is on the first or last rank.
+
+    Returns an array of the squares, 8*rank + file, of each placement's
+    pieces in the order of the signature, and an array of whether White
+    is to move in each. whiteToMove picks the side to move for all of
+    them, or at random if it is None.
+
+    The same seed gives the same placements, and asking for more only
+    adds placements to the end. Raises ValueError if MAX_EMPTY_BATCHES
+    batches in a row have no legal placement, e.g. for a signature with
+    too many pieces to place without a check.
+    """
+    white, black = parseSignature(signature)
+    symbols = white + black
+    colors = 'w' * len(white) + 'b' * len(black)
+    whiteKing, blackKing = symbols.index('K'), symbols.rindex('K')
+    pawns = [i for i, symbol in enumerate(symbols) if symbol == 'P']
+    others = [i for i, symbol in enumerate(symbols) if symbol != 'P']
+    rng = np.random.default_rng(seed)
+    placements = [np.empty((0, len(symbols)), dtype=np.int8)]
+    sides = [np.empty(0, dtype=bool)]
+    found = emptyBatches = 0
+    while found < count:
+        # The Pawns go on the ranks in between first, then the other
+        # pieces on the squares left, in random order.
+        squares = np.empty((BATCH_SIZE, len(symbols)), dtype=np.intp)
+        squares[:, pawns] = rng.permuted(
+            np.tile(np.arange(8, 56), (BATCH_SIZE, 1)), axis=1)[:, :len(pawns)]
+        order = rng.random((BATCH_SIZE, 64))
+        np.put_along_axis(order, squares[:, pawns], 2, axis=1)
+        squares[:, others] = np.argsort(order, axis=1)[:, :len(others)]
+        if whiteToMove is None:
+            toMove = rng.random(BATCH_SIZE) < 0.5
+        else:
+            toMove = np.full(BATCH_SIZE, bool(whiteToMove))
+
+        legal = np.ones(BATCH_SIZE, dtype=bool)
+        occupied = np.bitwise_or.reduce(
+            np.left_shift(np.uint64(1), squares.astype(np.uint64)), axis=1)
+        for king, enemyColor in ((whiteKing, 'b'), (blackKing, 'w')):
+            kingSquares = squares[:, king]
+            for i, (symbol, color) in enumerate(zip(symbols, colors)):
+                if color != enemyColor:
+                    continue
+                if symbol == 'P':
+                    attacks = PAWN_ATTACKS[color][squares[:, i], kingSquares]
+                else:
+                    attacks = ATTACKS[symbol][squares[:, i], kingSquares]
+                # Nothing in the way.
+                attacks &= (BETWEEN[squares[:, i], kingSquares]
+                            & occupied) == 0
+                legal &= ~attacks
+
+        placements.append(squares[legal].astype(np.int8))
+        sides.append(toMove[legal])
+        found += int(legal.sum())
+        emptyBatches = 0 if legal.any() else emptyBatches + 1
+        if emptyBatches == MAX_EMPTY_BATCHES:
+            raise ValueError(f"No legal placements found for '{signature}'.")
+
+    return (np.concatenate(placements)[:count],
+            np.concatenate(sides)[:count])
+
+
+def getFEN(symbols, colors, squares, whiteToMove):
+    """
+    Returns the FEN of the pieces on the squares, with no castling
+    rights or en passant square.
+    """
+    board = ['1'] * 64
+    for symbol, color, square in zip(symbols, colors, squares):
+        board[square] = symbol if color == 'w' else symbol.lower()
+    rows = []
+    for rank in range(8):
+        row = ''.join(board[8*rank:8*rank + 8])
+        for run in range(8, 1, -1):
+            row = row.replace('1' * run, str(run))
+        rows.append(row)
+
+    return '/'.join(rows) + (' w' if whiteToMove else ' b') + ' - - 0 1'
+
+
+def getRandomFENs(signature, count, seed=None, whiteToMove=None):
+    """
+    Returns the FENs of count random legal positions with the material
+    of the signature (see generateRandomPlacements()).
+    """
+    white, black = parseSignature(signature)
+    colors = 'w' * len(white) + 'b' * len(black)
+    placements, sides = generateRandomPlacements(signature, count, seed,
+                                                 whiteToMove)
+    return [getFEN(white + black, colors, squares, side)
+            for squares, side in zip(placements.tolist(), sides)]
+
+
+def makeRandomGameStates(signature, count, seed=None, whiteToMove=None):
+    """
+    Yields count GameStates of random legal positions with the material
+    of the signature (see generateRandomPlacements()).
+    """
+    for fen in getRandomFENs(signature, count, seed, whiteToMove):
+        yield GameState(fen)
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+This module plays the AI against itself without the Pygame window to
+make training data for evaluators. Games are played in parallel worker
+processes, and the positions searched in them are written with their
+search scores and the games' results to compressed shard files.
+"""
+
+__all__ = ['runSelfPlay', 'playSelfPlayGame', 'loadShard', 'ShardWriter',
+           'loadManifest']
+
+import json
+import os
+import random as rn
+from collections import Counter
+from multiprocessing import Pool
+
+import numpy as np
+
+import chess_ai
+from chess_engine import GameState
+
+SHARD_SIZE = 2**14  # Positions in each shard file.
+MANIFEST_FILE = 'manifest.json'
+SELF_PLAY_DEPTH = 2
+MAX_GAME_PLIES = 300  # Longer games are scored as draws.
+RANDOM_PLIES = 8  # Random moves at the start of each game, for variety.
+REPETITIONS = 3  # Times a position can occur before the game is drawn.
+# Arrays in each shard, with their types.  Positions are encoded like
+# chess_ai.encodeBoard(), keys are the position keys (see
+# GameState.get_position_key()), and scores and results are from
+# White's side: the search score in pawns (mates are near
+# chess_ai.CHECKMATE), and 1, 0.5, or 0.
+SHARD_ARRAYS = dict(  # Name: dtype
+    positions = np.int8,
+    whiteToMove = bool,
+    keys = np.uint64,
+    scores = np.float32,
+    results = np.float32,
+)
+
+
+def playSelfPlayGame(args):
+    """
+    Plays a game of the AI against itself. Takes a tuple of the game's
+    number, random seed, search depth, maximum number of plies, and
+    number of random plies to start with.
+
+    Returns the game's number and a dictionary of the SHARD_ARRAYS of
+    the positions that were searched.
+    """
+    gameNumber, seed, depth, maxPlies, randomPlies = args
+    rn.seed(seed)
+    gs = GameState()
+    records = {name: [] for name in SHARD_ARRAYS}
+    repetitions = Counter()
+    result = 0.5
+    for ply in range(maxPlies):
+        gs.valid_moves = gs.get_valid_moves()
+        gs.find_mate(gs.valid_moves)
+        if gs.gameover:
+            if gs.checkmate:
+                result = 0.0 if gs.white_to_move else 1.0
+            break
+        key = gs.get_position_key()
+        repetitions[key] += 1
+        if (repetitions[key] >= REPETITIONS
+                or len(gs.board.get_pieces()) == 2):  # Only the Kings.
+            break
+
+        move = None
+        if ply >= randomPlies:
+            move = chess_ai.getBestMove(gs, depth)
+            if move is not None and chess_ai.searchState.score is not None:
+                records['positions'].append(chess_ai.encodeBoard(gs.board))
+                records['whiteToMove'].append(gs.white_to_move)
+                records['keys'].append(key)
+                records['scores'].append(chess_ai.searchState.score)
+        if move is None:
+            move = chess_ai.getRandomMove(gs.valid_moves)
+        gs.make_new_move(move)
+
+    records['results'] = [result] * len(records['keys'])
+    return gameNumber, {
+        name: np.array(records[name], dtype=dtype).reshape(
+            (-1, 64) if name == 'positions' else -1)
+        for name, dtype in SHARD_ARRAYS.items()}
+
+
+class ShardWriter():
+    """
+    Collects the positions of finished games and writes them to shards
+    of shardSize positions, keeping the manifest in the directory up to
+    date.
+
+    A position already in the shard being filled is left out, so each
+    shard has every position key at most once. The manifest lists the
+    shards and the games whose positions have all been written, and is
+    replaced in one step after each shard, so it is never left half
+    written. A game with positions still waiting when the run stops
+    isn't in the manifest, so it is played again when the run resumes.
+    """
+    def __init__(self, directory: str, shardSize: int=SHARD_SIZE) -> None:
+        self.directory = directory
+        self.shard_size = shardSize
+        self.manifest = loadManifest(directory)
+        self.buffer = {name: [] for name in SHARD_ARRAYS}
+        self.game_numbers = []  # The game of each position in the buffer.
+        self.keys = set()  # Position keys in the buffer.
+        self.finished_games = set()  # Added, but not yet in the manifest.
+
+    def __len__(self) -> int:
+        """Return the number of positions waiting to be written."""
+        return len(self.game_numbers)
+
+    def add_game(self, gameNumber: int, records: dict) -> None:
+        """
+        Adds the positions of a game (see playSelfPlayGame()), writing
+        shards whenever there are enough.
+        """
+        for i, key in enumerate(records['keys']):
+            if key in self.keys:
+                continue
+            self.keys.add(key)
+            for name in SHARD_ARRAYS:
+                self.buffer[name].append(records[name][i])
+            self.game_numbers.append(gameNumber)
+            if len(self) == self.shard_size:
+                self.write_shard()
+        self.finished_games.add(gameNumber)
+
+    def write_shard(self) -> None:
+        """Writes the positions waiting to a new shard."""
+        shardNumber = len(self.manifest['shards'])
+        filename = f'shard-{shardNumber:05d}.npz'
+        path = os.path.join(self.directory, filename)
+        with open(path + '.tmp', 'wb') as file:
+            np.savez_compressed(file, **{
+                name: np.array(self.buffer[name], dtype=dtype).reshape(
+                    (-1, 64) if name == 'positions' else -1)
+                for name, dtype in SHARD_ARRAYS.items()})
+        os.replace(path + '.tmp', path)
+        self.manifest['shards'].append(dict(file=filename,
+                                            positions=len(self)))
+        self.manifest['positions'] += len(self)
+
+        self.buffer = {name: [] for name in SHARD_ARRAYS}
+        self.game_numbers = []
+        self.keys = set()
+        self.save_manifest()
+
+    def save_manifest(self) -> None:
+        """
+        Adds the finished games with no positions waiting to the
+        manifest and saves it.
+        """
+        written = self.finished_games - set(self.game_numbers)
+        self.manifest['games'] = sorted(set(self.manifest['games'])
+                                        | written)
+        self.finished_games -= written
+        path = os.path.join(self.directory, MANIFEST_FILE)
+        with open(path + '.tmp', 'w') as file:
+            json.dump(self.manifest, file)
+        os.replace(path + '.tmp', path)
+
+    def close(self) -> None:
+        """Writes the positions still waiting to a last, smaller shard."""
+        if len(self):
+            self.write_shard()
+        else:
+            self.save_manifest()
+
+
+def loadManifest(directory: str) -> dict:
+    """
+    Returns the manifest of the shards in the directory, or an empty one
+    if there isn't one yet.
+    """
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return dict(shards=[], games=[], positions=0)
+
+    with open(path) as file:
+        return json.load(file)
+
+
+def loadShard(filename: str) -> dict:
+    """Returns a dictionary of the SHARD_ARRAYS in a shard file."""
+    with np.load(filename) as shard:
+        return {name: shard[name] for name in SHARD_ARRAYS}
+
+
+def runSelfPlay(directory: str, numGames: int, processes: int=None,
+                depth: int=SELF_PLAY_DEPTH, seed: int=0,
+                shardSize: int=SHARD_SIZE, maxPlies: int=MAX_GAME_PLIES,
+                randomPlies: int=RANDOM_PLIES) -> dict:
+    """
+    Plays numGames games of the AI against itself in processes worker
+    processes (the number of CPUs if None), writing their positions to
+    shards in the directory. Returns the manifest.
+
+    Games are numbered from 0, and game n is played with the random
+    seed seed + n. If the directory already has a manifest, the games
+    in it are skipped, so an interrupted run can be started again with
+    the same arguments to finish it.
+    """
+    os.makedirs(directory, exist_ok=True)
+    writer = ShardWriter(directory, shardSize)
+    played = set(writer.manifest['games'])
+    games = [(gameNumber, seed + gameNumber, depth, maxPlies, randomPlies)
+             for gameNumber in range(numGames) if gameNumber not in played]
+    with Pool(processes) as pool:
+        for gameNumber, records in pool.imap_unordered(playSelfPlayGame,
+                                                       games):
+            writer.add_game(gameNumber, records)
+    writer.close()
+
+    return writer.manifest
@@ -0,0 +1,480 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains endgame tablebases, which hold the exact result of
+every position of a King and a few pieces against a lone King, found by
+retrograde analysis with NumPy arrays.
+"""
+
+__all__ = ['Tablebase', 'generateTablebase', 'generateTablebaseFiles',
+           'loadTablebase', 'getTablebaseKey', 'MAX_TABLEBASE_PIECES']
+
+import os
+import struct
+
+import numpy as np
+
+MAX_TABLEBASE_PIECES = 4  # Including the Kings.
+TABLEBASE_PIECES = 'QRBN'  # Pieces a tablebase can have, in signature order.
+DRAW = 255  # Stored for positions that aren't won, so aren't mates either.
+CHUNK_SIZE = 2**20  # Positions looked at at once when setting up a table.
+TABLEBASE_HEADER = struct.Struct('<8s8sQ')  # Magic, signature, positions.
+TABLEBASE_MAGIC = b'ChessTB1'
+
+KING_STEPS = ((-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1),
+              (1, 1))
+KNIGHT_STEPS = ((-2, -1), (-1, -2), (1, -2), (2, -1), (-2, 1), (-1, 2),
+                (2, 1), (1, 2))
+ROOK_DIRECTIONS = ((0, -1), (-1, 0), (1, 0), (0, 1))
+BISHOP_DIRECTIONS = ((-1, -1), (1, -1), (-1, 1), (1, 1))
+PIECE_MOVES = dict(  # Symbol: (directions or steps, whether it slides)
+    K = (KING_STEPS, False),
+    Q = (ROOK_DIRECTIONS + BISHOP_DIRECTIONS, True),
+    R = (ROOK_DIRECTIONS, True),
+    B = (BISHOP_DIRECTIONS, True),
+    N = (KNIGHT_STEPS, False),
+)
+
+
+def makeSquareTables():
+    """
+    Returns the tables the analysis looks squares up in, indexed by
+    8*rank + file, with 64 standing for off the board:
+
+        steps: the square one step in each direction from each square,
+        attacks: whether each piece attacks a square from another square
+            on an empty board,
+        between: the squares between two squares on a line, as a 64-bit
+            mask,
+        adjacent: whether two squares are next to each other or the same.
+    """
+    steps = {}
+    for x, y in KING_STEPS + KNIGHT_STEPS:
+        table = np.full(65, 64, np.int8)
+        for square in range(64):
+            file, rank = square % 8 + x, square // 8 + y
+            if 0 <= file < 8 and 0 <= rank < 8:
+                table[square] = 8*rank + file
+        steps[x, y] = table
+
+    attacks = {}
+    for symbol, (directions, slides) in PIECE_MOVES.items():
+        table = np.zeros((64, 64), bool)
+        for square in range(64):
+            for direction in directions:
+                target = steps[direction][square]
+                while target != 64:
+                    table[square, target] = True
+                    target = steps[direction][target] if slides else 64
+        attacks[symbol] = table
+
+    between = np.zeros((64, 64), np.uint64)
+    for square in range(64):
+        for direction in PIECE_MOVES['Q'][0]:
+            mask = 0
+            target = steps[direction][square]
+            while target != 64:
+                between[square, target] = mask
+                mask |= 1 << int(target)
+                target = steps[direction][target]
+
+    adjacent = np.zeros((65, 65), bool)
+    adjacent[:64, :64] = attacks['K'] | np.eye(64, dtype=bool)
+
+    return steps, attacks, between, adjacent
+
+
+STEPS, ATTACKS, BETWEEN, ADJACENT = makeSquareTables()
+
+
+class Tablebase():
+    """
+    Distances to mate for every placement of the stronger side's King,
+    the lone King, and the stronger side's pieces, e.g. 'KRRK' for two
+    Rooks.
+
+    A position is indexed by the squares of the Kings and the pieces in
+    the order of the signature, as base 64 digits. For each index,
+    strong_to_move holds the number of plies to mate with the stronger
+    side to move, and weak_to_move the number of plies until the lone
+    King is mated with it to move, or DRAW if the position isn't won.
+    Pieces move the same way for both colors, so one table serves both.
+    """
+    def __init__(self, signature: str, strongToMove, weakToMove) -> None:
+        self.signature = signature
+        self.strong_to_move = strongToMove
+        self.weak_to_move = weakToMove
+
+    def __len__(self) -> int:
+        """Return the number of positions in the table."""
+        return len(self.strong_to_move)
+
+    def probe(self, squares, strongToMove: bool):
+        """
+        Returns the number of plies to mate from the position with the
+        pieces on the squares, in the order of the signature, or None if
+        it is a draw.
+        """
+        index = 0
+        for square in squares:
+            index = 64*index + square
+        table = self.strong_to_move if strongToMove else self.weak_to_move
+        plies = int(table[index])
+
+        return None if plies == DRAW else plies
+
+    def save(self, filename: str) -> None:
+        """
+        Writes the table to a file of a short header followed by a byte
+        for each position with each side to move.
+        """
+        with open(filename, 'wb') as file:
+            file.write(TABLEBASE_HEADER.pack(
+                TABLEBASE_MAGIC, self.signature.encode('ascii'), len(self)))
+            file.write(np.ascontiguousarray(self.strong_to_move).tobytes())
+            file.write(np.ascontiguousarray(self.weak_to_move).tobytes())
+
+
+def loadTablebase(filename: str) -> Tablebase:
+    """
+    Opens a table written by Tablebase.save(). The file is
+    memory-mapped, so only the parts that are probed are read.
+    """
+    with open(filename, 'rb') as file:
+        magic, signature, size = TABLEBASE_HEADER.unpack(
+            file.read(TABLEBASE_HEADER.size))
+    if magic != TABLEBASE_MAGIC:
+        raise ValueError(f"'{filename}' isn't a tablebase file.")
+    tables = np.memmap(filename, np.uint8, 'r', TABLEBASE_HEADER.size,
+                       (2, size))
+
+    return Tablebase(signature.rstrip(b'\0').decode('ascii'), tables[0],
+                     tables[1])
+
+
+def getTablebaseKey(board):
+    """
+    Returns the signature of the board's material, the stronger side's
+    color, and the squares (as 8*rank + file) in the order of the
+    signature, or None if the board isn't a King and up to
+    MAX_TABLEBASE_PIECES - 2 pieces against a lone King.
+    """
+    if len(board.get_pieces()) > MAX_TABLEBASE_PIECES:
+        return None
+
+    pieces = [piece for piece in board.get_pieces() if piece.is_on_board()]
+
+    strong = dict(white = [], black = [])
+    for piece in pieces:
+        if piece.get_name() != 'King':
+            strong[piece.get_color()].append(piece)
+    if strong['white'] and strong['black']:
+        return None
+    strongColor = 'white' if strong['white'] else 'black'
+    strongPieces = sorted(
+        strong[strongColor],
+        key=lambda piece: TABLEBASE_PIECES.find(piece.get_symbol()))
+    if any(piece.get_symbol() not in TABLEBASE_PIECES
+           for piece in strongPieces):
+        return None
+    if strongColor == 'white':
+        kings = (board.white_king, board.black_king)
+    else:
+        kings = (board.black_king, board.white_king)
+    squares = []
+    for piece in kings + tuple(strongPieces):
+        file, rank = piece.get_coords()
+        squares.append(8*rank + file)
+    signature = 'K' + ''.join(
+        piece.get_symbol() for piece in strongPieces) + 'K'
+
+    return signature, strongColor, squares
+
+
+def generateTablebase(signature: str, subtables: dict=None) -> Tablebase:
+    """
+    Builds the table for the signature, e.g. 'KQK' or 'KRRK', by
+    retrograde analysis, working back from the mates.
+
+    First every position is checked for mate, then each round finds the
+    positions where the stronger side can reach a position lost in the
+    last round, and the positions where every move of the lone King
+    reaches a won position. Capturing a piece leads to a smaller table,
+    which is built first and kept in subtables, a dictionary of
+    Tablebases by signature.
+    """
+    pieces = signature[1:-1]
+    if (len(signature) > MAX_TABLEBASE_PIECES or signature[0] != 'K'
+            or signature[-1] != 'K'
+            or any(symbol not in TABLEBASE_PIECES for symbol in pieces)):
+        raise ValueError(f"Can't build a tablebase for '{signature}'.")
+    if subtables is None:
+        subtables = {}
+    for captured in range(len(pieces)):
+        subSignature = 'K' + pieces[:captured] + pieces[captured+1:] + 'K'
+        if len(subSignature) > 2 and subSignature not in subtables:
+            subtables[subSignature] = generateTablebase(subSignature,
+                                                        subtables)
+
+    generator = RetrogradeAnalysis(signature, subtables)
+    return generator.run()
+
+
+def generateTablebaseFiles(signatures, directory: str='.') -> list:
+    """
+    Builds the tables for the signatures and saves each one to a file
+    named after its signature, e.g. 'KRK.tb', in the directory. Returns
+    the names of the files.
+    """
+    subtables = {}
+    filenames = []
+    for signature in signatures:
+        table = generateTablebase(signature, subtables)
+        subtables[signature] = table
+        filename = os.path.join(directory, signature + '.tb')
+        table.save(filename)
+        filenames.append(filename)
+
+    return filenames
+
+
+class RetrogradeAnalysis():
+    """
+    Works out a Tablebase. Positions are kept as NumPy arrays of their
+    indices, and the squares of the pieces are decoded from them, so
+    each step is done for many positions at once.
+
+    The pieces are numbered in the order of the signature: 0 is the
+    stronger side's King, 1 is the lone King, and 2 and up are the
+    stronger side's pieces.
+    """
+    def __init__(self, signature: str, subtables: dict) -> None:
+        self.signature = signature
+        self.symbols = 'K' + signature[1:-1]  # Symbols of the strong pieces.
+        self.count = len(signature)
+        self.size = 64**self.count
+        self.weights = [np.int64(64**(self.count - 1 - piece))
+                        for piece in range(self.count)]
+        self.subtables = subtables
+        self.strong_to_move = np.full(self.size, DRAW, np.uint8)
+        self.weak_to_move = np.full(self.size, DRAW, np.uint8)
+        self.legal = np.zeros(self.size, bool)  # With the strong to move.
+        self.captures = []  # Positions where the lone King can capture.
+
+    def get_squares(self, indices) -> list:
+        """Returns an array of the squares of each piece."""
+        return [(indices // weight % 64).astype(np.int8)
+                for weight in self.weights]
+
+    def get_subsignature(self, captured: int) -> str:
+        """Returns the signature left after a piece is captured."""
+        return ('K' + self.symbols[1:captured - 1] + self.symbols[captured:]
+                + 'K')
+
+    def run(self) -> Tablebase:
+        """Finds the result of every position."""
+        lost = []
+        for start in range(0, self.size, CHUNK_SIZE):
+            indices = np.arange(start, min(start + CHUNK_SIZE, self.size))
+            lost.append(self.find_mates(indices))
+        lost = np.concatenate(lost)
+        self.weak_to_move[lost] = 0
+        self.captures = np.concatenate(self.captures)
+
+        # The lone King might only be lost once a smaller table's longer
+        # mate comes up, so the rounds go on until those are past.
+        lastCapture = 0
+        for piece in range(2, self.count):
+            table = self.subtables.get(self.get_subsignature(piece))
+            if table is not None:
+                results = table.strong_to_move
+                lastCapture = max(lastCapture,
+                                  int(results[results != DRAW].max(initial=0)))
+        plies = 0
+        found = np.zeros(self.size, bool)  # Marks positions to look at.
+        while len(lost) or plies <= lastCapture:
+            found[:] = False
+            for positions in self.get_strong_unmoves(lost):
+                found[positions] = True
+            won = np.flatnonzero(
+                found & self.legal & (self.strong_to_move == DRAW))
+            self.strong_to_move[won] = plies + 1
+
+            found[:] = False
+            if plies <= lastCapture:
+                self.captures = self.captures[
+                    self.weak_to_move[self.captures] == DRAW]
+                found[self.captures] = True
+            for positions in self.get_weak_unmoves(won):
+                found[positions] = True
+            candidates = np.flatnonzero(found & (self.weak_to_move == DRAW))
+            lost = candidates[self.is_lost(candidates, plies + 1)]
+            self.weak_to_move[lost] = plies + 2
+            plies += 2
+            if plies >= DRAW - 2:
+                break
+
+        return Tablebase(self.signature, self.strong_to_move,
+                         self.weak_to_move)
+
+    def find_mates(self, indices):
+        """
+        Marks which positions are legal with the stronger side to move,
+        and returns the positions where the lone King is mated.
+        """
+        squares = self.get_squares(indices)
+        legal = ~ADJACENT[squares[0], squares[1]]
+        for piece in range(self.count):
+            for other in range(piece + 1, self.count):
+                legal &= squares[piece] != squares[other]
+        indices = indices[legal]
+        squares = [pieceSquares[legal] for pieceSquares in squares]
+        inCheck = self.is_attacked(squares[1], squares,
+                                   self.get_blockers(squares))
+        self.legal[indices[~inCheck]] = True
+
+        hasMove = np.zeros(len(indices), bool)
+        canCapture = np.zeros(len(indices), bool)
+        for moves, _, captured in self.get_weak_moves(squares):
+            hasMove |= moves
+            canCapture |= moves & captured
+        self.captures.append(indices[canCapture])
+
+        return indices[inCheck & ~hasMove]
+
+    def get_blockers(self, squares):
+        """
+        Returns 64-bit masks of the squares of the stronger side's
+        pieces, which block its lines of attack. The lone King is left
+        out, so that it can't hide behind itself.
+        """
+        blockers = np.zeros(len(squares[0]), np.uint64)
+        for piece in [0] + list(range(2, self.count)):
+            blockers |= np.left_shift(np.uint64(1),
+                                      squares[piece].astype(np.uint64))
+
+        return blockers
+
+    def is_attacked(self, targets, squares, blockers):
+        """
+        Returns whether the stronger side attacks each target square,
+        with its lines blocked by the blockers. A piece on its target
+        square doesn't attack it.
+        """
+        attacked = np.zeros(len(targets), bool)
+        for piece, symbol in zip([0] + list(range(2, self.count)),
+                                 self.symbols):
+            hits = ATTACKS[symbol][squares[piece], targets]
+            if PIECE_MOVES[symbol][1]:
+                # Only the lines that are lined up need checking.
+                lined = np.flatnonzero(hits)
+                hits[lined] = BETWEEN[squares[piece][lined],
+                                      targets[lined]] & blockers[lined] == 0
+            attacked |= hits
+
+        return attacked
+
+    def get_weak_moves(self, squares):
+        """
+        Yields, for each step of the lone King, which positions it can
+        make it in, the squares it moves to, and which of the moves are
+        captures.
+        """
+        blockers = self.get_blockers(squares)
+        for step in KING_STEPS:
+            targets = STEPS[step][squares[1]]
+            inside = targets != 64
+            targets = np.where(inside, targets, squares[1])
+            moves = inside & ~ADJACENT[targets, squares[0]]
+            moves &= ~self.is_attacked(targets, squares, blockers)
+            captured = np.zeros(len(targets), bool)
+            for piece in range(2, self.count):
+                captured |= squares[piece] == targets
+            yield moves, targets, captured
+
+    def is_lost(self, indices, plies):
+        """
+        Returns whether every move of the lone King, of which there must
+        be one, reaches a position already won by the stronger side in
+        plies or fewer.
+        """
+        squares = self.get_squares(indices)
+        hasMove = np.zeros(len(indices), bool)
+        escapes = np.zeros(len(indices), bool)
+        for moves, targets, captured in self.get_weak_moves(squares):
+            hasMove |= moves
+            results = self.strong_to_move[
+                indices + (targets - squares[1]) * self.weights[1]]
+            escapes |= moves & ~captured & (results == DRAW)
+            # A capture's result is in a smaller table, where it can be
+            # a longer mate than any found here so far.
+            for piece in range(2, self.count):
+                captures = moves & (squares[piece] == targets)
+                if captures.any():
+                    escapes |= captures & (self.probe_capture(
+                        squares, targets, piece) > plies)
+
+        return hasMove & ~escapes
+
+    def probe_capture(self, squares, targets, captured):
+        """
+        Returns the results from the smaller table after the lone King
+        captures a piece by moving to the targets, or DRAW for the
+        positions where the stronger side has nothing left.
+        """
+        subSignature = self.get_subsignature(captured)
+        if len(subSignature) == 2:
+            return np.full(len(targets), DRAW, np.uint8)
+
+        index = np.zeros(len(targets), np.int64)
+        for piece in range(self.count):
+            if piece == 1:
+                index = 64*index + targets
+            elif piece != captured:
+                index = 64*index + squares[piece]
+
+        return self.subtables[subSignature].strong_to_move[index]
+
+    def get_strong_unmoves(self, indices):
+        """
+        Yields arrays of the positions with the stronger side to move
+        that lead to the positions by one of its moves. Its pieces can't have
+        captured anything, so every move can be taken back by making the
+        same move from the square it ended on.
+        """
+        allSquares = self.get_squares(indices)
+        for piece, symbol in zip([0] + list(range(2, self.count)),
+                                 self.symbols):
+            directions, slides = PIECE_MOVES[symbol]
+            for direction in directions:
+                # Positions are dropped as their piece's line is blocked.
+                lineIndices, squares = indices, allSquares
+                targets = squares[piece]
+                for _ in range(7 if slides else 1):
+                    targets = STEPS[direction][targets]
+                    clear = targets != 64
+                    for other in squares:
+                        clear &= other != targets
+                    lineIndices, targets = lineIndices[clear], targets[clear]
+                    if not len(lineIndices):
+                        break
+                    squares = [other[clear] for other in squares]
+                    moves = lineIndices + (
+                        targets - squares[piece]) * self.weights[piece]
+                    if piece == 0:
+                        moves = moves[~ADJACENT[targets, squares[1]]]
+                    yield moves
+
+    def get_weak_unmoves(self, indices):
+        """
+        Yields arrays of the positions with the lone King to move that
+        lead to the positions by one of its moves other than captures. The lone
+        King may have been in check in them.
+        """
+        squares = self.get_squares(indices)
+        for step in KING_STEPS:
+            targets = STEPS[step][squares[1]]
+            moves = (targets != 64) & ~ADJACENT[targets, squares[0]]
+            for piece in range(2, self.count):
+                moves &= squares[piece] != targets
+            yield indices[moves] + (
+                targets[moves] - squares[1][moves]) * self.weights[1]
@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+"""
+This module tunes the AI's evaluation weights Texel-style: the
+evaluation of a large set of positions from played games is fit to the
+games' results by gradient descent on a logistic loss. The weights are
+written to chess_ai.EVAL_WEIGHTS_FILE, which chess_ai loads at import.
+"""
+
+__all__ = ['TuningData', 'loadTuningData', 'readLabeledPositions',
+           'extractFeatures', 'getInitialWeights', 'getLoss',
+           'fitScalingConstant', 'tuneWeights', 'writeEvalWeights',
+           'tuneEvalWeights']
+
+import json
+import re
+from collections import namedtuple
+
+import numpy as np
+
+import chess_ai
+from chess_ai import BATCH_PIECES, MAX_PHASE, encodeFEN, countPawnMasks
+
+MAX_PIECES = 32  # Pieces on a legal board.
+NUM_PIECE_SQUARES = 6 * 64  # Piece, then square from White's side.
+NO_PIECE = 2 * NUM_PIECE_SQUARES  # Padding in TuningData.pieces.
+NUM_PAWN_TERMS = 11  # Columns of chess_ai.countPawnMasks().
+BATCH_SIZE = 2**14  # Positions read and extracted at a time.
+CHUNK_SIZE = 2**16  # Positions scored at a time while tuning.
+# The weights are one flat array, in centipawns, of these parts in order.
+WEIGHT_PARTS = dict(  # Name: shape
+    pieceSquare = (2, 6, 64),  # Middlegame and endgame table entries.
+    material = (2, 6),
+    promotion = (),
+    pawns = (NUM_PAWN_TERMS,),
+)
+PIECE_NAMES = dict(P='Pawn', N='Knight', B='Bishop', R='Rook', Q='Queen',
+                   K='King')
+RESULT = re.compile(  # A result, or White's score in brackets.
+    r'1-0|0-1|1/2-1/2|\[\s*(1(?:\.0*)?|0?\.5|0(?:\.0*)?)\s*\]')
+RESULT_SCORES = {'1-0': 1.0, '0-1': 0.0, '1/2-1/2': 0.5}
+
+# Positions from played games with the results of the games, stored
+# compactly so that millions of them fit in memory.  pieces holds the
+# index of each piece's weight in its position's row, with NO_PIECE
+# after the last piece. The first NUM_PIECE_SQUARES indices are White's
+# pieces and the next are Black's. phases holds the game phases, pawns
+# the counts of countPawnMasks(), and results White's scores.
+TuningData = namedtuple('TuningData', ['pieces', 'phases', 'pawns',
+                                       'results'])
+
+
+def makePieceIndices():
+    """
+    Makes the table of TuningData.pieces indices, indexed by piece code
+    (see chess_ai.encodeBoard()) and then square.
+    """
+    indices = np.full((13, 64), NO_PIECE, dtype=np.uint16)
+    for code in range(1, 13):
+        piece = (code - 1) % 6
+        for rank in range(8):
+            # Black's pieces are flipped top to bottom, like their tables.
+            row = rank if code <= 6 else 7 - rank
+            for file in range(8):
+                index = 64*piece + 8*row + file
+                if code > 6:
+                    index += NUM_PIECE_SQUARES
+                indices[code, 8*rank + file] = index
+
+    return indices
+
+
+PIECE_INDICES = makePieceIndices()
+
+
+def readLabeledPositions(file, batchSize=BATCH_SIZE):
+    """
+    Reads the positions in a file of labeled positions in batches,
+    yielding a list of piece placements and an array of results.
+
+    Each line is a FEN (or EPD) followed by the game's result, as
+    '1-0', '0-1', or '1/2-1/2' (e.g., 'c9 "1-0";') or as White's score
+    in brackets, e.g., '[0.5]'. Lines without a result are skipped.
+    """
+    placements, results = [], []
+    for line in file:
+        fields = line.split(None, 1)
+        if len(fields) < 2 or fields[0].count('/') != 7:
+            continue
+        match = RESULT.search(fields[1])
+        if match is None:
+            continue
+        placements.append(fields[0])
+        if match.group(1) is not None:
+            results.append(float(match.group(1)))
+        else:
+            results.append(RESULT_SCORES[match.group()])
+        if len(placements) == batchSize:
+            yield placements, np.array(results, dtype=np.float32)
+            placements, results = [], []
+
+    if placements:
+        yield placements, np.array(results, dtype=np.float32)
+
+
+def extractFeatures(placements, results):
+    """
+    Extracts the evaluation features of a batch of piece placements.
+    Returns TuningData.
+    """
+    positions = np.array([encodeFEN(placement) for placement in placements],
+                         dtype=np.intp).reshape(-1, 64)
+    # The occupied squares of each position, then the empty ones.
+    squares = np.argsort(positions == 0, axis=1,
+                         kind='stable')[:, :MAX_PIECES]
+    pieces = PIECE_INDICES[np.take_along_axis(positions, squares, axis=1),
+                           squares]
+    phaseTable = chess_ai.batchTables[2]
+    phases = np.minimum(phaseTable[positions].sum(axis=1), MAX_PHASE)
+    pawns = countPawnMasks(positions.reshape(-1, 8, 8))
+
+    return TuningData(pieces, phases.astype(np.uint8),
+                      pawns.astype(np.int8), results)
+
+
+def loadTuningData(filename, maxPositions=None):
+    """
+    Loads the features of up to maxPositions labeled positions from a
+    file (see readLabeledPositions()).
+
+    The file is read and extracted a batch at a time, so only the
+    compact features of the positions are kept in memory.
+    """
+    batches = []
+    count = 0
+    with open(filename) as file:
+        for placements, results in readLabeledPositions(file):
+            if maxPositions is not None:
+                placements = placements[:maxPositions - count]
+                results = results[:len(placements)]
+            batches.append(extractFeatures(placements, results))
+            count += len(placements)
+            if count == maxPositions:
+                break
+
+    if not batches:
+        return TuningData(
+            np.empty((0, MAX_PIECES), dtype=np.uint16),
+            np.empty(0, dtype=np.uint8),
+            np.empty((0, NUM_PAWN_TERMS), dtype=np.int8),
+            np.empty(0, dtype=np.float32))
+    return TuningData(*(np.concatenate(arrays) for arrays in zip(*batches)))
+
+
+def splitWeights(weights):
+    """Returns a dictionary of views of the parts of a weights array."""
+    parts = {}
+    start = 0
+    for name, shape in WEIGHT_PARTS.items():
+        size = int(np.prod(shape))
+        parts[name] = weights[start:start + size].reshape(shape)
+        start += size
+
+    return parts
+
+
+def getInitialWeights():
+    """Returns a weights array of chess_ai's current scores."""
+    size = sum(int(np.prod(shape)) for shape in WEIGHT_PARTS.values())
+    weights = np.zeros(size)
+    parts = splitWeights(weights)
+    for piece, symbol in enumerate(BATCH_PIECES):
+        name = PIECE_NAMES[symbol]
+        tables = chess_ai.PIECE_SQUARE_TABLES[name]
+        for phase in range(2):
+            parts['pieceSquare'][phase, piece] = np.ravel(tables[phase])
+            parts['material'][phase, piece] = (
+                chess_ai.MATERIAL_SCORE[name][phase])
+    parts['promotion'][...] = chess_ai.PROMOTION_BONUS
+    parts['pawns'][:] = 100 * chess_ai.getPawnWeights()
+
+    return weights
+
+
+def getPieceSquareScores(weights):
+    """
+    Returns the middlegame and endgame scores of each TuningData.pieces
+    index: each piece's material plus its table entry, with the
+    promotion bonus for Pawns one step from promoting, negated for
+    Black, and 0 for NO_PIECE.
+    """
+    parts = splitWeights(weights)
+    scores = parts['pieceSquare'] + parts['material'][:, :, np.newaxis]
+    scores[:, 0, 8:16] += parts['promotion']  # Pawns on the 7th rank.
+    scores = scores.reshape(2, NUM_PIECE_SQUARES)
+
+    return np.concatenate([scores, -scores, np.zeros((2, 1))], axis=1)
+
+
+def scoreChunks(data, weights):
+    """
+    Scores the positions in the data with the weights, in centipawns, a
+    chunk at a time. Yields the chunk's slice, its scores, and its
+    middlegame fractions.
+    """
+    middlegameScores, endgameScores = getPieceSquareScores(weights)
+    pawnWeights = splitWeights(weights)['pawns']
+    for start in range(0, len(data.results), CHUNK_SIZE):
+        chunk = slice(start, start + CHUNK_SIZE)
+        pieces = data.pieces[chunk]
+        middlegame = data.phases[chunk] / MAX_PHASE
+        scores = (middlegameScores[pieces].sum(axis=1) * middlegame
+                  + endgameScores[pieces].sum(axis=1) * (1 - middlegame)
+                  + data.pawns[chunk] @ pawnWeights)
+        yield chunk, scores, middlegame
+
+
+def getWinProbabilities(scores, scale):
+    """
+    Returns White's expected score in positions with the scores, in
+    centipawns, and the scaling constant scale.
+    """
+    return 1 / (1 + 10**(-scale * scores / 400))
+
+
+def getLoss(data, weights, scale):
+    """
+    Returns the mean logistic loss (cross-entropy) of the expected
+    scores of the positions against the games' results.
+    """
+    total = 0.0
+    for chunk, scores, _ in scoreChunks(data, weights):
+        probabilities = np.clip(getWinProbabilities(scores, scale),
+                                1e-12, 1 - 1e-12)
+        results = data.results[chunk]
+        total -= (results * np.log(probabilities)
+                  + (1 - results) * np.log(1 - probabilities)).sum()
+
+    return total / len(data.results)
+
+
+def getGradient(data, weights, scale):
+    """Returns the gradient of getLoss() with respect to the weights."""
+    gradient = np.zeros_like(weights)
+    parts = splitWeights(gradient)
+    pieceGradients = np.zeros((2, NO_PIECE + 1))
+    for chunk, scores, middlegame in scoreChunks(data, weights):
+        # The derivative of the loss with respect to each score.
+        errors = (getWinProbabilities(scores, scale) - data.results[chunk])
+        errors *= scale * np.log(10) / 400 / len(data.results)
+        pieces = data.pieces[chunk].ravel()
+        for phase, fraction in enumerate((middlegame, 1 - middlegame)):
+            pieceGradients[phase] += np.bincount(
+                pieces, np.repeat(errors * fraction, MAX_PIECES),
+                minlength=NO_PIECE + 1)
+        parts['pawns'] += data.pawns[chunk].T @ errors
+
+    # Black's pieces count against their scores.
+    pieceSquare = (pieceGradients[:, :NUM_PIECE_SQUARES]
+                   - pieceGradients[:, NUM_PIECE_SQUARES:NO_PIECE])
+    parts['pieceSquare'][...] = pieceSquare.reshape(2, 6, 64)
+    parts['material'][...] = parts['pieceSquare'].sum(axis=2)
+    parts['promotion'][...] = parts['pieceSquare'][:, 0, 8:16].sum()
+
+    return gradient
+
+
+def fitScalingConstant(data, weights, low=0.1, high=4.0, iterations=40):
+    """
+    Returns the scaling constant that gives the lowest loss with the
+    weights, found with a golden section search between low and high.
+    """
+    ratio = (np.sqrt(5) - 1) / 2
+    for _ in range(iterations):
+        left = high - ratio * (high - low)
+        right = low + ratio * (high - low)
+        if getLoss(data, weights, left) < getLoss(data, weights, right):
+            high = right
+        else:
+            low = left
+
+    return (low + high) / 2
+
+
+def tuneWeights(data, weights, scale, epochs=300, learningRate=1.0):
+    """
+    Tunes the weights by full-batch gradient descent with Adam steps of
+    about learningRate centipawns. The King's material is left at 0.
+
+    Returns the tuned weights and the loss after each epoch.
+    """
+    weights = weights.copy()
+    fixed = np.zeros_like(weights, dtype=bool)
+    splitWeights(fixed)['material'][:, BATCH_PIECES.index('K')] = True
+    momentum = np.zeros_like(weights)
+    velocity = np.zeros_like(weights)
+    beta1, beta2, epsilon = 0.9, 0.999, 1e-8
+    losses = []
+    for epoch in range(1, epochs + 1):
+        gradient = getGradient(data, weights, scale)
+        gradient[fixed] = 0
+        momentum = beta1*momentum + (1 - beta1)*gradient
+        velocity = beta2*velocity + (1 - beta2)*gradient**2
+        step = (momentum / (1 - beta1**epoch)
+                / (np.sqrt(velocity / (1 - beta2**epoch)) + epsilon))
+        weights -= learningRate * step
+        losses.append(getLoss(data, weights, scale))
+
+    return weights, losses
+
+
+def writeEvalWeights(weights, filename=chess_ai.EVAL_WEIGHTS_FILE):
+    """
+    Writes the weights to a file that chess_ai.loadEvalWeights() reads,
+    rounded to whole centipawns, with the Pawn structure terms in pawns.
+    """
+    parts = splitWeights(np.rint(weights).astype(int))
+    pawnScores = splitWeights(weights)['pawns'] / 100
+    materialScore = {}
+    pieceSquareTables = {}
+    for piece, symbol in enumerate(BATCH_PIECES):
+        name = PIECE_NAMES[symbol]
+        materialScore[name] = parts['material'][:, piece].tolist()
+        pieceSquareTables[name] = (
+            parts['pieceSquare'][:, piece].reshape(2, 8, 8).tolist())
+    terms = list(chess_ai.PAWN_STRUCTURE)
+    evalWeights = dict(
+        MATERIAL_SCORE = materialScore,
+        PIECE_SQUARE_TABLES = pieceSquareTables,
+        PROMOTION_BONUS = int(parts['promotion']),
+        PAWN_STRUCTURE = {term: round(float(pawnScores[i]), 3)
+                          for i, term in enumerate(terms)},
+        # Pawns can only be 1 to 6 ranks from promotion.
+        PASSED_PAWN_BONUS = {
+            distance: round(float(pawnScores[len(terms) + distance]), 3)
+            for distance in range(1, 7)},
+    )
+    with open(filename, 'w') as file:
+        json.dump(evalWeights, file)
+
+
+def tuneEvalWeights(positionsFilename,
+                    weightsFilename=chess_ai.EVAL_WEIGHTS_FILE, epochs=300,
+                    learningRate=1.0, maxPositions=None):
+    """
+    Tunes chess_ai's evaluation weights on a file of labeled positions
+    (see readLabeledPositions()) and writes them to weightsFilename.
+
+    The scaling constant is fit to the current weights first and then
+    held fixed. Returns the losses before and after tuning.
+    """
+    data = loadTuningData(positionsFilename, maxPositions)
+    weights = getInitialWeights()
+    scale = fitScalingConstant(data, weights)
+    startLoss = getLoss(data, weights, scale)
+    weights, losses = tuneWeights(data, weights, scale, epochs, learningRate)
+    writeEvalWeights(weights, weightsFilename)
+
+    return startLoss, losses[-1] if losses else startLoss
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""Tests for the tables in chess_cache."""
+
+from chess_cache import EvalCache, FileTranspositionTable, EXACT
+
+
+def test_eval_cache_slots():
+    cache = EvalCache(16)
+    cache.store(3, 1.5)
+    assert cache.probe(3) == 1.5
+    cache.store(19, -0.5)  # Same slot as key 3.
+    assert cache.probe(3) is None
+    assert cache.probe(19) == -0.5
+    assert cache.get_stats()['hits'] == 2
+    cache.clear()
+    assert cache.probe(19) is None
+
+
+def test_cache_file_is_tied_to_evaluation(tmp_path):
+    filename = str(tmp_path / 'search.cache')
+    table = FileTranspositionTable(filename, 64, evalKey=1)
+    table.store(12345, 3, 0.5, EXACT, 7)
+    table.close()
+    table = FileTranspositionTable(filename, 64, evalKey=1)
+    assert table.probe(12345).score == 0.5
+    table.close()
+    table = FileTranspositionTable(filename, 64, evalKey=2)
+    assert table.probe(12345) is None
+    table.close()
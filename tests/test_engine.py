@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+"""Tests for the game state in chess_engine."""
+
+from chess_engine import GameState
+from chess_perft import findMove
+
+
+def test_en_passant_updates_piece_list():
+    gs = GameState('4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 1')
+    pawn = gs.board.squares[3, 3].get_piece()
+    gs.make_move(findMove(gs, 'e5d6'))
+    assert pawn not in gs.board.get_pieces()
+    assert len(gs.board.get_pieces()) == 3
+    gs.undo_move()
+    assert gs.board.get_pieces().count(pawn) == 1
+    assert len(gs.board.get_pieces()) == 4
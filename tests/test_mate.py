@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""Tests for the mate-in-N solver in chess_ai."""
+
+import chess_ai
+from chess_engine import GameState
+from chess_perft import findMove
+
+
+def test_mate_by_underpromotion():
+    # Only f8=N mates: a Queen on f8 isn't check.
+    gs = GameState('6br/5Ppk/6pp/8/8/8/8/K7 w - - 0 1')
+    assert chess_ai.getMateLine(gs, 1) == ['f8=N']
+    assert chess_ai.getMateLine(gs, 2) == ['f8=N']
+
+
+def test_defence_by_underpromotion():
+    # After Ke3, b1=Q allows Qd2 mate, but b1=N covers d2
+    # and holds out a move longer.
+    gs = GameState('8/8/8/8/8/2Q5/1p3K2/3k4 w - - 0 1')
+    assert chess_ai.getMateLine(gs, 2) is None
+    line = chess_ai.getMateLine(gs, 3)
+    assert line is not None and line[1] == 'b1=N'
+
+
+def playMoves(gs, names):
+    for name in names:
+        gs.make_move(findMove(gs, name))
+
+
+def undoMoves(gs, count):
+    for _ in range(count):
+        gs.undo_move()
+        gs.undo_log.pop()
+
+
+def test_mate_line_after_transposition():
+    # Both orders reach the same position, but with the Rooks swapped.
+    gs = GameState('7k/8/5K2/8/8/8/1R6/R7 w - - 0 1')
+    results = {}
+    playMoves(gs, ['a1b1', 'h8g8', 'b2a2', 'g8h8'])
+    key = gs.get_position_key()
+    assert chess_ai.searchMate(gs, 2, False, results) is not None
+    undoMoves(gs, 4)
+    playMoves(gs, ['a1a2', 'h8g8', 'b2b1', 'g8h8'])
+    assert gs.get_position_key() == key
+    pieces = [square.get_piece() for square in gs.board.squares.flat]
+    names = chess_ai.getLineNames(gs, results[key, 2], 3)
+    assert len(names) == 3
+    for square, piece in zip(gs.board.squares.flat, pieces):
+        assert square.get_piece() is piece
+        if piece is not None:
+            assert piece.square is square
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""Tests for the network evaluator in chess_nnue and its use in chess_ai."""
+
+import numpy as np
+import pytest
+
+import chess_ai
+import chess_nnue
+from chess_engine import GameState
+
+
+@pytest.fixture
+def networkFile(tmp_path):
+    filename = str(tmp_path / 'network.npz')
+    chess_nnue.saveNetwork(filename, chess_nnue.makeNetworkWeights(
+        32, 8, seed=1))
+    yield filename
+    chess_ai.useNetwork(None)
+
+
+def getSearchScore(gs, depth):
+    gs.valid_moves = gs.get_valid_moves()
+    chess_ai.getBestMove(gs, depth)
+    return chess_ai.searchState.score
+
+
+def test_accumulator_matches_full_pass(networkFile):
+    chess_ai.useNetwork(networkFile)
+    network = chess_ai.network
+    gs = GameState()
+    rng = np.random.default_rng(0)
+    for _ in range(120):
+        moves = gs.get_valid_moves()
+        gs.find_mate(moves)
+        if gs.gameover:
+            break
+        gs.make_new_move(moves[rng.integers(len(moves))])
+        score = network.evaluate(gs.board.accumulator, gs.white_to_move)
+        full = network.evaluate_positions(chess_ai.encodeBoard(gs.board),
+                                          [gs.white_to_move])[0]
+        assert abs(score - full) < 1e-5
+
+
+def test_switching_evaluators_clears_search_results(networkFile):
+    gs = GameState()
+    expected = getSearchScore(gs, 2)
+    chess_ai.useNetwork(networkFile)
+    assert gs.board.accumulator is None
+    assert getSearchScore(gs, 2) != expected
+    chess_ai.useNetwork(None)
+    assert gs.board.accumulator is None
+    assert getSearchScore(gs, 2) == expected
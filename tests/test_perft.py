@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""Tests for the perft tool in chess_perft."""
+
+import pytest
+
+import chess_perft
+from chess_engine import GameState
+
+
+def test_perft_counts():
+    assert chess_perft.checkPerftPositions(maxDepth=2) == []
+
+
+def test_perft_leaves_no_undo_log():
+    fen = chess_perft.PERFT_POSITIONS['kiwipete'][0]
+    for table in (None, chess_perft.makePerftTable()):
+        gs = GameState(fen)
+        divide = chess_perft.dividePerft(gs, 3, table)
+        assert sum(divide.values()) == 97862
+        assert gs.undo_log == []
+
+
+def test_perft_depth_zero_is_rejected():
+    fen = chess_perft.PERFT_POSITIONS['start'][0]
+    with pytest.raises(ValueError):
+        chess_perft.runPerft(fen, 0)
+
+
+def test_small_perft_table_gives_right_counts():
+    fen, counts = chess_perft.PERFT_POSITIONS['kiwipete']
+    table = chess_perft.makePerftTable(16)
+    assert chess_perft.perft(GameState(fen), 3, table) == counts[2]
+    assert len(table.entries) == 16
+
+
+
+def test_parallel_perft_matches_divide():
+    fen = chess_perft.PERFT_POSITIONS['position3'][0]
+    expected = chess_perft.runPerft(fen, 3).divide
+    for splitDepth in (1, 2):
+        result = chess_perft.parallelPerft(fen, 3, 2, splitDepth)
+        assert result.divide == expected
+
+
+def test_perft_task_leaves_no_undo_log():
+    # A worker's task: the position after its moves, then perft below it.
+    fen = chess_perft.PERFT_POSITIONS['kiwipete'][0]
+    gs = GameState(fen)
+    gs.make_move(chess_perft.findMove(gs, 'e2a6'))
+    nodes = chess_perft.perft(gs, 2, chess_perft.makePerftTable())
+    assert nodes == chess_perft.runPerft(fen, 3).divide['e2a6']
+    assert gs.undo_log == []
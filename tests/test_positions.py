@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""Tests for the random position generator in chess_positions."""
+
+import numpy as np
+import pytest
+
+import chess_positions
+
+
+def test_no_king_in_check():
+    for gs in chess_positions.makeRandomGameStates('KRBPvKQN', 200, seed=0):
+        for king in (gs.board.white_king, gs.board.black_king):
+            assert not gs.get_pins_and_checks(king)[1]
+
+
+def test_same_seed_gives_same_placements():
+    first, firstSides = chess_positions.generateRandomPlacements(
+        'KRPvKR', 50, seed=7)
+    more, moreSides = chess_positions.generateRandomPlacements(
+        'KRPvKR', 80, seed=7)
+    assert np.array_equal(first, more[:50])
+    assert np.array_equal(firstSides, moreSides[:50])
+
+
+def test_no_placements():
+    placements, sides = chess_positions.generateRandomPlacements('KRPvKR', 0)
+    assert placements.shape == (0, 5) and sides.shape == (0,)
+    assert chess_positions.getRandomFENs('KQK', 0) == []
+
+
+def test_impossible_signature():
+    with pytest.raises(ValueError):
+        chess_positions.generateRandomPlacements('K' + 'Q' * 40 + 'vK', 1)
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""Tests for the self-play shards in chess_selfplay."""
+
+import os
+
+import numpy as np
+
+import chess_selfplay
+from chess_selfplay import ShardWriter, loadManifest, loadShard
+
+
+def makeRecords(keys, result=1.0):
+    count = len(keys)
+    return dict(
+        positions = np.zeros((count, 64), dtype=np.int8),
+        whiteToMove = np.ones(count, dtype=bool),
+        keys = np.array(keys, dtype=np.uint64),
+        scores = np.arange(count, dtype=np.float32),
+        results = np.full(count, result, dtype=np.float32),
+    )
+
+
+def test_shards_skip_repeated_positions(tmp_path):
+    directory = str(tmp_path)
+    writer = ShardWriter(directory, shardSize=3)
+    writer.add_game(0, makeRecords([1, 2, 1, 3]))
+    writer.add_game(1, makeRecords([3, 4]))
+    writer.close()
+    manifest = loadManifest(directory)
+    assert [shard['positions'] for shard in manifest['shards']] == [3, 2]
+    assert manifest['games'] == [0, 1]
+    first = loadShard(os.path.join(directory, manifest['shards'][0]['file']))
+    assert first['keys'].tolist() == [1, 2, 3]
+
+
+def test_unwritten_games_are_left_out_of_manifest(tmp_path):
+    directory = str(tmp_path)
+    writer = ShardWriter(directory, shardSize=3)
+    writer.add_game(0, makeRecords([1, 2]))
+    writer.add_game(1, makeRecords([3, 4]))  # 4 waits for the next shard.
+    assert loadManifest(directory)['games'] == [0]
+
+
+def test_self_play_resumes(tmp_path):
+    directory = str(tmp_path)
+    options = dict(processes=1, depth=1, maxPlies=12, randomPlies=8)
+    chess_selfplay.runSelfPlay(directory, 2, **options)
+    assert loadManifest(directory)['games'] == [0, 1]
+    manifest = chess_selfplay.runSelfPlay(directory, 3, **options)
+    assert manifest['games'] == [0, 1, 2]
+    positions = sum(len(loadShard(os.path.join(directory, shard['file']))
+                        ['keys']) for shard in manifest['shards'])
+    assert positions == manifest['positions']
@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+"""Tests for loading tuned evaluation weights."""
+
+import chess_ai
+
+
+def test_loading_weights_clears_search_results(tmp_path):
+    filename = tmp_path / 'eval_weights.json'
+    filename.write_text('{}')  # No terms, so the weights stay the same.
+    chess_ai.transpositionTable.store(12345, 3, 1.0, chess_ai.EXACT, 0)
+    chess_ai.evalCache.store(12345, 1.0)
+    chess_ai.loadEvalWeights(str(filename))
+    assert chess_ai.transpositionTable.probe(12345) is None
+    assert chess_ai.evalCache.probe(12345) is None